@@ -2,42 +2,84 @@
 """Calculate statistics of a 3D dataset."""
 import os
 import sys
+import math
 import argparse
-import imageio
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
-from PIL import Image, ImageChops
-from single_experiment_runner import load_organized_dataset, plot_slices
-from single_experiment_runner import limit_number_patients_per_label
 from matplotlib import pyplot as plt
-from keras.utils import np_utils
-from scipy.ndimage.morphology import binary_erosion
-from skimage import feature
 from scipy.stats import ks_2samp, iqr, expon
 sys.path.insert(0, 'create_datasets')
 from save_datasets import calculate_shared_axis, plot_boxplot, plot_histogram
 from save_datasets import save_plt_figures_to_pdf, analyze_data, simple_plot_histogram
 from parse_volumes_dataset import plot_pet_slice
-
-
-def get_statistics_mask(mask):
-    """Get size box and volume of mask where we can fit all 1s in contour."""
-    ones_pos = np.nonzero(mask)
-    eroded = binary_erosion(mask)
-    outer_mask = mask - eroded
-    volume = len(ones_pos[0])
-    surface = outer_mask.sum()
-    return surface, volume, ones_pos
-
-
-def get_glcm_statistics(volume):
-    """Get statistics realted to GLCM."""
-    # very technically, GLCMs are only defined in 2d and there is
-    # considerable disagreement as to how to translate them into 3d.
-    # the common practice for small, similar objects like yours
-    # therefore is to select typical images from the volume. this
-    # can be a few slices toward the middle and average or even just
-    # use the median slice. Here I am using the median slice
-    image_array = volume[:, :, int(volume.shape[2] / 2)]
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+GLCM_LEVELS = 16
+
+
+def get_statistics_mask(mask, x=None):
+    """Get size box and volume of mask where we can fit all 1s in contour.
+
+    When x is given, also return the values of x inside the mask (else None),
+    so callers do not need to scan the mask a second time.
+    """
+    from scipy.ndimage.morphology import binary_erosion
+    mask_bool = mask.astype(bool, copy=False)
+    eroded = binary_erosion(mask_bool)
+    surface = int(np.count_nonzero(mask_bool & ~eroded))
+    volume = int(np.count_nonzero(mask_bool))
+    masked_x = x[mask_bool] if x is not None else None
+    return surface, volume, masked_x
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def quantize_kernel(image_array, lo, inv_range, levels, out):
+        """Rescale one slice into [0, levels) with a single read/write pass."""
+        for r in range(image_array.shape[0]):
+            for c in range(image_array.shape[1]):
+                out[r, c] = np.uint8((image_array[r, c] - lo) * inv_range * (levels - 1) + 0.5)
+
+
+def quantize_image(image_array, levels, out=None):
+    """Downsample the gray shades of an image to [0, levels) as uint8."""
+    lo = image_array.min()
+    hi = image_array.max()
+    inv_range = 1.0 / (hi - lo)
+    if out is None:
+        out = np.empty(image_array.shape, dtype=np.uint8)
+    if NUMBA_AVAILABLE:
+        quantize_kernel(image_array.astype(np.float32, copy=False), np.float32(lo),
+                        np.float32(inv_range), levels, out)
+    else:
+        # single float32 temporary, modified in place, instead of a
+        # chain of float64 intermediates
+        scaled = image_array.astype(np.float32)
+        scaled -= lo
+        scaled *= inv_range * (levels - 1)
+        scaled += 0.5
+        np.floor(scaled, out=scaled)
+        out[...] = scaled
+    return out
+
+
+def get_glcm_statistics(image_array):
+    """Get statistics realted to GLCM of a 2D slice.
+
+    very technically, GLCMs are only defined in 2d and there is
+    considerable disagreement as to how to translate them into 3d.
+    the common practice for small, similar objects like yours
+    therefore is to select typical images from the volume. this
+    can be a few slices toward the middle and average or even just
+    use the median slice. The caller is expected to extract the
+    median slice once per patient and pass it here.
+    """
+    from skimage import feature
     # skimage will compute the GLCM for multiple pixel offsets
     # at once; we only need nearest neighbors so the offset is 1
     offsets = np.array([1]).astype(np.int)
@@ -52,48 +94,159 @@ def get_glcm_statistics(volume):
     # the shades to something reasonable. FYI: this is properly done
     # via histogram matching but no MD ever does this correctly. instead
     # they do (again, this is *INCORRECT* (but quite common in the field)):
-    LEVELS = 16
-    lo, hi = image_array.min(), image_array.max()
-    image_array = np.round((image_array - lo) / (hi - lo) * (LEVELS - 1)).astype(np.uint8)
+    LEVELS = GLCM_LEVELS
+    image_array = quantize_image(image_array, LEVELS)
     # Calculate co-matrix
     glcms = feature.greycomatrix(image_array, offsets, radians, LEVELS, symmetric=True,
                                  normed=True)
-    # compute the desired GLCM statistic
-    dissimil = feature.greycoprops(glcms, prop='dissimilarity')
-    # now that you have a GLCM for each offset and each direction, average over direction
-    # 0 because there is only one offset
-    dissimil = [dissimil[0, angle] for angle in range(radians.size)]
-    dissimil = np.mean(dissimil)
-    correlation = feature.greycoprops(glcms, prop='correlation')
-    correlation = [correlation[0, angle] for angle in range(radians.size)]
-    correlation = np.mean(correlation)
-    asm = feature.greycoprops(glcms, prop='ASM')
-    asm = [asm[0, angle] for angle in range(radians.size)]
-    asm = np.mean(asm)
+    # compute the desired GLCM statistics; now that you have a GLCM for each
+    # offset and each direction, average over direction (row 0 because there
+    # is only one offset)
+    dissimil = feature.greycoprops(glcms, prop='dissimilarity')[0].mean()
+    correlation = feature.greycoprops(glcms, prop='correlation')[0].mean()
+    asm = feature.greycoprops(glcms, prop='ASM')[0].mean()
     return dissimil, correlation, asm
 
 
+def merge_train_test(train, test):
+    """Merge train and test sets with a single preallocated copy."""
+    if isinstance(train, np.ndarray) and isinstance(test, np.ndarray):
+        merged = np.empty((len(train) + len(test),) + train.shape[1:], dtype=train.dtype)
+        merged[:len(train)] = train
+        merged[len(train):] = test
+        return merged
+    return list(train) + list(test)
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def glcm_batch(slices, levels):
+        """Compute normalized symmetric GLCMs of all slices in one parallel pass."""
+        num_slices, height, width = slices.shape
+        # same offsets as skimage for angles 0, 45, 90 and 135 degrees
+        delta_rows = np.array([0, 1, 1, 1])
+        delta_cols = np.array([1, 1, 0, -1])
+        out = np.zeros((num_slices, 4, levels, levels), dtype=np.float32)
+        for n in prange(num_slices):
+            counts = np.zeros((levels, levels), dtype=np.uint32)
+            for a in range(4):
+                counts[:, :] = 0
+                dr = delta_rows[a]
+                dc = delta_cols[a]
+                total = 0
+                for r in range(height):
+                    if r + dr < 0 or r + dr >= height:
+                        continue
+                    for c in range(width):
+                        if c + dc < 0 or c + dc >= width:
+                            continue
+                        i = slices[n, r, c]
+                        j = slices[n, r + dr, c + dc]
+                        counts[i, j] += 1
+                        counts[j, i] += 1
+                        total += 2
+                if total > 0:
+                    inv_total = 1.0 / total
+                    for i in range(levels):
+                        for j in range(levels):
+                            out[n, a, i, j] = counts[i, j] * inv_total
+        return out
+
+
+def glcm_batch_properties(glcms):
+    """Get dissimilarity, correlation and ASM of (N, angles, L, L) GLCMs.
+
+    Equivalent to skimage's greycoprops, vectorized over slices and
+    averaged over angles; returns three arrays with one value per slice.
+    """
+    levels = glcms.shape[-1]
+    idx = np.arange(levels, dtype=np.float64)
+    diff = np.abs(idx[:, None] - idx[None, :])
+    dissimil = (glcms * diff).sum(axis=(2, 3))
+    asm = (glcms * glcms).sum(axis=(2, 3))
+    p_row = glcms.sum(axis=3)
+    p_col = glcms.sum(axis=2)
+    mean_row = (p_row * idx).sum(axis=2)
+    mean_col = (p_col * idx).sum(axis=2)
+    var_row = (p_row * (idx - mean_row[..., None]) ** 2).sum(axis=2)
+    var_col = (p_col * (idx - mean_col[..., None]) ** 2).sum(axis=2)
+    covariance = (glcms * (idx[:, None] - mean_row[..., None, None]) *
+                  (idx[None, :] - mean_col[..., None, None])).sum(axis=(2, 3))
+    std_product = np.sqrt(var_row * var_col)
+    # like skimage, define correlation as 1 when one of the stds is ~0
+    correlation = np.ones_like(covariance)
+    valid = std_product > 1e-15
+    correlation[valid] = covariance[valid] / std_product[valid]
+    return dissimil.mean(axis=1), correlation.mean(axis=1), asm.mean(axis=1)
+
+
+def get_glcm_statistics_batch(slices_q):
+    """Get GLCM statistics of all median slices at once.
+
+    Expects slices already quantized to uint8 with quantize_image. Uses a
+    numba kernel that processes all patients in one parallel pass when numba
+    is installed, and falls back to per-slice skimage otherwise.
+    Returns three arrays (dissimilarity, correlation, asm), one value per slice.
+    """
+    if not NUMBA_AVAILABLE:
+        stats = [get_glcm_statistics(image_array) for image_array in slices_q]
+        return tuple(np.array(stat) for stat in zip(*stats))
+    glcms = glcm_batch(np.ascontiguousarray(slices_q), GLCM_LEVELS)
+    return glcm_batch_properties(glcms)
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def mean_std_kernel(flat):
+        """Accumulate sum and sum of squares in a single pass over the data."""
+        acc = 0.0
+        acc_sq = 0.0
+        for i in range(flat.size):
+            value = flat[i]
+            acc += value
+            acc_sq += value * value
+        mean = acc / flat.size
+        variance = max(acc_sq / flat.size - mean * mean, 0.0)
+        return mean, math.sqrt(variance)
+
+
+def extract_patient_features(params):
+    """Compute the scalar metrics of one patient (runs in a worker process)."""
+    x, y, m, factor = params
+    if factor:
+        x = x * 255
+    label = int(y[1])
+    flat = x.ravel()
+    if NUMBA_AVAILABLE:
+        mean, std_dev = mean_std_kernel(flat)
+    else:
+        std_dev = np.std(flat)
+        mean = np.mean(flat)
+    # partition instead of the full sort hidden inside np.median
+    half = flat.size // 2
+    if flat.size % 2:
+        median = np.partition(flat, half)[half]
+    else:
+        partitioned = np.partition(flat, [half - 1, half])
+        median = (partitioned[half - 1] + partitioned[half]) / 2
+    surface, volume, _ = get_statistics_mask(m)
+    return label, std_dev, mean, median, surface, volume
+
+
 def read_dataset(dataset_location, num_patients_per_label=None, slices_plot=False, plot=False):
     """Read and transfrom dataset."""
+    # deferred: importing single_experiment_runner loads keras, which is only
+    # needed when a dataset is actually read
+    from keras.utils import np_utils
+    from single_experiment_runner import load_organized_dataset, plot_slices
+    from single_experiment_runner import limit_number_patients_per_label
     train_set, test_set, train_aux, test_aux = load_organized_dataset(dataset_location)
     (x_train, y_train), (x_test, y_test), = train_set, test_set
     (patients_train, mask_train), (patients_test, mask_test) = train_aux, test_aux
-    try:
-        x_whole = np.append(x_train, x_test, axis=0)
-    except ValueError:
-        x_whole = x_train + x_test
-    try:
-        y_whole = np.append(y_train, y_test, axis=0)
-    except ValueError:
-        y_whole = y_train + y_test
-    try:
-        mask_whole = np.append(mask_train, mask_test, axis=0)
-    except ValueError:
-        mask_whole = mask_train + mask_test
-    try:
-        patients_whole = np.append(patients_train, patients_test, axis=0)
-    except ValueError:
-        patients_whole = patients_train + patients_test
+    x_whole = merge_train_test(x_train, x_test)
+    y_whole = merge_train_test(y_train, y_test)
+    mask_whole = merge_train_test(mask_train, mask_test)
+    patients_whole = merge_train_test(patients_train, patients_test)
     analyze_data(x_whole, y_whole, patients_whole, mask_whole, plot_data=plot, dataset_name=None)
 
     # Remove elements of the dataset if necessary
@@ -169,6 +322,8 @@ def parse_arguments():
                         help="multiply all data by 255")
     parser.add_argument('-pvi', '--plot_volume_histogram', default=False, action="store_true",
                         help="plot volume histogram and boxplots, and calculate volume metrics")
+    parser.add_argument('-fks', '--fast_ks', default=False, action="store_true",
+                        help="only run the sampled KS test, skip the full-data one")
     return parser.parse_args()
 
 
@@ -216,32 +371,48 @@ def plot_metric(data0, data1, label0="Metrics 0", label1="Metrics 1", label_all=
         plt.ioff()
 
 
-def calculate_similarity(list0, list1, num_samples=10000):
-    """Calculate similarity between 2 1d arrays with ks_2samp."""
-    similarity = ks_2samp(list0, list1)
+def calculate_similarity(list0, list1, num_samples=10000, full=True):
+    """Calculate similarity between 2 1d arrays with ks_2samp.
+
+    The full-data test sorts both arrays, which dominates runtime for
+    millions of voxels; past ~10000 samples the sampled statistic is
+    enough, so full=False skips the full-data test.
+    """
+    if full:
+        similarity = ks_2samp(list0, list1)
+        print("Similarity of all data (Shape: {} - {}):\n  {}".format(np.shape(list0),
+                                                                      np.shape(list1),
+                                                                      similarity))
     list0_sampled = np.random.choice(list0, num_samples)
     list1_sampled = np.random.choice(list1, num_samples)
     similarity_sampled = ks_2samp(list0_sampled, list1_sampled)
-    print("Similarity of all data (Shape: {} - {}):\n  {}".format(np.array(list0).shape,
-                                                                  np.array(list1).shape,
-                                                                  similarity))
     print("Similarity after sampling data ({} samples):\n  {}".format(num_samples,
                                                                       similarity_sampled))
 
 
 def remove_background_color(im):
     """Remove background frame in an image."""
-    bg = Image.new(im.mode, im.size, im.getpixel((0, 0)))
-    diff = ImageChops.difference(im, bg)
-    diff = ImageChops.add(diff, diff, 2.0, -100)
-    bbox = diff.getbbox()
-    if bbox:
-        return im.crop(bbox)
-    return im
+    arr = np.asarray(im)
+    background = arr[0, 0]
+    content = np.any(arr != background, axis=-1)
+    cols = np.where(content.any(axis=0))[0]
+    rows = np.where(content.any(axis=1))[0]
+    if len(cols) == 0 or len(rows) == 0:
+        return im
+    return im.crop((cols[0], rows[0], cols[-1] + 1, rows[-1] + 1))
+
+
+def figure_to_image(fig):
+    """Convert a rendered matplotlib figure to a PIL image without a PNG round-trip."""
+    from PIL import Image
+    fig.canvas.draw()
+    return Image.frombytes("RGB", fig.canvas.get_width_height(), fig.canvas.tostring_rgb())
 
 
 def save_images_median_slice(x_whole, y_whole, mask_whole, patients_whole):
     """Save every median slice as an image with and without mask, and image with all medians."""
+    import imageio
+    from PIL import Image
     folder = "median_images"
     try:
         os.mkdir(folder)
@@ -262,8 +433,8 @@ def save_images_median_slice(x_whole, y_whole, mask_whole, patients_whole):
         w = int(np.ceil(np.sqrt(len(labels))))
         if w * h < len(labels):
             h += 1
-    result = None
-    result_mask = None
+    canvas = None
+    canvas_mask = None
     img_w = None
     img_h = None
     for i, idx in enumerate(order):
@@ -274,22 +445,26 @@ def save_images_median_slice(x_whole, y_whole, mask_whole, patients_whole):
         plot_pet_slice(x, mask=None, center=int(x.shape[2] / 2), label=filename, figure=0,
                        square_pixels=True, show_axis=False, quit_immediately=True)
         plt.savefig(image_path, bbox_inches='tight')
+        # grab the rendered canvas for the mosaic instead of decoding the saved PNG
+        img = remove_background_color(figure_to_image(plt.figure(0)))
         plot_pet_slice(x, mask=m, center=int(x.shape[2] / 2), label=filename, figure=1,
                        square_pixels=True, show_axis=False, quit_immediately=True)
         plt.savefig(mask_path, bbox_inches='tight')
-        img = remove_background_color(Image.open(image_path))
-        if result is None:
+        img_mask = remove_background_color(figure_to_image(plt.figure(1)))
+        if canvas is None:
             img_w, img_h = img.size
-            result = Image.new("RGB", (img_w * w, img_h * h))
-            result_mask = Image.new("RGB", (img_w * w, img_h * h))
+            canvas = np.zeros((img_h * h, img_w * w, 3), dtype=np.uint8)
+            canvas_mask = np.zeros((img_h * h, img_w * w, 3), dtype=np.uint8)
         coords_x = (i // h) * img_w
         coords_y = (i % h) * img_h
-        result.paste(img, (coords_x, coords_y, coords_x + img_w, coords_y + img_h))
-        img_mask = remove_background_color(Image.open(mask_path))
-        result_mask.paste(img_mask, (coords_x, coords_y, coords_x + img_w, coords_y + img_h))
-    result.save("{}/{}.png".format(folder, "all_patients"))
-    result_mask.save("{}/{}.png".format(folder, "all_patients_masked"))
-    gif_list = [np.array(result)] * 5 + [np.array(result_mask)]
+        # one slice assignment per cell instead of a PIL paste
+        cell = np.asarray(img)[:img_h, :img_w]
+        canvas[coords_y:coords_y + cell.shape[0], coords_x:coords_x + cell.shape[1]] = cell
+        cell = np.asarray(img_mask)[:img_h, :img_w]
+        canvas_mask[coords_y:coords_y + cell.shape[0], coords_x:coords_x + cell.shape[1]] = cell
+    Image.fromarray(canvas).save("{}/{}.png".format(folder, "all_patients"))
+    Image.fromarray(canvas_mask).save("{}/{}.png".format(folder, "all_patients_masked"))
+    gif_list = [canvas] * 5 + [canvas_mask]
     imageio.mimsave("{}/{}.gif".format(folder, "all_patients"), gif_list, duration=0.4)
     plt.close("all")
 
@@ -320,8 +495,7 @@ def main():
     if args.plot_volume_histogram:
         volumes = [[], []]
         for x, y, m, p in zip(x_whole, y_whole, mask_whole, patients_whole):
-            ones_pos = np.nonzero(m)
-            volumes[int(y[1])].append(len(ones_pos[0]))
+            volumes[int(y[1])].append(int(np.count_nonzero(m)))
         volume_factor = 4.07283 * 4.07283 * 5.0 / (10 ** 3)
         print("Volumes Statistics:")
         for i, v in enumerate(volumes):
@@ -350,11 +524,12 @@ def main():
         rX = np.linspace(0, x_axis[-1] / 12 * 13, 100)
         rP = expon.pdf(rX, *P)
         plt.xlabel("Volume (px)")
-        sorted_data = sorted(all_volumes)
-        first = int(np.round(len(sorted_data) * 0.1))
-        last = int(np.round(len(sorted_data) * 0.9))
-        plt.axvline(x=sorted_data[first], color="#eced22", ls="--", lw=2, label="10 % limit")
-        plt.axvline(x=sorted_data[last], color="#e62728", ls="--", lw=2, label="90 % limit")
+        # partitioning selects the two percentile values without a full sort
+        first = int(np.round(len(all_volumes) * 0.1))
+        last = int(np.round(len(all_volumes) * 0.9))
+        limits = np.partition(all_volumes, [first, last])
+        plt.axvline(x=limits[first], color="#eced22", ls="--", lw=2, label="10 % limit")
+        plt.axvline(x=limits[last], color="#e62728", ls="--", lw=2, label="90 % limit")
         plt.plot(rX, rP, label="Exponential", lw=2)
         plt.legend()
         # Units: cc
@@ -367,11 +542,9 @@ def main():
         rX = np.linspace(0, x_axis[-1] / 12 * 13, 100)
         rP = expon.pdf(rX, *P)
         plt.xlabel("Volume (cc)")
-        sorted_data = sorted(all_volumes)
-        first = int(np.round(len(sorted_data) * 0.1))
-        last = int(np.round(len(sorted_data) * 0.9))
-        plt.axvline(x=sorted_data[first], color="#eced22", ls="--", lw=2, label="10 % limit")
-        plt.axvline(x=sorted_data[last], color="#e62728", ls="--", lw=2, label="90 % limit")
+        limits = np.partition(all_volumes, [first, last])
+        plt.axvline(x=limits[first], color="#eced22", ls="--", lw=2, label="10 % limit")
+        plt.axvline(x=limits[last], color="#e62728", ls="--", lw=2, label="90 % limit")
         plt.plot(rX, rP, label="Exponential", lw=2)
         plt.legend()
         # Boxplots
@@ -402,13 +575,50 @@ def main():
         "glcm_dissimilarity": [], "glcm_correlation": [], "glcm_asm": []
     }]
     patients = set()
-    gray_values = [[], []]
-    masked_gray_values = [[], []]
-    dataset_x = []
-    dataset_y = []
+    # Count voxels per label in a first pass, so the intensity buffers can be
+    # preallocated and filled by slice instead of growing huge Python lists
+    counts = [0, 0]
+    masked_counts = [0, 0]
+    median_slices = []
+    mask_bools = []
+    for x, y, m in zip(x_whole, y_whole, mask_whole):
+        label = int(y[1])
+        counts[label] += x.size
+        mask_bool = m.astype(bool, copy=False)
+        masked_counts[label] += int(np.count_nonzero(mask_bool))
+        mask_bools.append(mask_bool)
+        median_slices.append(quantize_image(x[:, :, x.shape[2] // 2], GLCM_LEVELS))
+    # one contiguous (N, H, W) buffer so the batched kernel streams through it
+    median_slices = np.ascontiguousarray(np.stack(median_slices))
+    # GLCM statistics are computed for every patient in a single batch
+    glcm_stats = get_glcm_statistics_batch(median_slices)
+    # The scalar metrics are independent per patient: extract them in parallel
+    with ProcessPoolExecutor() as executor:
+        features = list(executor.map(extract_patient_features,
+                                     zip(x_whole, y_whole, mask_whole, repeat(args.factor)),
+                                     chunksize=4))
+    # disk-backed buffers keep the full-dataset KS test in bounded memory
+    gray_values = []
+    masked_gray_values = []
+    tmp_buffer_files = []
+    for buffer_label in range(2):
+        name = "tmp_gray_values_{}.dat".format(buffer_label)
+        gray_values.append(np.memmap(name, dtype=np.float32, mode="w+",
+                                     shape=(counts[buffer_label],)))
+        tmp_buffer_files.append(name)
+        name = "tmp_masked_gray_values_{}.dat".format(buffer_label)
+        masked_gray_values.append(np.memmap(name, dtype=np.float32, mode="w+",
+                                            shape=(masked_counts[buffer_label],)))
+        tmp_buffer_files.append(name)
+    gray_offsets = [0, 0]
+    masked_offsets = [0, 0]
+    dataset_x = np.empty((len(x_whole), 3), dtype=np.float32)
+    dataset_y = np.empty(len(x_whole), dtype=np.int8)
     dataset_info = ""
     biased_data = False
-    for i, (x, y, m, p) in enumerate(zip(x_whole, y_whole, mask_whole, patients_whole)):
+    for i in range(len(x_whole)):
+        x = x_whole[i]
+        p = patients_whole[i]
         if p in patients and not biased_data:
             input("Repeated patient '{}'. This should never happen.".format(p))
             input("This message won't be displayed again, but know that the data may be biased"
@@ -417,15 +627,17 @@ def main():
         if args.factor:
             x = x * 255
         patients.add(p)
-        label = int(y[1])
-        std_dev = np.std(x)
-        mean = np.mean(x)
-        median = np.median(x)
-        surface, volume, mask_positions = get_statistics_mask(m)
+        label, std_dev, mean, median, surface, volume = features[i]
         surf_to_vol = surface / volume
-        dissimilarity, correlation, asm = get_glcm_statistics(x)
-        gray_values[label].extend(list(x.flatten()))
-        masked_gray_values[label].extend(list(x[mask_positions]))
+        dissimilarity, correlation, asm = (glcm_stats[0][i], glcm_stats[1][i],
+                                           glcm_stats[2][i])
+        offset = gray_offsets[label]
+        gray_values[label][offset:offset + x.size] = x.ravel()
+        gray_offsets[label] = offset + x.size
+        masked = x[mask_bools[i]]
+        offset = masked_offsets[label]
+        masked_gray_values[label][offset:offset + masked.size] = masked
+        masked_offsets[label] = offset + masked.size
         if args.verbose:
             print("Label:              {}".format(label))
             print("Mean:               {}".format(mean))
@@ -445,20 +657,18 @@ def main():
         metrics[label]["glcm_asm"].append(asm)
         if args.save_dataset:
             dataset_info = "mean_std_volume"
-            dataset_x.append([mean, std_dev, volume])
-            dataset_y.append(label)
+            dataset_x[i] = (mean, std_dev, volume)
+            dataset_y[i] = label
 
     # Calculate how different samples are
     print("KS_2SAMP similarity for masked pixels only:")
-    calculate_similarity(masked_gray_values[0], masked_gray_values[1])
+    calculate_similarity(masked_gray_values[0], masked_gray_values[1], full=not args.fast_ks)
     print(" ")
     print("KS_2SAMP similarity for all pixels:")
-    calculate_similarity(gray_values[0], gray_values[1])
+    calculate_similarity(gray_values[0], gray_values[1], full=not args.fast_ks)
     print(" ")
 
     if args.save_dataset:
-        dataset_x = np.array(dataset_x)
-        dataset_y = np.array(dataset_y)
         print("Saving dataset with the following characteristics:")
         print("    Data saved: {}".format(dataset_info))
         print("    X shape:    {}".format(dataset_x.shape))
@@ -547,6 +757,14 @@ def main():
     if args.plot:
         input("Press ENTER to close all figures and continue.")
         plt.close("all")
+
+    # Remove the disk-backed intensity buffers
+    del gray_values, masked_gray_values
+    for name in tmp_buffer_files:
+        try:
+            os.remove(name)
+        except OSError:
+            pass
     print("For more detailed printed statistics, run 'calculate_labels_differences.py'")
 
 
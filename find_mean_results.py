@@ -2,6 +2,7 @@
 import matplotlib_handle_display  # Must be imported before anything matplotlib related
 import numpy as np
 import os
+from glob import glob
 import pickle
 from prettytable import PrettyTable
 from cycler import cycler
@@ -21,6 +22,38 @@ plt.rc('axes', prop_cycle=(cycler('color', ['#1f77b4', '#ff7f0e', '#2ca02c', '#d
                            cycler('linestyle', ['-'] * 10 + ['--'] * 10)))
 
 
+def load_results(filename):
+    """Load a results pickle saved by single_experiment_runner.
+
+    Handles both the old format (the whole list in one dump) and the newer
+    one, which streams one record per combination. Runs that used
+    --parallel_comb leave one part file per instance (results*.pidN.pkl);
+    those are found next to filename and their records merged. Records are
+    returned sorted by combination, so files from runs that claimed the
+    combinations in different orders still line up with each other.
+    """
+    filenames = [filename] if os.path.exists(filename) else []
+    root, ext = os.path.splitext(filename)
+    filenames += sorted(glob(root + ".pid*" + ext))
+    if len(filenames) == 0:
+        raise FileNotFoundError(filename)
+    all_data = []
+    for name in filenames:
+        with open(name, 'rb') as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                if isinstance(record, list):  # Old format: the whole list at once
+                    all_data.extend(record)
+                else:
+                    all_data.append(record)
+    # Each record is (comb, ...); comb is a tuple of numbers
+    all_data.sort(key=lambda record: record[0])
+    return all_data
+
+
 def main(filename1=None, filename2=None, filename3=None, destination_folder=None):
     """Load data from 3 files previoulsy saved with single_experiment_runner and save mean.
 
@@ -30,21 +63,18 @@ def main(filename1=None, filename2=None, filename3=None, destination_folder=None
     if filename1 is None:
         filename1 = ("nn_models1_corrected/results_create_datasets-data-custom_lumpy_dataset_v3_"
                      "0-8192_mos_trimmed2-filters-units-dropout2.pkl")
-    with open(filename1, 'rb') as f:
-        all_data1 = pickle.load(f)
-        print("File 1 loaded from: '{}'".format(filename1))
+    all_data1 = load_results(filename1)
+    print("File 1 loaded from: '{}'".format(filename1))
     if filename2 is None:
         filename2 = ("nn_models2_corrected/results_create_datasets-data-custom_lumpy_dataset_v3_"
                      "0-8192_mos_trimmed2-filters-units-dropout2.pkl")
-    with open(filename2, 'rb') as f:
-        all_data2 = pickle.load(f)
-        print("File 2 loaded from: '{}'".format(filename2))
+    all_data2 = load_results(filename2)
+    print("File 2 loaded from: '{}'".format(filename2))
     if filename3 is None:
         filename3 = ("nn_models3_corrected/results_create_datasets-data-custom_lumpy_dataset_v3_"
                      "0-8192_mos_trimmed2-filters-units-dropout2.pkl")
-    with open(filename3, 'rb') as f:
-        all_data3 = pickle.load(f)
-        print("File 3 loaded from: '{}'".format(filename3))
+    all_data3 = load_results(filename3)
+    print("File 3 loaded from: '{}'".format(filename3))
 
     if destination_folder is None:
         destination_folder = "medians123_corrected"
@@ -90,6 +120,9 @@ def main(filename1=None, filename2=None, filename3=None, destination_folder=None
         comb1, all_cv1, all_train1, all_pat1, history1, rocs1 = params1
         comb2, all_cv2, all_train2, all_pat2, history2, rocs2 = params2
         comb3, all_cv3, all_train3, all_pat3, history3, rocs3 = params3
+        if comb1 != comb2 or comb1 != comb3:
+            raise Exception("Error. The three files do not hold the same combinations: "
+                            "{} vs {} vs {}".format(comb1, comb2, comb3))
         comb = comb1
         combs.append(comb)
 
@@ -275,6 +308,9 @@ def main(filename1=None, filename2=None, filename3=None, destination_folder=None
         comb1, all_cv1, all_train1, all_pat1, history1, rocs1 = params1
         comb2, all_cv2, all_train2, all_pat2, history2, rocs2 = params2
         comb3, all_cv3, all_train3, all_pat3, history3, rocs3 = params3
+        if comb1 != comb2 or comb1 != comb3:
+            raise Exception("Error. The three files do not hold the same combinations: "
+                            "{} vs {} vs {}".format(comb1, comb2, comb3))
         comb = comb1
         combs.append(comb)
 
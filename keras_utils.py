@@ -264,7 +264,13 @@ def flexible_neural_net(train_set, test_set, optimizer, loss, *layers, batch_siz
     else:
         callbacks = [callback(location)]
     if early_stopping is not None and early_stopping > 0:
-        callbacks.append(EarlyStopping(monitor="val_loss", patience=early_stopping, verbose=True))
+        try:
+            callbacks.append(EarlyStopping(monitor="val_loss", patience=early_stopping,
+                                           min_delta=1e-4, restore_best_weights=True,
+                                           verbose=True))
+        except TypeError:  # Keras < 2.2.3 cannot restore the best weights
+            callbacks.append(EarlyStopping(monitor="val_loss", patience=early_stopping,
+                                           min_delta=1e-4, verbose=True))
 
     # Create model and add layers
     model = Sequential()
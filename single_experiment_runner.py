@@ -1,12 +1,28 @@
 #!/usr/bin/env python3.5
 import matplotlib_handle_display  # Must be imported before anything matplotlib related
+import matplotlib
 import argparse
+import functools
+import gc
+import hashlib
+import io
+import json
 import itertools
 import os
 import pickle
 import sys
+
+# Batch runs never open a window, so render with Agg even when a display
+# exists: it skips GUI canvas creation and event dispatch on every figure().
+# Only when this file is the entry script: importers (e.g. the dataset
+# statistics script) plot interactively with their own flags, and
+# matplotlib_handle_display above already picked Agg if there is no display
+if __name__ == "__main__" and not any(flag in sys.argv
+                                      for flag in ("-p", "--plot", "-ps", "--plot_slices")):
+    matplotlib.use("Agg")
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from time import clock
+from time import perf_counter
 from cycler import cycler
 from matplotlib import pyplot as plt
 import matplotlib.image as mpimg
@@ -15,14 +31,25 @@ from collections import Counter
 
 import numpy as np
 from keras import losses, optimizers
-from keras.layers import Conv2D, Dense, Dropout, Flatten, MaxPooling2D
+from keras.layers import (Conv2D, Dense, Dropout, Flatten, GlobalAveragePooling2D,
+                          MaxPooling2D)
 from keras.utils import np_utils
-from sklearn.metrics import classification_report, confusion_matrix, roc_curve, auc
 
 from keras_utils import flexible_neural_net
 sys.path.insert(0, 'create_datasets')
 from save_datasets import analyze_data
 
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+# Headless batch runs (Agg backend) never need the interactive machinery:
+# ion/show/draw become no-ops so savefig paths skip event-loop bring-up.
+# Compared with ==, not endswith: TkAgg/Qt5Agg are interactive backends
+BATCH_MODE = matplotlib.get_backend().lower() == "agg"
 
 # Cycle colors from normal line to dotted line (allows to tell 20 plots apart)
 plt.rc('axes', prop_cycle=(cycler('color', ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728',
@@ -33,39 +60,73 @@ plt.rc('axes', prop_cycle=(cycler('color', ['#1f77b4', '#ff7f0e', '#2ca02c', '#d
                            cycler('linestyle', ['-'] * 10 + ['--'] * 10)))
 
 
+@functools.lru_cache(maxsize=128)
+def grid_shape(num_curves, grow_height=False):
+    """Get the (h, w) subplot layout the multi-plot helpers use."""
+    if num_curves % 5 == 0:
+        return num_curves // 5, 5
+    h = int(np.floor(np.sqrt(num_curves)))
+    w = int(np.ceil(np.sqrt(num_curves)))
+    if grow_height:
+        if w * h < num_curves:
+            h += 1
+    else:
+        while w * h < num_curves:
+            w += 1
+    return h, w
+
+
+def get_figure(fig_num, figsize=None):
+    """Reuse the live Figure for fig_num instead of building a new one.
+
+    Reusing keeps the canvas and renderer warm across plotting calls; on
+    reuse the figure is resized to figsize (plt.figure would silently ignore
+    a changed figsize for an existing figure).
+    """
+    if plt.fignum_exists(fig_num):
+        fig = plt.figure(fig_num)
+        if figsize is not None:
+            fig.set_size_inches(figsize, forward=False)
+        return fig
+    if figsize is not None:
+        return plt.figure(fig_num, figsize=figsize)
+    return plt.figure(fig_num)
+
+
 def plot_slices(volume, title=None, fig_num=0, filename=None, show=True):
     """Plot all slices of volume in one figure."""
     # Plot epoch history for accuracy and loss
-    if filename is None and show:
+    if filename is None and show and not BATCH_MODE:
         plt.ion()
     num_curves = volume.shape[2]
-    if num_curves % 5 == 0:
-        h = int(num_curves / 5)
-        w = 5
-    else:
-        h = int(np.floor(np.sqrt(num_curves)))
-        w = int(np.ceil(np.sqrt(num_curves)))
-        while w * h < num_curves:
-            w += 1
-    fig = plt.figure(fig_num, figsize=(1.5 * w, 1.2 * h))
-    vmin = np.min(volume)
-    vmax = np.max(volume)
+    h, w = grid_shape(num_curves)
+    fig = get_figure(fig_num, figsize=(1.5 * w, 1.2 * h))
+    vmin = volume.min()
+    vmax = volume.max()
     cmap = plt.cm.gray
     plt.clf()
     for i in range(num_curves):
         subfig = fig.add_subplot(h, w, i + 1)
-        subfig.pcolormesh(volume[:, :, i], vmin=vmin, vmax=vmax, cmap=cmap)
+        # imshow blits one bitmap per slice; pcolormesh built a QuadMesh
+        # with one quad per pixel
+        subfig.imshow(volume[:, :, i], vmin=vmin, vmax=vmax, cmap=cmap,
+                      interpolation='nearest', aspect='auto', origin='lower')
         subfig.axis('off')
     if title is not None:
         # fig.suptitle(title)
         fig.canvas.set_window_title("Figure {} - {}".format(fig_num, title))
     if filename is None:
-        if show:
+        if show and not BATCH_MODE:
             plt.show()
             plt.ioff()
     else:
-        fig.savefig(filename, bbox_inches="tight")
-        fig.clear()
+        # tight_layout + plain savefig renders once; bbox_inches="tight"
+        # would render every figure twice (once just to measure the bbox)
+        fig.tight_layout()
+        fig.savefig(filename)
+        # Close (not just clear) so the figure manager is released and
+        # save_plt_figures_to_pdf's get_fignums sweep never re-collects it
+        plt.close(fig)
 
 
 def plot_accuracy_curve(acc, val_acc=None, title=None, fig_num=0, filename=None, show=True):
@@ -74,11 +135,11 @@ def plot_accuracy_curve(acc, val_acc=None, title=None, fig_num=0, filename=None,
     If filename is None, the figure will be shown, otherwise it will be saved with name filename
     """
     # Plot epoch history for accuracy and loss
-    if filename is None and show:
+    if filename is None and show and not BATCH_MODE:
         plt.ion()
-    fig = plt.figure(fig_num)
+    fig = get_figure(fig_num)
     subfig = fig.add_subplot(111)
-    x_pts = range(1, len(acc) + 1)
+    x_pts = np.arange(1, len(acc) + 1)
     subfig.plot(x_pts, acc, label="training")
     if val_acc is not None:
         subfig.plot(x_pts, val_acc, label="validation")
@@ -89,12 +150,17 @@ def plot_accuracy_curve(acc, val_acc=None, title=None, fig_num=0, filename=None,
     subfig.set_xlabel("Epoch")
     plt.legend()
     if filename is None:
-        if show:
+        if show and not BATCH_MODE:
             plt.show()
             plt.ioff()
     else:
-        fig.savefig(filename, bbox_inches="tight")
-        fig.clear()
+        # tight_layout + plain savefig renders once; bbox_inches="tight"
+        # would render every figure twice (once just to measure the bbox)
+        fig.tight_layout()
+        fig.savefig(filename)
+        # Close (not just clear) so the figure manager is released and
+        # save_plt_figures_to_pdf's get_fignums sweep never re-collects it
+        plt.close(fig)
 
 
 def plot_multiple_accuracy_curves(accs, val_accs=None, title=None, fig_num=0, filename=None,
@@ -104,55 +170,49 @@ def plot_multiple_accuracy_curves(accs, val_accs=None, title=None, fig_num=0, fi
     If filename is None, the figure will be shown, otherwise it will be saved with name filename
     """
     # Plot epoch history for accuracy and loss
-    if filename is None and show:
+    if filename is None and show and not BATCH_MODE:
         plt.ion()
     num_curves = len(accs)
-    if num_curves % 5 == 0:
-        h = int(num_curves / 5)
-        w = 5
-    else:
-        h = int(np.floor(np.sqrt(num_curves)))
-        w = int(np.ceil(np.sqrt(num_curves)))
-        if w * h < num_curves:
-            h += 1
-    fig = plt.figure(fig_num, figsize=(8 * w, 6 * h))
+    h, w = grid_shape(num_curves, grow_height=True)
+    fig = get_figure(fig_num, figsize=(8 * w, 6 * h))
+    if val_accs is None:
+        # fast path: no validation curves at all
+        val_accs = itertools.repeat(None)
     for i, (acc, val_acc) in enumerate(zip(accs, val_accs)):
         subfig = fig.add_subplot(h, w, i + 1)
-        x_pts = range(1, len(acc) + 1)
+        x_pts = np.arange(1, len(acc) + 1)
         subfig.plot(x_pts, acc, label="training")
         if val_acc is not None:
             subfig.plot(x_pts, val_acc, label="validation")
         subfig.set_xlabel("Epoch")
         if labels is not None:
             subfig.set_title(labels[i])
-        plt.legend()
+        subfig.legend()
     if title is None:
         title = "Model Accuracy History"
     fig.suptitle(title)
     fig.canvas.set_window_title("Figure {} - {}".format(fig_num, title))
     if filename is None:
-        if show:
+        if show and not BATCH_MODE:
             plt.show()
             plt.ioff()
     else:
-        fig.savefig(filename, bbox_inches="tight")
-        fig.clear()
+        # tight_layout + plain savefig renders once; bbox_inches="tight"
+        # would render every figure twice (once just to measure the bbox)
+        fig.tight_layout()
+        fig.savefig(filename)
+        # Close (not just clear) so the figure manager is released and
+        # save_plt_figures_to_pdf's get_fignums sweep never re-collects it
+        plt.close(fig)
 
 
 def plot_multiple_roc_curves(rocs, title=None, fig_num=0, filename=None, show=True, labels=None):
     """Docstring for plot_multiple_roc_curves."""
-    if filename is None and show:
+    if filename is None and show and not BATCH_MODE:
         plt.ion()
     num_curves = len(rocs)
-    if num_curves % 5 == 0:
-        h = int(num_curves / 5)
-        w = 5
-    else:
-        h = int(np.floor(np.sqrt(num_curves)))
-        w = int(np.ceil(np.sqrt(num_curves)))
-        if w * h < num_curves:
-            h += 1
-    fig = plt.figure(fig_num, figsize=(8 * w, 6 * h))
+    h, w = grid_shape(num_curves, grow_height=True)
+    fig = get_figure(fig_num, figsize=(8 * w, 6 * h))
     for j, (fpr, tpr, roc_auc) in enumerate(rocs):
         subfig = fig.add_subplot(h, w, j + 1)
         for i, color in zip(range(2), ['aqua', 'darkorange']):
@@ -171,19 +231,24 @@ def plot_multiple_roc_curves(rocs, title=None, fig_num=0, filename=None, show=Tr
     fig.suptitle(title)
     fig.canvas.set_window_title("Figure {} - {}".format(fig_num, title))
     if filename is None:
-        if show:
+        if show and not BATCH_MODE:
             plt.show()
             plt.ioff()
     else:
-        fig.savefig(filename, bbox_inches="tight")
-        fig.clear()
+        # tight_layout + plain savefig renders once; bbox_inches="tight"
+        # would render every figure twice (once just to measure the bbox)
+        fig.tight_layout()
+        fig.savefig(filename)
+        # Close (not just clear) so the figure manager is released and
+        # save_plt_figures_to_pdf's get_fignums sweep never re-collects it
+        plt.close(fig)
 
 
 def plot_roc_curve(fpr, tpr, roc_auc, title=None, fig_num=0, filename=None, show=True):
     """Plot roc curve for label 0 and 1."""
-    if filename is None and show:
+    if filename is None and show and not BATCH_MODE:
         plt.ion()
-    fig = plt.figure(fig_num)
+    fig = get_figure(fig_num)
     subfig = fig.add_subplot(111)
     # Plot ROC curves
     for i in range(2):
@@ -201,27 +266,90 @@ def plot_roc_curve(fpr, tpr, roc_auc, title=None, fig_num=0, filename=None, show
     subfig.set_xlabel("Epoch")
     plt.legend()
     if filename is None:
-        if show:
+        if show and not BATCH_MODE:
             plt.show()
             plt.ioff()
     else:
-        fig.savefig(filename, bbox_inches="tight")
-        fig.clear()
+        # tight_layout + plain savefig renders once; bbox_inches="tight"
+        # would render every figure twice (once just to measure the bbox)
+        fig.tight_layout()
+        fig.savefig(filename)
+        # Close (not just clear) so the figure manager is released and
+        # save_plt_figures_to_pdf's get_fignums sweep never re-collects it
+        plt.close(fig)
+
+
+# Pool and pending futures used to write figures without blocking training
+_figure_pool = None
+_pending_figure_saves = []
+
+
+def _get_figure_pool():
+    """Return the lazily created process pool that writes figures."""
+    global _figure_pool
+    if _figure_pool is None:
+        _figure_pool = ProcessPoolExecutor(max_workers=2)
+    return _figure_pool
+
+
+def _render_figures_to_pdf(filename, figs, bbox_inches=None):
+    """Render figs into one PDF, buffering the whole document in memory.
+
+    Page compression happens against a BytesIO buffer and the assembled
+    document is flushed to disk with a single write, instead of dribbling
+    each page into the file as it is rendered.
+    """
+    buffer = io.BytesIO()
+    pp = PdfPages(buffer)
+    for fig in figs:
+        fig.savefig(pp, format='pdf', bbox_inches=bbox_inches)
+    pp.close()
+    with open(filename, 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+def _write_figures_to_pdf(filename, pickled_figs, bbox_inches=None):
+    """Unpickle figures and write them into one PDF (runs in a worker process)."""
+    _render_figures_to_pdf(filename, pickle.loads(pickled_figs), bbox_inches)
+    print("PDF file saved in '{}'.".format(filename))
 
 
-def save_plt_figures_to_pdf(filename, figs=None, dpi=200):
-    """Save all matplotlib figures in a single PDF file."""
+def wait_for_figure_saves():
+    """Block until every background PDF write has finished."""
+    for future in _pending_figure_saves:
+        future.result()
+    del _pending_figure_saves[:]
+
+
+def save_plt_figures_to_pdf(filename, figs=None, dpi=200, bbox_inches=None, async_save=False,
+                            close=False):
+    """Save all matplotlib figures in a single PDF file.
+
+    With async_save the figures are pickled immediately (so the caller may
+    clear them) and rendered in a worker process, overlapping the PDF write
+    with whatever the caller does next; use wait_for_figure_saves() to drain.
+    With close, every saved figure is closed afterwards so long batch runs
+    do not accumulate canvases across experiments.
+    """
     dirname = os.path.dirname(filename)
     try:
         os.makedirs(dirname)
     except OSError:
         pass
-    pp = PdfPages(filename)
     if figs is None:
         figs = [plt.figure(n) for n in plt.get_fignums()]
-    for fig in figs:
-        fig.savefig(pp, format='pdf')
-    pp.close()
+    if async_save:
+        _pending_figure_saves.append(
+            _get_figure_pool().submit(_write_figures_to_pdf, filename, pickle.dumps(figs),
+                                      bbox_inches))
+        if close:
+            for fig in figs:
+                plt.close(fig)
+        return
+    _render_figures_to_pdf(filename, figs, bbox_inches)
+    if close:
+        for fig in figs:
+            plt.close(fig)
     print("PDF file saved in '{}'.".format(filename))
 
 
@@ -231,8 +359,10 @@ def plot_image(location, title=None, fig_num=0, show=True):
     if show:
         plt.ion()
     fig = plt.figure(fig_num, figsize=(8 * 2, 6 * 2), dpi=300)
-    plt.imshow(img)
-    plt.axis("off")
+    # figimage copies the raw pixels once; imshow would push the already
+    # rasterized PNG through its resampling pipeline again
+    fig.clf()
+    fig.figimage(img, resize=True)
     if title is not None:
         fig.suptitle(title)
         fig.canvas.set_window_title("Figure {} - {}".format(fig_num, title))
@@ -245,27 +375,20 @@ def transform_curves_to_plot(y_pts, x_pts):
     """Transform lists to format that pyplot will print them.
 
     Transforms this: [[1,2,3,4], [5,6,7,8]] into [[1,5], [2,6], [3,7], [4,8]]
+    Shorter rows are padded by repeating their last point.
     """
-    new_y_pts = []
-    new_x_pts = []
-    last_row = max([len(row) for row in y_pts])
-    for i, row in enumerate(y_pts):
-        for j, y in enumerate(row):
-            try:
-                new_y_pts[j].append(y)
-                new_x_pts[j].append(x_pts[i][j])
-            except IndexError:
-                new_y_pts.append([y])
-                new_x_pts.append([x_pts[i][j]])
-        x = x_pts[i][j]
-        while j < last_row:
-            j += 1
-            try:
-                new_y_pts[j].append(y)
-                new_x_pts[j].append(x)
-            except IndexError:
-                new_y_pts.append([y])
-                new_x_pts.append([x])
+    # zip_longest transposes in C; the None gaps of shorter rows are then
+    # filled with each row's last point (no exception-driven inner loop)
+    new_y_pts = [list(col) for col in itertools.zip_longest(*y_pts)]
+    new_x_pts = [list(col) for col in itertools.zip_longest(*x_pts)]
+    for col_y, col_x in zip(new_y_pts, new_x_pts):
+        for i, y in enumerate(col_y):
+            if y is None:
+                col_y[i] = y_pts[i][-1]
+                col_x[i] = x_pts[i][-1]
+    # like the original implementation, repeat the final row of points once
+    new_y_pts.append([row[-1] for row in y_pts])
+    new_x_pts.append([row[-1] for row in x_pts])
     return (new_y_pts, new_x_pts)
 
 
@@ -289,12 +412,9 @@ def plot_line(y_pts, x_pts=None, y_label=None, x_label=None, title=None, axis=No
     :param n_ticks: len2 list [ticks_x, tics_y] to select # ticks in both axis
     :param show: if False, the figure will not be shown. Only used if filename is None
     """
-    if filename is None and show:
+    if filename is None and show and not BATCH_MODE:
         plt.ion()
-    if figsize is not None:
-        fig = plt.figure(fig_num, figsize=figsize)
-    else:
-        fig = plt.figure(fig_num)
+    fig = get_figure(fig_num, figsize=figsize)
     ax = plt.subplot(111)
     if x_pts is None:
         if style is None:
@@ -370,14 +490,66 @@ def plot_line(y_pts, x_pts=None, y_label=None, x_label=None, title=None, axis=No
             plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
         else:
             plt.legend()
-    plt.draw()
+    if not BATCH_MODE:
+        plt.draw()
     if filename is None:
-        if show:
+        if show and not BATCH_MODE:
             plt.show()
             plt.ioff()
     else:
-        fig.savefig(filename, bbox_inches="tight")
-        fig.clear()
+        # tight_layout + plain savefig renders once; bbox_inches="tight"
+        # would render every figure twice (once just to measure the bbox)
+        fig.tight_layout()
+        fig.savefig(filename)
+        # Close (not just clear) so the figure manager is released and
+        # save_plt_figures_to_pdf's get_fignums sweep never re-collects it
+        plt.close(fig)
+
+
+def plot_lines(y_series, x_pts, labels, y_label=None, x_label=None, title=None, axis=None,
+               style=None, x_scale="linear", logbase=2, fig_num=0, show=True, n_ticks=None):
+    """Plot several curves sharing one x axis with a single matplotlib call.
+
+    y_series is a (num_points, num_series) array or a sequence of 1D arrays
+    (column-stacked here); all curves go through one ax.plot dispatch instead
+    of one plot_line call per curve.
+    """
+    if not isinstance(y_series, np.ndarray):
+        y_series = np.column_stack(y_series)
+    if show and not BATCH_MODE:
+        plt.ion()
+    fig = get_figure(fig_num)
+    ax = plt.subplot(111)
+    if style is None:
+        lines = ax.plot(x_pts, y_series)
+    else:
+        lines = ax.plot(x_pts, y_series, style)
+    for line, curve_label in zip(lines, labels):
+        line.set_label(curve_label)
+    if x_scale == "log":
+        ax.set_xscale(x_scale, basex=logbase)
+    elif x_scale != "linear":
+        ax.set_xscale(x_scale)
+    if y_label is not None:
+        ax.set_ylabel(y_label)
+    if x_label is not None:
+        ax.set_xlabel(x_label)
+    if title is not None:
+        plt.title(title)
+        fig.canvas.set_window_title("Figure {} - {}".format(fig_num, title))
+    if axis is not None:
+        plt.axis(axis)
+    if n_ticks is not None:
+        if n_ticks[0] is not None:
+            plt.locator_params(axis='x', nbins=n_ticks[0])
+        if n_ticks[1] is not None:
+            plt.locator_params(axis='y', nbins=n_ticks[1])
+    plt.legend()
+    if not BATCH_MODE:
+        plt.draw()
+    if show and not BATCH_MODE:
+        plt.show()
+        plt.ioff()
 
 
 def plot_binary_background(y_pts, first_x=0, y_label=None, x_label=None, title=None, axis=None,
@@ -401,9 +573,9 @@ def plot_binary_background(y_pts, first_x=0, y_label=None, x_label=None, title=N
     :param min_max_values: plot values from min_max_values[0] to min_max_values[1]
     :param alpha: transparency of bars
     """
-    if filename is None and show:
+    if filename is None and show and not BATCH_MODE:
         plt.ion()
-    fig = plt.figure(fig_num)
+    fig = get_figure(fig_num)
     new_y = []
     new_x = []
     prev = 0
@@ -453,14 +625,48 @@ def plot_binary_background(y_pts, first_x=0, y_label=None, x_label=None, title=N
         if n_ticks[1] is not None:
             plt.locator_params(axis='y', nbins=n_ticks[1])
     plt.legend()
-    plt.draw()
+    if not BATCH_MODE:
+        plt.draw()
     if filename is None:
-        if show:
+        if show and not BATCH_MODE:
             plt.show()
             plt.ioff()
     else:
-        fig.savefig(filename, bbox_inches="tight")
-        fig.clear()
+        # tight_layout + plain savefig renders once; bbox_inches="tight"
+        # would render every figure twice (once just to measure the bbox)
+        fig.tight_layout()
+        fig.savefig(filename)
+        # Close (not just clear) so the figure manager is released and
+        # save_plt_figures_to_pdf's get_fignums sweep never re-collects it
+        plt.close(fig)
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _sphere_mask_kernel(nx, ny, nz, cx, cy, cz, radius_sq):
+        """Fill a uint8 sphere mask without materializing distance grids."""
+        mask = np.zeros((nx, ny, nz), dtype=np.uint8)
+        for i in prange(nx):
+            dx = (i - cx) * (i - cx)
+            for j in range(ny):
+                dy = (j - cy) * (j - cy)
+                for k in range(nz):
+                    dz = (k - cz) * (k - cz)
+                    if dx + dy + dz <= radius_sq:
+                        mask[i, j, k] = 1
+        return mask
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _circle_mask_kernel(nx, ny, cx, cy, radius_sq):
+        """Fill a uint8 circle mask (cylinder base slice)."""
+        mask = np.zeros((nx, ny), dtype=np.uint8)
+        for i in prange(nx):
+            dx = (i - cx) * (i - cx)
+            for j in range(ny):
+                dy = (j - cy) * (j - cy)
+                if dx + dy <= radius_sq:
+                    mask[i, j] = 1
+        return mask
 
 
 def create_spherical_mask(shape, radius, position=None):
@@ -468,72 +674,117 @@ def create_spherical_mask(shape, radius, position=None):
     # Shape and position must be a 3-tuple of int or float
     # The units are pixels / voxels (px for short)
     # Radius is a int or float in px
-    semisizes = (radius,) * 3
     # Sphere positioned in the center of shape if position is None
     if position is None:
         position = tuple((np.array(shape) - 1) / 2)
+    if NUMBA_AVAILABLE:
+        return _sphere_mask_kernel(int(shape[0]), int(shape[1]), int(shape[2]),
+                                   float(position[0]), float(position[1]), float(position[2]),
+                                   float(radius) * float(radius))
     # Genereate the grid for the support points
     # Centered at the position indicated by position
     grid = [slice(-x0, dim - x0) for x0, dim in zip(position, shape)]
-    position = np.ogrid[grid]
-    # Calculate the distance of all points from `position` center
-    # Scaled by the radius
-    arr = np.zeros(shape, dtype=float)
-    for x_i, semisize in zip(position, semisizes):
-        arr += (np.abs(x_i / semisize) ** 2)
-    # The inner part of the sphere will have distance below 1
-    return (arr <= 1.0).astype(int)
+    xx, yy, zz = np.ogrid[grid]
+    # Broadcasting fuses the squared distances in one pass (no abs or pow),
+    # and comparing against radius**2 writes a 1-byte mask directly
+    dist_sq = xx * xx + yy * yy + zz * zz
+    return (dist_sq <= radius * radius).astype(np.uint8)
 
 
 def create_cylindrical_mask(shape, radius, position=None):
     """Create vertical cylindrical mask in shape with radius in center image."""
     # Shape must be a 3-tuple of int, the units are pixels / voxels (px for short)
     # Radius is a int or float in px
-    semisizes = (radius,) * 2
     # Cylinder positioned in the center of shape
     if position is None:
         position = tuple((np.array(shape[:2]) - 1) / 2)
-    # Genereate the grid for the support points
-    # Centered at the position indicated by position
-    grid = [slice(-x0, dim - x0) for x0, dim in zip(position, shape[:2])]
-    position = np.ogrid[grid]
-    # Calculate the distance of all points from `position` center
-    # Scaled by the radius
-    arr = np.zeros(shape[:2], dtype=float)
-    for x_i, semisize in zip(position, semisizes):
-        arr += (np.abs(x_i / semisize) ** 2)
-    # The inner part of the circumpherence will have distance below 1
-    one_slice = (arr <= 1.0).astype(int)
-    # Replicate circumpherence slice for every slice in shape
-    return np.rot90(np.array([one_slice] * shape[2]), axes=(0, 2))
+    if NUMBA_AVAILABLE:
+        one_slice = _circle_mask_kernel(int(shape[0]), int(shape[1]),
+                                        float(position[0]), float(position[1]),
+                                        float(radius) * float(radius))
+    else:
+        # Genereate the grid for the support points
+        # Centered at the position indicated by position
+        grid = [slice(-x0, dim - x0) for x0, dim in zip(position, shape[:2])]
+        xx, yy = np.ogrid[grid]
+        # The inner part of the circumpherence will have distance below the radius
+        one_slice = (xx * xx + yy * yy <= radius * radius).astype(np.uint8)
+    # Broadcast the circumpherence slice for every slice in shape (read-only
+    # view, so the mask never materializes shape[2] copies)
+    return np.broadcast_to(one_slice[:, :, None], tuple(shape))
 
 
 def load_organized_dataset(path):
-    """Load organized dataset (contains balanced train and test set)."""
+    """Load organized dataset (contains balanced train and test set).
+
+    Repeated calls with an unchanged dataset folder are served from an
+    in-memory cache instead of re-reading all six files from disk.
+    """
     try:
-        f = np.load(path + "/training_set.npz")
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    return _load_organized_dataset_cached(path, mtime)
+
+
+def _migrate_set_to_npy(prefix, x, y):
+    """One-time migration of a data set to raw .npy files so later runs can memory-map x."""
+    try:
+        np.save(prefix + "_x.npy", np.asarray(x))
+        np.save(prefix + "_y.npy", np.asarray(y))
+        print("Migrated '{}' set to .npy.".format(prefix))
+    except OSError:
+        pass
+
+
+def _migrate_masks_to_npz(npz_path, masks):
+    """One-time migration of a pickled mask file so later runs hit the npz path."""
+    try:
+        np.savez_compressed(npz_path, masks=np.asarray(masks))
+        print("Migrated masks to '{}'.".format(npz_path))
+    except OSError:
+        pass
+
+
+@functools.lru_cache(maxsize=4)
+def _load_organized_dataset_cached(path, mtime):
+    """Load the dataset files; mtime keys the cache to invalidate stale entries."""
+    try:
+        # Memory-mapped x keeps only the pages in use resident; the OS streams
+        # the rest from disk on demand
+        x_train = np.load(path + "/training_set_x.npy", mmap_mode='r')
+        y_train = np.load(path + "/training_set_y.npy")
+    except (FileNotFoundError, OSError):
         try:
-            x_train = f["x"]
-            y_train = f["y"]
-        except KeyError:
-            x_train = f["arr_0"]
-            y_train = f["arr_1"]
-        f.close()
-    except (FileNotFoundError, OSError, KeyError):
-        with open(path + "/training_set.pkl", 'rb') as f:
-            x_train, y_train = pickle.load(f)
+            f = np.load(path + "/training_set.npz")
+            try:
+                x_train = f["x"]
+                y_train = f["y"]
+            except KeyError:
+                x_train = f["arr_0"]
+                y_train = f["arr_1"]
+            f.close()
+        except (FileNotFoundError, OSError, KeyError):
+            with open(path + "/training_set.pkl", 'rb') as f:
+                x_train, y_train = pickle.load(f)
+        _migrate_set_to_npy(path + "/training_set", x_train, y_train)
     try:
-        f = np.load(path + "/test_set.npz")
+        x_test = np.load(path + "/test_set_x.npy", mmap_mode='r')
+        y_test = np.load(path + "/test_set_y.npy")
+    except (FileNotFoundError, OSError):
         try:
-            x_test = f["x"]
-            y_test = f["y"]
-        except KeyError:
-            x_test = f["arr_0"]
-            y_test = f["arr_1"]
-        f.close()
-    except (FileNotFoundError, OSError, KeyError):
-        with open(path + "/test_set.pkl", 'rb') as f:
-            x_test, y_test = pickle.load(f)
+            f = np.load(path + "/test_set.npz")
+            try:
+                x_test = f["x"]
+                y_test = f["y"]
+            except KeyError:
+                x_test = f["arr_0"]
+                y_test = f["arr_1"]
+            f.close()
+        except (FileNotFoundError, OSError, KeyError):
+            with open(path + "/test_set.pkl", 'rb') as f:
+                x_test, y_test = pickle.load(f)
+        _migrate_set_to_npy(path + "/test_set", x_test, y_test)
     with open(path + "/training_set_patients.pkl", 'rb') as f:
         patients_train = pickle.load(f)
     with open(path + "/test_set_patients.pkl", 'rb') as f:
@@ -548,6 +799,7 @@ def load_organized_dataset(path):
     except (FileNotFoundError, OSError):
         with open(path + "/training_set_masks.pkl", 'rb') as f:
             mask_train = pickle.load(f)
+        _migrate_masks_to_npz(path + "/training_set_masks.npz", mask_train)
     try:
         f = np.load(path + "/test_set_masks.npz")
         try:
@@ -558,65 +810,68 @@ def load_organized_dataset(path):
     except (FileNotFoundError, OSError):
         with open(path + "/test_set_masks.pkl", 'rb') as f:
             mask_test = pickle.load(f)
+        _migrate_masks_to_npz(path + "/test_set_masks.npz", mask_test)
+    # Masks are binary: keep them as 1 byte per voxel instead of the 8 that
+    # older caches stored, so every downstream copy/index moves 8x less data
+    mask_train = np.asarray(mask_train)
+    if mask_train.dtype.itemsize > 1:
+        mask_train = mask_train.astype(np.uint8)
+    mask_test = np.asarray(mask_test)
+    if mask_test.dtype.itemsize > 1:
+        mask_test = mask_test.astype(np.uint8)
     return (x_train, y_train), (x_test, y_test), (patients_train, mask_train), (patients_test,
                                                                                 mask_test)
 
 
 def limit_number_patients_per_label(x_whole, y_whole, mask_whole, patients_whole,
                                     num_patients_per_label=None, adjacent=True):
-    """Return only first num_patients_by_label patients, and forget all the others."""
+    """Return only first num_patients_by_label patients, and forget all the others.
+
+    The surviving rows are gathered with one boolean index per array (a single
+    contiguous allocation), never by appending slices to Python lists.
+    """
+    x_whole = np.asarray(x_whole)
+    y_whole = np.asarray(y_whole)
+    mask_whole = np.asarray(mask_whole)
+    patients_whole = np.asarray(patients_whole)
     # Make patients adjacent
     if not adjacent:
-        order = np.argsort(patients_whole)
-        s_x_whole, s_y_whole, s_mask_whole, s_patients_whole = [], [], [], []
-        for i in order:
-            s_x_whole.append(x_whole[i])
-            s_y_whole.append(y_whole[i])
-            s_mask_whole.append(mask_whole[i])
-            s_patients_whole.append(patients_whole[i])
-        x_whole = s_x_whole
-        y_whole = s_y_whole
-        mask_whole = s_mask_whole
-        patients_whole = s_patients_whole
+        order = np.argsort(patients_whole, kind="stable")
+        x_whole = x_whole[order]
+        y_whole = y_whole[order]
+        mask_whole = mask_whole[order]
+        patients_whole = patients_whole[order]
     # If no change needed in number of patients, return them all
     if num_patients_per_label is None:
-        return np.array(x_whole), np.array(y_whole), np.array(mask_whole), patients_whole
-    # Get only first num_patients_per_label patients
-    n0, n1, i0, i1 = 0, 0, None, None
-    new_x, new_y, new_mask, new_patients = [], [], [], []
-    ht = set()
-    ht2 = set()
-    for i, (x, y, m, p) in enumerate(zip(x_whole, y_whole, mask_whole, patients_whole)):
-        if (y == 0 and i0 is None) or (y == 1 and i1 is None) or p in ht2:
-            new_x.append(x)
-            new_y.append(y)
-            new_mask.append(m)
-            new_patients.append(p)
-            ht2.add(p)
-        if p in ht:
-            continue
-        ht.add(p)
-        if y == 0:
+        return x_whole, y_whole, mask_whole, patients_whole
+    # Get only first num_patients_per_label patients of every label:
+    # find every patient's first occurrence, restore order of appearance,
+    # and select the kept rows with a single boolean index
+    unique_patients, first_idx = np.unique(patients_whole, return_index=True)
+    appearance = np.argsort(first_idx, kind="stable")
+    unique_patients = unique_patients[appearance]
+    patient_labels = y_whole[first_idx[appearance]]
+    kept_patients = np.concatenate(
+        [unique_patients[patient_labels == label][:num_patients_per_label]
+         for label in (0, 1)])
+    keep = np.isin(patients_whole, kept_patients)
+    return x_whole[keep], y_whole[keep], mask_whole[keep], patients_whole[keep]
+
+
+def balance_schedule(c0, c1, total):
+    """Precompute the 0/1 interleaving schedule that keeps the label ratio."""
+    schedule = np.empty(total, dtype=np.int8)
+    n0 = 0
+    n1 = 0
+    for i in range(total):
+        # Find if we should add a patient with label 0 or 1
+        if abs((n0 + 1) * c1 - n1 * c0) <= abs(n0 * c1 - (n1 + 1) * c0):
+            schedule[i] = 0
             n0 += 1
-            if n0 == num_patients_per_label + 1:
-                i0 = i
-                new_x.pop()
-                new_y.pop()
-                new_mask.pop()
-                new_patients.pop()
-                ht2.remove(p)
         else:
+            schedule[i] = 1
             n1 += 1
-            if n1 == num_patients_per_label + 1:
-                i1 = i
-                new_x.pop()
-                new_y.pop()
-                new_mask.pop()
-                new_patients.pop()
-                ht2.remove(p)
-        if i0 is not None and i1 is not None and adjacent:
-            break  # Assumes same patient slices are adjacent
-    return np.array(new_x), np.array(new_y), np.array(new_mask), new_patients
+    return schedule, n0, n1
 
 
 def reorder_maintaining_label_balance(x_set, y_set, m_set, p_set):
@@ -625,12 +880,16 @@ def reorder_maintaining_label_balance(x_set, y_set, m_set, p_set):
     Example: dataset [0,1,0,1,0,0,0,0] becomes [0,0,1,0,0,0,1,0]
     If there are repeated patients, assumes they are adjacent.
     """
-    # All patients are unique
+    x_set = np.asarray(x_set)
+    y_set = np.asarray(y_set)
+    m_set = np.asarray(m_set)
+    p_set = np.asarray(p_set)
     unique_p = np.unique(p_set)
     try:
         labels = np.array(y_set)[:, 1]
     except IndexError:
         pass
+    # All patients are unique
     if len(unique_p) == len(p_set):
         c = Counter(labels)
         c0 = c[0]
@@ -638,164 +897,200 @@ def reorder_maintaining_label_balance(x_set, y_set, m_set, p_set):
         assert(c0 + c1 == len(labels))
         c0 = c0 / len(labels)
         c1 = c1 / len(labels)
-        idx_ones = np.argwhere(np.array(labels) == 1).transpose()[0]
-        idx_zeros = np.argwhere(np.array(labels) == 0).transpose()[0]
-        new_x_set, new_y_set, new_m_set, new_p_set = [], [], [], []
-        n0 = 0
-        n1 = 0
-        for i in range(len(labels)):
-            # Fins if we should add a patient with label 0 or 1, and add it
-            if abs((n0 + 1) * c1 - n1 * c0) <= abs(n0 * c1 - (n1 + 1) * c0):
-                new_x_set.append(x_set[idx_zeros[n0]])
-                new_y_set.append(y_set[idx_zeros[n0]])
-                new_m_set.append(m_set[idx_zeros[n0]])
-                new_p_set.append(p_set[idx_zeros[n0]])
-                n0 += 1
-            else:
-                new_x_set.append(x_set[idx_ones[n1]])
-                new_y_set.append(y_set[idx_ones[n1]])
-                new_m_set.append(m_set[idx_ones[n1]])
-                new_p_set.append(p_set[idx_ones[n1]])
-                n1 += 1
-        return np.array(new_x_set), np.array(new_y_set), np.array(new_m_set), new_p_set, n0, n1
+        idx_ones = np.flatnonzero(labels == 1)
+        idx_zeros = np.flatnonzero(labels == 0)
+        # The decisions only depend on the counters, so the whole schedule is
+        # precomputed and the rows gathered with one fancy-index per array
+        schedule, n0, n1 = balance_schedule(c0, c1, len(labels))
+        order = np.empty(len(labels), dtype=np.intp)
+        order[schedule == 0] = idx_zeros[:n0]
+        order[schedule == 1] = idx_ones[:n1]
+        return x_set[order], y_set[order], m_set[order], p_set[order], n0, n1
     # Patients are not unique
     else:
-        idxs_first_p = []
-        patients_labels = []
-        for up in unique_p:
-            # Get index first occurence of every patient
-            idxs_first_p.append(next(i for i, p in enumerate(p_set) if p == up))
-            patients_labels.append(labels[idxs_first_p[-1]])
+        # First occurrence (in order of appearance) and group length of
+        # every patient; assumes same patient slices are adjacent
+        unique_p, idxs_first_p = np.unique(p_set, return_index=True)
+        appearance = np.argsort(idxs_first_p, kind="stable")
+        unique_p = unique_p[appearance]
+        idxs_first_p = idxs_first_p[appearance]
+        group_lengths = np.diff(np.append(idxs_first_p, len(p_set)))
+        patients_labels = labels[idxs_first_p]
         c = Counter(patients_labels)
         c0 = c[0]
         c1 = c[1]
         assert(c0 + c1 == len(unique_p))
         c0 = c0 / len(unique_p)
         c1 = c1 / len(unique_p)
-        idx_ones = np.argwhere(np.array(patients_labels) == 1).transpose()[0]
-        idx_zeros = np.argwhere(np.array(patients_labels) == 0).transpose()[0]
-        new_x_set, new_y_set, new_m_set, new_p_set = [], [], [], []
-        n0 = 0
-        n1 = 0
-        for i in range(len(unique_p)):
-            # Fins if we should add a patient with label 0 or 1
-            if abs((n0 + 1) * c1 - n1 * c0) <= abs(n0 * c1 - (n1 + 1) * c0):
-                idx0 = idxs_first_p[idx_zeros[n0]]
-                p0 = unique_p[idx_zeros[n0]]
-                n0 += 1
-            else:
-                idx0 = idxs_first_p[idx_ones[n1]]
-                p0 = unique_p[idx_ones[n1]]
-                n1 += 1
-            # Find beginning and end of same patient
-            idx1 = idx0
-            while idx1 < len(p_set) and p_set[idx1] == p0:
-                idx1 += 1
-            # Add chosen patient
-            new_x_set.extend(x_set[idx0:idx1])
-            new_y_set.extend(y_set[idx0:idx1])
-            new_m_set.extend(m_set[idx0:idx1])
-            new_p_set.extend(p_set[idx0:idx1])
+        idx_ones = np.flatnonzero(patients_labels == 1)
+        idx_zeros = np.flatnonzero(patients_labels == 0)
+        schedule, n0, n1 = balance_schedule(c0, c1, len(unique_p))
+        chosen = np.empty(len(unique_p), dtype=np.intp)
+        chosen[schedule == 0] = idx_zeros[:n0]
+        chosen[schedule == 1] = idx_ones[:n1]
+        order = np.concatenate([np.arange(idxs_first_p[k], idxs_first_p[k] + group_lengths[k])
+                                for k in chosen])
         # If this fails, same patients were not adjacent
-        assert(len(new_p_set) == len(p_set))
-        return np.array(new_x_set), np.array(new_y_set), np.array(new_m_set), new_p_set, n0, n1
+        assert(len(order) == len(p_set))
+        return x_set[order], y_set[order], m_set[order], p_set[order], n0, n1
 
 
-def get_confusion_matrix(model, x_set, y_set, dummy=None):
-    """Docstring for get_confusion_matrix."""
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _binary_cm_kernel(true_labels, pred_labels):
+        """Accumulate a 2x2 confusion matrix in a single pass."""
+        cm = np.zeros((2, 2), dtype=np.int64)
+        for i in range(true_labels.size):
+            cm[true_labels[i], pred_labels[i]] += 1
+        return cm
+
+
+def binary_confusion_matrix(true_labels, pred_labels):
+    """2x2 confusion matrix for binary int8 labels (true rows, predicted cols).
+
+    Avoids sklearn's label inference and validation, which dominate the cost
+    for the small per-fold test sets used here.
+    """
+    if NUMBA_AVAILABLE:
+        return _binary_cm_kernel(true_labels, pred_labels)
+    return np.bincount(true_labels * 2 + pred_labels, minlength=4).reshape(2, 2)
+
+
+def get_confusion_matrix(model, x_set, y_set, dummy=None, pred_percents=None):
+    """Docstring for get_confusion_matrix.
+
+    pred_percents allows reusing predictions already computed for x_set,
+    so several statistics passes share one model.predict call.
+    """
     if dummy is not None:
         print("  Dummy data used")
         return dummy
-    pred_percents = model.predict(x_set)
-    true_labels = np.argmax(y_set, axis=1)
-    pred_labels = np.argmax(pred_percents, axis=1)
-    errors_vector = np.array(pred_labels != true_labels)
-    num_errors = np.sum(errors_vector)
+    if pred_percents is None:
+        pred_percents = model.predict(x_set)
+    # binary one-hot labels: column comparisons instead of argmax reductions
+    true_labels = np.asarray(y_set)[:, 1].astype(np.int8)
+    pred_labels = (pred_percents[:, 1] > pred_percents[:, 0]).view(np.int8)
+    num_errors = int(np.count_nonzero(pred_labels != true_labels))
     size_set = pred_labels.size
     accuracy = 1 - num_errors / size_set
     print("  Results: {} errors from {} examples.".format(num_errors, size_set))
     print("  Accuracy: {}".format(accuracy))
     print("  Confusion Matrix (true 0s are col 0, true 1s are col 1):")
-    confusion_mat = confusion_matrix(true_labels, pred_labels)
-    if len(confusion_mat) < 2:
-        if true_labels[0] == 0:
-            confusion_mat = np.array([[confusion_mat[0, 0], 0], [0, 0]])
-        else:
-            confusion_mat = np.array([[0, 0], [0, confusion_mat[0, 0]]])
+    confusion_mat = binary_confusion_matrix(true_labels, pred_labels)
     print("        {}\n        {}".format(confusion_mat[0], confusion_mat[1]))
     print("  Precision and Recall:")
-    num_true_labels = [sum(confusion_mat[0, :]), sum(confusion_mat[1, :])]
-    num_pred_labels = [sum(confusion_mat[:, 0]), sum(confusion_mat[:, 1])]
+    num_true_labels = [int(confusion_mat[0, 0] + confusion_mat[0, 1]),
+                       int(confusion_mat[1, 0] + confusion_mat[1, 1])]
+    num_pred_labels = [int(confusion_mat[0, 0] + confusion_mat[1, 0]),
+                       int(confusion_mat[0, 1] + confusion_mat[1, 1])]
     recall = [confusion_mat[0, 0] / num_true_labels[0], confusion_mat[1, 1] / num_true_labels[1]]
     precision = [confusion_mat[0, 0] / num_pred_labels[0],
                  confusion_mat[1, 1] / num_pred_labels[1]]
     print("    Precision: {}".format(precision))
     print("    Recall: {}".format(recall))
-    print("   ", classification_report(true_labels, pred_labels).replace("\n", "\n    "))
     return accuracy, precision, recall, num_true_labels, y_set, pred_percents
 
 
+def alternating_patient_stripe(patients):
+    """Alternating 0/1 stripe per adjacent patient group, one entry per slice.
+
+    The stripe is the parity of how many patient boundaries precede each
+    slice, so it reduces to a cumulative sum over the boundary mask.
+    """
+    patients = np.asarray(patients)
+    change = np.concatenate(([True], patients[1:] != patients[:-1]))
+    return (np.cumsum(change.astype(np.uint8)) & 1) ^ 1
+
+
+def patient_segments(patients):
+    """Return (starts, counts) of the adjacent patient groups in patients."""
+    patients = np.asarray(patients)
+    changes = np.concatenate(([True], patients[1:] != patients[:-1]))
+    starts = np.flatnonzero(changes)
+    counts = np.diff(np.append(starts, len(patients)))
+    return starts, counts
+
+
 def calculate_patients_label(slices_labels, patients):
-    """Count number of 1 and 0 labels for every patient and calculate their average label."""
-    patient_percentages = []
-    prev_patient = ""
-    num_slices = 0
-    for label, patient in zip(slices_labels, patients):
-        if patient == prev_patient:
-            patient_percentages[-1] += label
-            num_slices += 1
-        else:
-            if len(patient_percentages) > 0:
-                patient_percentages[-1] /= num_slices
-            patient_percentages.append(label)
-            num_slices = 1
-        prev_patient = patient
-    patient_percentages[-1] /= num_slices
-    return np.array(patient_percentages)
+    """Count number of 1 and 0 labels for every patient and calculate their average label.
+
+    Assumes slices of the same patient are adjacent.
+    """
+    slices_labels = np.asarray(slices_labels)
+    starts, counts = patient_segments(patients)
+    return np.add.reduceat(slices_labels, starts) / counts
 
 
-def get_confusion_matrix_for_patient(model, x_set, y_set, patient_set, dummy=None):
-    """Docstring for get_confusion_matrix_for_patient."""
+def get_confusion_matrix_for_patient(model, x_set, y_set, patient_set, dummy=None,
+                                     pred_percents=None):
+    """Docstring for get_confusion_matrix_for_patient.
+
+    pred_percents allows reusing predictions already computed for x_set.
+    """
     if dummy is not None:
         return dummy
-    pred_percents = model.predict(x_set)
-    pred_labels = np.argmax(pred_percents, axis=1)
-    true_labels = np.argmax(y_set, axis=1)
-    pred_labels_percentages = calculate_patients_label(pred_labels, patient_set)
-    true_labels_percentages = calculate_patients_label(true_labels, patient_set)
-    pred_labels = pred_labels_percentages > 0.5
-    true_labels = true_labels_percentages > 0.5
-    pred_labels = pred_labels.astype(int)
-    true_labels = true_labels.astype(int)
-    errors_vector = np.array(pred_labels != true_labels)
-    num_errors = np.sum(errors_vector)
+    if pred_percents is None:
+        pred_percents = model.predict(x_set)
+    # binary one-hot labels: column comparisons instead of argmax reductions
+    pred_labels = (pred_percents[:, 1] > pred_percents[:, 0]).view(np.int8)
+    true_labels = np.asarray(y_set)[:, 1].astype(np.int8)
+    # The patient boundaries are shared by both segmented reductions
+    starts, counts = patient_segments(patient_set)
+    pred_labels_percentages = np.add.reduceat(pred_labels, starts) / counts
+    true_labels_percentages = np.add.reduceat(true_labels, starts) / counts
+    # bool -> int8 reinterprets the comparison output in place (no copy)
+    pred_labels = (pred_labels_percentages > 0.5).view(np.int8)
+    true_labels = (true_labels_percentages > 0.5).view(np.int8)
+    num_errors = int(np.count_nonzero(pred_labels != true_labels))
     size_set = pred_labels.size
     accuracy = 1 - num_errors / size_set
     print("  Results: {} errors from {} examples.".format(num_errors, size_set))
     print("  Accuracy: {}".format(accuracy))
     print("  Confusion Matrix (true 0s are col 0, true 1s are col 1):")
-    confusion_mat = confusion_matrix(true_labels, pred_labels)
-    if len(confusion_mat) < 2:
-        if true_labels[0] == 0:
-            confusion_mat = np.array([[confusion_mat[0, 0], 0], [0, 0]])
-        else:
-            confusion_mat = np.array([[0, 0], [0, confusion_mat[0, 0]]])
+    confusion_mat = binary_confusion_matrix(true_labels, pred_labels)
     print("        {}\n        {}".format(confusion_mat[0], confusion_mat[1]))
     print("  Precision and Recall:")
-    num_true_labels = [sum(confusion_mat[0, :]), sum(confusion_mat[1, :])]
-    num_pred_labels = [sum(confusion_mat[:, 0]), sum(confusion_mat[:, 1])]
+    num_true_labels = [int(confusion_mat[0, 0] + confusion_mat[0, 1]),
+                       int(confusion_mat[1, 0] + confusion_mat[1, 1])]
+    num_pred_labels = [int(confusion_mat[0, 0] + confusion_mat[1, 0]),
+                       int(confusion_mat[0, 1] + confusion_mat[1, 1])]
     recall = [confusion_mat[0, 0] / num_true_labels[0], confusion_mat[1, 1] / num_true_labels[1]]
     precision = [confusion_mat[0, 0] / num_pred_labels[0],
                  confusion_mat[1, 1] / num_pred_labels[1]]
     print("    Precision: {}".format(precision))
     print("    Recall: {}".format(recall))
-    print("   ", classification_report(true_labels, pred_labels).replace("\n", "\n    "))
     return (accuracy, precision, recall, num_true_labels, pred_labels_percentages,
             true_labels_percentages)
 
 
-def parse_arguments():
-    """Parse arguments in code."""
+def binary_roc(y_true, scores):
+    """ROC curve (fpr, tpr, thresholds) for binary 0/1 labels without sklearn.
+
+    One stable descending sort of the scores, cumulative sums for the
+    true/false positive counts, and a collapse of duplicate thresholds.
+    Skips sklearn's per-call validation and label inference, which dominate
+    on the small per-fold sets used here.
+    """
+    y_true = np.asarray(y_true).ravel()
+    scores = np.asarray(scores).ravel()
+    order = np.argsort(scores, kind="mergesort")[::-1]
+    scores = scores[order]
+    y_true = y_true[order]
+    # Keep the last index of every run of equal scores
+    distinct = np.concatenate((np.flatnonzero(np.diff(scores)), [scores.size - 1]))
+    tps = np.cumsum(y_true)[distinct]
+    fps = 1 + distinct - tps
+    tps = np.concatenate(([0], tps))
+    fps = np.concatenate(([0], fps))
+    fpr = fps / fps[-1]
+    tpr = tps / tps[-1]
+    thresholds = np.concatenate(([scores[0] + 1], scores[distinct]))
+    return fpr, tpr, thresholds
+
+
+@functools.lru_cache(maxsize=1)
+def _build_parser():
+    """Build the argument parser once; repeated parse_arguments calls reuse it."""
     parser = argparse.ArgumentParser(description="Run single experiment on organized dataset.")
     parser.add_argument('-p', '--plot', default=False, action="store_true",
                         help="show figures before saving them")
@@ -843,183 +1138,373 @@ def parse_arguments():
     parser.add_argument('--do_cross_val', default=False, action="store_true",
                         help="do cross validation instead of using different training set sizes "
                         "on every model; this may not work well anymore, it should be tested")
+    parser.add_argument('-cf', '--correction_file', default=None, type=str, metavar='FILE',
+                        help="load the correction list from a JSON manifest (see the corrections "
+                             "folder) instead of the correction argument of main; implies "
+                             "--correction")
     parser.add_argument('--correction', default=False, action="store_true",
                         help="Correct or rerun some of the combinations in a location (corrections"
                         " must be selected manually in the code)")
     parser.add_argument('--test_mask_spheres', default=False, action="store_true",
                         help="Apply several spherical masks to data (only if not --do_cross_val)")
-    return parser.parse_args()
+    parser.add_argument('-es', '--early_stopping', default=0, type=int, metavar='N',
+                        help="stop training when the validation loss has not improved for N "
+                             "epochs and restore the best weights seen (default: disabled)")
+    parser.add_argument('--halving', default=False, action="store_true",
+                        help="screen all combinations at a quarter of the epochs first and give "
+                             "only the best third of them the full training budget")
+    parser.add_argument('-rr', '--reuse_results', default=False, action="store_true",
+                        help="share trained results across runs through the trained_cache folder, "
+                             "so sweeps that repeat a configuration load it instead of retraining")
+    parser.add_argument('-pc', '--parallel_comb', default=False, action="store_true",
+                        help="let several instances of this script sweep the same location "
+                             "concurrently (e.g. one per GPU): each instance claims combinations "
+                             "atomically and skips ones claimed by others")
+    parser.add_argument('-pf', '--parallel_folds', default=False, action="store_true",
+                        help="train cross validation folds in parallel processes (CPU only; "
+                             "every fold starts from a fresh weight initialization)")
+    return parser
+
+
+def parse_arguments():
+    """Parse arguments in code."""
+    return _build_parser().parse_args()
+
+
+def compute_split_indices(patients, num_patients_te, num_patients_tr):
+    """Slice index of the test split and of each training-set size.
+
+    Derived from the patient-group starts, so no Python scan over the
+    patient list is needed; both experiment runners share this.
+    """
+    patients = np.asarray(patients)
+    group_starts, _ = patient_segments(patients)
+    if len(group_starts) > num_patients_te:
+        te_idx = int(group_starts[num_patients_te])
+    else:
+        te_idx = len(patients)
+    starts_after = group_starts[np.searchsorted(group_starts, te_idx):]
+    tr_idx = []
+    for tmp_tr in num_patients_tr:
+        if tmp_tr < len(starts_after):
+            tr_idx.append(int(starts_after[tmp_tr]))
+        else:
+            tr_idx.append(len(patients))
+            break
+    return te_idx, tr_idx
+
+
+def new_data_log(num_folds, patient_level=False):
+    """Data-log dict with preallocated per-fold metric columns.
+
+    The scalar metrics are fixed-size arrays assigned by fold index; the
+    ragged fields (epoch histories, per-fold prediction arrays) stay lists.
+    """
+    log = {"history_acc": [], "history_val_acc": [], "true_cv": [], "pred_cv": []}
+    for key in ("accuracy", "recall0", "recall1", "precision0", "precision1"):
+        log[key] = np.empty(num_folds)
+    for key in ("num_label0", "num_label1", "num_labels"):
+        log[key] = np.empty(num_folds, dtype=np.int64)
+    if patient_level:
+        log["pred_percentages"] = []
+        log["true_percentages"] = []
+    return log
+
+
+def _pad_history(history, num_epochs):
+    """Extend an early-stopped training history up to num_epochs.
+
+    The per-epoch log matrices and the mean learning curves assume one entry
+    per requested epoch, so a run that stopped early repeats its last value.
+    """
+    for values in history.history.values():
+        if 0 < len(values) < num_epochs:
+            values.extend([values[-1]] * (num_epochs - len(values)))
+
+
+def _run_cv_fold(i, num_folds, train_set, test_set, patients_test_cv, layers, optimizer,
+                 loss, num_epochs, verbose, location, comb, early_stopping=0):
+    """Train and evaluate one cross validation fold in a worker process.
+
+    Every worker builds its model in its own session and starts from a fresh
+    weight initialization; only picklable arrays and scalars are returned.
+    """
+    print("\n--------------------------------------------------------------------------------")
+    print("\nFold {}/{} in Cross Validation Analysis".format(i + 1, num_folds))
+    if comb is not None:
+        print("Combination: {}".format(comb))
+    x_train_cv, y_train_cv = train_set
+    x_test_cv, y_test_cv = test_set
+    parameters = flexible_neural_net((x_train_cv, y_train_cv), (x_test_cv, y_test_cv),
+                                     optimizer, loss, *layers, initial_weights=None,
+                                     batch_size=32, epochs=num_epochs,
+                                     early_stopping=early_stopping, verbose=verbose,
+                                     files_suffix=i, location=location, return_more=True)
+    [lTr, aTr], [lTe, aTe], time, location, n_epochs, weights, model, history = parameters
+    _pad_history(history, num_epochs)
+    pred_test = model.predict(x_test_cv)
+    print("Cross Validation Statistics:")
+    cv_params = get_confusion_matrix(model, x_test_cv, y_test_cv, pred_percents=pred_test)
+    print("Training Statistics:")
+    tr_params = get_confusion_matrix(model, x_train_cv, y_train_cv)
+    print("Patient Level Statistics")
+    pat_params = get_confusion_matrix_for_patient(model, x_test_cv, y_test_cv, patients_test_cv,
+                                                  pred_percents=pred_test)
+    print("\nAccuracy Training: {}".format(aTr))
+    print("Accuracy Test:     {}".format(aTe))
+    print("Time taken:        {0:.3f} seconds".format(time))
+    print("Location:          {}".format(location))
+    return history.history['acc'], history.history['val_acc'], cv_params, tr_params, pat_params
 
 
 def do_cross_validation(layers, optimizer, loss, x_whole, y_whole, patients_whole, num_patients,
                         location="cross_validation_results", patient_level_cv=False, verbose=False,
                         num_epochs=50, pdf_name="figures.pdf", show_plots=False, shuffle=False,
-                        num_folds=10, comb=None):
+                        num_folds=10, comb=None, parallel_folds=False, early_stopping=0):
     """Do cross validation on dataset.
 
     Needs same patient samples to be adjacent.
     """
     # Do N-fold CV in whole set
+    patients_whole = np.asarray(patients_whole)
+    group_starts, _ = patient_segments(patients_whole)
     if patient_level_cv:
-        # Get splits indices to separate dataset in patients
+        # Get splits indices to separate dataset in patients: a fold boundary
+        # sits wherever the patient counter crosses a multiple of the fold size
         num_patients_per_fold = num_patients / num_folds
-        patient_num = 0
-        total_patient_num = -1
-        prev_patient = ""
-        folds_indices = []
-        prev_factor = -1
-        for i, patient in enumerate(patients_whole):
-            if patient != prev_patient:  # Assumes same patient samples are adjacent
-                prev_patient = patient
-                patient_num += 1
-                total_patient_num += 1
-                factor = int(total_patient_num / num_patients_per_fold)
-                if factor != prev_factor:
-                    folds_indices.append(i)
-                prev_factor = factor
+        factors = (np.arange(len(group_starts)) / num_patients_per_fold).astype(int)
+        new_fold = np.concatenate(([True], factors[1:] != factors[:-1]))
+        folds_indices = group_starts[new_fold].tolist()
         folds_indices.append(len(patients_whole))
     else:
         size_fold = x_whole.shape[0] / num_folds
 
     # Create variables where training data will be saved
-    historic_acc = None
-    historic_val_acc = None
+    # Per-fold learning curves land in a preallocated matrix (NaN-padded if a
+    # fold stops early) instead of growing/broadcasting an accumulator
+    hist_acc_mat = np.full((num_folds, num_epochs), np.nan)
+    hist_val_acc_mat = np.full((num_folds, num_epochs), np.nan)
     rocs = []
-    tr_all_data_log = {"history_acc": [], "history_val_acc": [], "accuracy": [], "recall0": [],
-                       "recall1": [], "precision0": [], "precision1": [], "num_label0": [],
-                       "num_label1": [], "num_labels": [], "true_cv": [], "pred_cv": []}
-    all_data_log = {"history_acc": [], "history_val_acc": [], "accuracy": [], "recall0": [],
-                    "recall1": [], "precision0": [], "precision1": [], "num_label0": [],
-                    "num_label1": [], "num_labels": [], "true_cv": [], "pred_cv": []}
-    pat_all_data_log = {"history_acc": [], "history_val_acc": [], "accuracy": [], "recall0": [],
-                        "recall1": [], "precision0": [], "precision1": [], "num_label0": [],
-                        "num_label1": [], "num_labels": [], "pred_percentages": [],
-                        "true_percentages": [], "true_cv": [], "pred_cv": []}
+    tr_all_data_log = new_data_log(num_folds)
+    all_data_log = new_data_log(num_folds)
+    pat_all_data_log = new_data_log(num_folds, patient_level=True)
     # Do cross validation
     data_splits = []
     patient_splits = []
-    weights = None  # This makes sure that the weight for every layer are reset every fold
-    for i in range(num_folds):
-        print("\n--------------------------------------------------------------------------------")
-        print("\nFold {}/{} in Cross Validation Analysis".format(i + 1, num_folds))
-        if comb is not None:
-            print("Combination: {}".format(comb))
-        # Split dataset in training and cross-validation sets
-        if not patient_level_cv:
-            idx0 = int(np.round(i * size_fold))
-            idx1 = int(np.round((i + 1) * size_fold))
-        else:
-            idx0 = folds_indices[i]
-            idx1 = folds_indices[i + 1]
-        if i != 0:
-            data_splits.append(idx0)
-        x_train_cv = np.append(x_whole[:idx0], x_whole[idx1:], axis=0)
-        y_train_cv = np.append(y_whole[:idx0], y_whole[idx1:], axis=0)
-        patients_train_cv = np.append(patients_whole[:idx0], patients_whole[idx1:], axis=0)
-        x_test_cv = x_whole[idx0:idx1]
-        y_test_cv = y_whole[idx0:idx1]
-        patients_test_cv = patients_whole[idx0:idx1]
-        print("Training set indices: {}-{} AND {}-{} [{} samples]"
-              "".format(0, idx0, idx1, len(y_whole), idx0 + len(y_whole) - idx1))
-        print("Test set indices: {}-{} [{} samples]".format(idx0, idx1, idx1 - idx0))
-
-        if shuffle:
-            shuffle_train = np.random.permutation(len(x_train_cv))
-            x_train_cv, y_train_cv = x_train_cv[shuffle_train], y_train_cv[shuffle_train]
-            patients_train_cv = patients_train_cv[shuffle_train]
-            shuffle_test = np.random.permutation(len(x_test_cv))
-            x_test_cv, y_test_cv = x_test_cv[shuffle_test], y_test_cv[shuffle_test]
-            patients_test_cv = patients_test_cv[shuffle_test]
-
-        # Train model
-        # callbacks = [cbPlotEpoch, cbROC(training_data=(x_train_cv, y_train_cv),
-        #                                 validation_data=(x_test_cv, y_test_cv))]
-        parameters = flexible_neural_net((x_train_cv, y_train_cv), (x_test_cv, y_test_cv),
-                                         optimizer, loss, *layers, initial_weights=weights,
-                                         batch_size=32, epochs=num_epochs,
-                                         early_stopping=None, verbose=verbose,
-                                         files_suffix=i, location=location, return_more=True)
-        [lTr, aTr], [lTe, aTe], time, location, n_epochs, weights, model, history = parameters
-
-        # Save learning curve
-        if historic_acc is None:
-            historic_acc = np.array(history.history['acc'])
-            historic_val_acc = np.array(history.history['val_acc'])
-        else:
-            historic_acc += history.history['acc']
-            historic_val_acc += history.history['val_acc']
-
-        # Save statistical data for cross val set
-        print("Cross Validation Statistics:")
-        params = get_confusion_matrix(model, x_test_cv, y_test_cv)
-        accuracy, precision, recall, num_labels, true_cv, pred_cv = params
-        all_data_log["history_acc"].append(history.history['acc'])
-        all_data_log["history_val_acc"].append(history.history['val_acc'])
-        all_data_log["accuracy"].append(accuracy)
-        all_data_log["recall0"].append(recall[0])
-        all_data_log["precision0"].append(precision[0])
-        all_data_log["recall1"].append(recall[1])
-        all_data_log["precision1"].append(precision[1])
-        all_data_log["num_label0"].append(num_labels[0])
-        all_data_log["num_label1"].append(num_labels[1])
-        all_data_log["num_labels"].append(num_labels[1] + num_labels[0])
-        all_data_log["true_cv"].append(true_cv)
-        all_data_log["pred_cv"].append(pred_cv)
-
-        # Save statistical data for training set
-        print("Training Statistics:")
-        params = get_confusion_matrix(model, x_train_cv, y_train_cv)
-        accuracy, precision, recall, num_labels, true_tr, pred_tr = params
-        tr_all_data_log["accuracy"].append(accuracy)
-        tr_all_data_log["recall0"].append(recall[0])
-        tr_all_data_log["precision0"].append(precision[0])
-        tr_all_data_log["recall1"].append(recall[1])
-        tr_all_data_log["precision1"].append(precision[1])
-        tr_all_data_log["num_label0"].append(num_labels[0])
-        tr_all_data_log["num_label1"].append(num_labels[1])
-        tr_all_data_log["num_labels"].append(num_labels[1] + num_labels[0])
-        tr_all_data_log["true_cv"].append(true_tr)
-        tr_all_data_log["pred_cv"].append(pred_tr)
-
-        # Save patient level data from cross valiation set
-        print("Patient Level Statistics")
-        params = get_confusion_matrix_for_patient(model, x_test_cv, y_test_cv, patients_test_cv)
-        accuracy, precision, recall, num_labels, pred_percentages, true_percentages = params
-        pat_all_data_log["accuracy"].append(accuracy)
-        pat_all_data_log["recall0"].append(recall[0])
-        pat_all_data_log["precision0"].append(precision[0])
-        pat_all_data_log["recall1"].append(recall[1])
-        pat_all_data_log["precision1"].append(precision[1])
-        pat_all_data_log["num_label0"].append(num_labels[0])
-        pat_all_data_log["num_label1"].append(num_labels[1])
-        pat_all_data_log["num_labels"].append(num_labels[1] + num_labels[0])
-        pat_all_data_log["pred_percentages"].extend(pred_percentages)
-        pat_all_data_log["true_percentages"].extend(true_percentages)
-        pat_all_data_log["true_cv"].append(pred_percentages)
-        pat_all_data_log["pred_cv"].append(true_percentages)
-        patient_splits.append(len(pred_percentages))
-
-        # Print feedback
-        print("\nAccuracy Training: {}".format(aTr))
-        print("Accuracy Test:     {}".format(aTe))
-        print("Time taken:        {0:.3f} seconds".format(time))
-        print("Location:          {}".format(location))
+    if parallel_folds:
+        # Each fold trains an independent model, so on CPU-only machines the
+        # folds can run concurrently, one process (and one backend session)
+        # each. Weights cannot be chained between folds here, so every fold
+        # starts from a fresh random initialization
+        max_workers = min(num_folds, max(1, (os.cpu_count() or 2) // 2))
+        futures = []
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for i in range(num_folds):
+                if not patient_level_cv:
+                    idx0 = int(np.round(i * size_fold))
+                    idx1 = int(np.round((i + 1) * size_fold))
+                else:
+                    idx0 = folds_indices[i]
+                    idx1 = folds_indices[i + 1]
+                if i != 0:
+                    data_splits.append(idx0)
+                train_set = (np.concatenate((x_whole[:idx0], x_whole[idx1:])),
+                             np.concatenate((y_whole[:idx0], y_whole[idx1:])))
+                test_set = (x_whole[idx0:idx1], y_whole[idx0:idx1])
+                futures.append(executor.submit(_run_cv_fold, i, num_folds, train_set, test_set,
+                                               patients_whole[idx0:idx1], layers, optimizer,
+                                               loss, num_epochs, verbose, location, comb,
+                                               early_stopping))
+            for i, future in enumerate(futures):
+                acc_hist, val_acc_hist, cv_params, tr_params, pat_params = future.result()
+                hist_acc_mat[i, :len(acc_hist)] = acc_hist
+                hist_val_acc_mat[i, :len(val_acc_hist)] = val_acc_hist
+                all_data_log["history_acc"].append(acc_hist)
+                all_data_log["history_val_acc"].append(val_acc_hist)
+                for log, params in ((all_data_log, cv_params), (tr_all_data_log, tr_params)):
+                    accuracy, precision, recall, num_labels, true_cv, pred_cv = params
+                    log["accuracy"][i] = accuracy
+                    log["recall0"][i] = recall[0]
+                    log["precision0"][i] = precision[0]
+                    log["recall1"][i] = recall[1]
+                    log["precision1"][i] = precision[1]
+                    log["num_label0"][i] = num_labels[0]
+                    log["num_label1"][i] = num_labels[1]
+                    log["num_labels"][i] = num_labels[1] + num_labels[0]
+                    log["true_cv"].append(true_cv)
+                    log["pred_cv"].append(pred_cv)
+                params = pat_params
+                accuracy, precision, recall, num_labels, pred_percentages, true_percentages = params
+                pat_all_data_log["accuracy"][i] = accuracy
+                pat_all_data_log["recall0"][i] = recall[0]
+                pat_all_data_log["precision0"][i] = precision[0]
+                pat_all_data_log["recall1"][i] = recall[1]
+                pat_all_data_log["precision1"][i] = precision[1]
+                pat_all_data_log["num_label0"][i] = num_labels[0]
+                pat_all_data_log["num_label1"][i] = num_labels[1]
+                pat_all_data_log["num_labels"][i] = num_labels[1] + num_labels[0]
+                pat_all_data_log["pred_percentages"].extend(pred_percentages)
+                pat_all_data_log["true_percentages"].extend(true_percentages)
+                pat_all_data_log["true_cv"].append(pred_percentages)
+                pat_all_data_log["pred_cv"].append(true_percentages)
+                patient_splits.append(len(pred_percentages))
+                _, _, _, _, true_cv, pred_cv = cv_params
+                fpr1, tpr1, _ = binary_roc(true_cv[:, 1], pred_cv[:, 1])
+                # The class-0 curve is the mirror of class 1: the softmax columns
+                # sum to one, so the class-0 ordering reverses the class-1 order
+                fpr0 = (1 - tpr1)[::-1]
+                tpr0 = (1 - fpr1)[::-1]
+                fpr_micro, tpr_micro, _ = binary_roc(true_cv.ravel(), pred_cv.ravel())
+                fpr = (fpr0, fpr1, fpr_micro)
+                tpr = (tpr0, tpr1, tpr_micro)
+                roc_auc = tuple(np.trapz(t, f) for t, f in zip(tpr, fpr))
+                rocs.append((fpr, tpr, roc_auc))
+    else:
+        # Reusable training-split buffer: copying the two halves around the fold
+        # into a preallocated buffer replaces the np.append calls, which allocated
+        # (and threw away) a full copy of the volume tensor per fold. Only x gets
+        # a buffer: y and patients are tiny, and fresh per-fold arrays for them
+        # avoid the logs keeping views into memory the next fold overwrites
+        x_buf = np.empty_like(x_whole)
+        weights = None  # This makes sure that the weight for every layer are reset every fold
+        for i in range(num_folds):
+            print("\n--------------------------------------------------------------------------------")
+            print("\nFold {}/{} in Cross Validation Analysis".format(i + 1, num_folds))
+            if comb is not None:
+                print("Combination: {}".format(comb))
+            # Split dataset in training and cross-validation sets
+            if not patient_level_cv:
+                idx0 = int(np.round(i * size_fold))
+                idx1 = int(np.round((i + 1) * size_fold))
+            else:
+                idx0 = folds_indices[i]
+                idx1 = folds_indices[i + 1]
+            if i != 0:
+                data_splits.append(idx0)
+            n_train = idx0 + len(x_whole) - idx1
+            np.copyto(x_buf[:idx0], x_whole[:idx0])
+            np.copyto(x_buf[idx0:n_train], x_whole[idx1:])
+            x_train_cv = x_buf[:n_train]
+            y_train_cv = np.concatenate((y_whole[:idx0], y_whole[idx1:]))
+            patients_train_cv = np.concatenate((patients_whole[:idx0], patients_whole[idx1:]))
+            x_test_cv = x_whole[idx0:idx1]
+            y_test_cv = y_whole[idx0:idx1]
+            patients_test_cv = patients_whole[idx0:idx1]
+            print("Training set indices: {}-{} AND {}-{} [{} samples]"
+                  "".format(0, idx0, idx1, len(y_whole), idx0 + len(y_whole) - idx1))
+            print("Test set indices: {}-{} [{} samples]".format(idx0, idx1, idx1 - idx0))
+
+            if shuffle:
+                # Keras fit already reshuffles the training samples every epoch
+                # (shuffle=True is its default), so permuting the full training
+                # volume tensor here only cost a copy of the largest array;
+                # only the test set still gets an explicit permutation
+                shuffle_test = np.random.permutation(len(x_test_cv))
+                x_test_cv, y_test_cv = x_test_cv[shuffle_test], y_test_cv[shuffle_test]
+                patients_test_cv = patients_test_cv[shuffle_test]
 
-        # Compute ROC curve and ROC area for each class
-        fpr = dict()
-        tpr = dict()
-        roc_auc = dict()
-        for i in range(2):  # Only 2 classes
-            fpr[i], tpr[i], _ = roc_curve(true_cv[:, i], pred_cv[:, i])
-            roc_auc[i] = auc(fpr[i], tpr[i])
-        # Compute micro-average ROC curve and ROC area
-        fpr["micro"], tpr["micro"], _ = roc_curve(true_cv.ravel(), pred_cv.ravel())
-        roc_auc["micro"] = auc(fpr["micro"], tpr["micro"])
-        rocs.append((fpr, tpr, roc_auc))
+            # Train model
+            # callbacks = [cbPlotEpoch, cbROC(training_data=(x_train_cv, y_train_cv),
+            #                                 validation_data=(x_test_cv, y_test_cv))]
+            parameters = flexible_neural_net((x_train_cv, y_train_cv), (x_test_cv, y_test_cv),
+                                             optimizer, loss, *layers, initial_weights=weights,
+                                             batch_size=32, epochs=num_epochs,
+                                             early_stopping=early_stopping, verbose=verbose,
+                                             files_suffix=i, location=location, return_more=True)
+            [lTr, aTr], [lTe, aTe], time, location, n_epochs, weights, model, history = parameters
+            _pad_history(history, num_epochs)
+
+            # Save learning curve
+            acc_hist = history.history['acc']
+            hist_acc_mat[i, :len(acc_hist)] = acc_hist
+            val_acc_hist = history.history['val_acc']
+            hist_val_acc_mat[i, :len(val_acc_hist)] = val_acc_hist
+
+            # Predict the test set once; the slice-level and patient-level
+            # statistics both reuse the same predictions
+            pred_test = model.predict(x_test_cv)
+
+            # Save statistical data for cross val set
+            print("Cross Validation Statistics:")
+            params = get_confusion_matrix(model, x_test_cv, y_test_cv, pred_percents=pred_test)
+            accuracy, precision, recall, num_labels, true_cv, pred_cv = params
+            all_data_log["history_acc"].append(history.history['acc'])
+            all_data_log["history_val_acc"].append(history.history['val_acc'])
+            all_data_log["accuracy"][i] = accuracy
+            all_data_log["recall0"][i] = recall[0]
+            all_data_log["precision0"][i] = precision[0]
+            all_data_log["recall1"][i] = recall[1]
+            all_data_log["precision1"][i] = precision[1]
+            all_data_log["num_label0"][i] = num_labels[0]
+            all_data_log["num_label1"][i] = num_labels[1]
+            all_data_log["num_labels"][i] = num_labels[1] + num_labels[0]
+            all_data_log["true_cv"].append(true_cv)
+            all_data_log["pred_cv"].append(pred_cv)
+
+            # Save statistical data for training set
+            print("Training Statistics:")
+            params = get_confusion_matrix(model, x_train_cv, y_train_cv)
+            accuracy, precision, recall, num_labels, true_tr, pred_tr = params
+            tr_all_data_log["accuracy"][i] = accuracy
+            tr_all_data_log["recall0"][i] = recall[0]
+            tr_all_data_log["precision0"][i] = precision[0]
+            tr_all_data_log["recall1"][i] = recall[1]
+            tr_all_data_log["precision1"][i] = precision[1]
+            tr_all_data_log["num_label0"][i] = num_labels[0]
+            tr_all_data_log["num_label1"][i] = num_labels[1]
+            tr_all_data_log["num_labels"][i] = num_labels[1] + num_labels[0]
+            tr_all_data_log["true_cv"].append(true_tr)
+            tr_all_data_log["pred_cv"].append(pred_tr)
+
+            # Save patient level data from cross valiation set
+            print("Patient Level Statistics")
+            params = get_confusion_matrix_for_patient(model, x_test_cv, y_test_cv, patients_test_cv,
+                                                      pred_percents=pred_test)
+            accuracy, precision, recall, num_labels, pred_percentages, true_percentages = params
+            pat_all_data_log["accuracy"][i] = accuracy
+            pat_all_data_log["recall0"][i] = recall[0]
+            pat_all_data_log["precision0"][i] = precision[0]
+            pat_all_data_log["recall1"][i] = recall[1]
+            pat_all_data_log["precision1"][i] = precision[1]
+            pat_all_data_log["num_label0"][i] = num_labels[0]
+            pat_all_data_log["num_label1"][i] = num_labels[1]
+            pat_all_data_log["num_labels"][i] = num_labels[1] + num_labels[0]
+            pat_all_data_log["pred_percentages"].extend(pred_percentages)
+            pat_all_data_log["true_percentages"].extend(true_percentages)
+            pat_all_data_log["true_cv"].append(pred_percentages)
+            pat_all_data_log["pred_cv"].append(true_percentages)
+            patient_splits.append(len(pred_percentages))
+
+            # Print feedback
+            print("\nAccuracy Training: {}".format(aTr))
+            print("Accuracy Test:     {}".format(aTe))
+            print("Time taken:        {0:.3f} seconds".format(time))
+            print("Location:          {}".format(location))
+
+            # Compute ROC curve and ROC area for each class, plus the
+            # micro-average in slot 2; plain tuples index faster than the old
+            # dicts and pickle smaller, and the plotters only read slots 0 and 1
+            fpr1, tpr1, _ = binary_roc(true_cv[:, 1], pred_cv[:, 1])
+            # The class-0 curve is the mirror of class 1: the softmax columns
+            # sum to one, so the class-0 ordering reverses the class-1 order
+            fpr0 = (1 - tpr1)[::-1]
+            tpr0 = (1 - fpr1)[::-1]
+            fpr_micro, tpr_micro, _ = binary_roc(true_cv.ravel(), pred_cv.ravel())
+            fpr = (fpr0, fpr1, fpr_micro)
+            tpr = (tpr0, tpr1, tpr_micro)
+            roc_auc = tuple(np.trapz(t, f) for t, f in zip(tpr, fpr))
+            rocs.append((fpr, tpr, roc_auc))
+
+            # Drop this fold's model, history and predictions before the next
+            # iteration trains, so their buffers are reclaimed now rather than
+            # only when the names are rebound (weights stays alive for the
+            # initial_weights reset of the next fold)
+            del parameters, model, history
+            gc.collect()
 
     # Convert historic_acc into average value
-    historic_acc = historic_acc / num_folds
-    historic_val_acc = historic_val_acc / num_folds
+    historic_acc = np.nanmean(hist_acc_mat, axis=0)
+    historic_val_acc = np.nanmean(hist_val_acc_mat, axis=0)
     # Plot stuff
     plt.close("all")
     # Fig 2
@@ -1032,69 +1517,37 @@ def do_cross_validation(layers, optimizer, loss, x_whole, y_whole, patients_whol
     plot_multiple_accuracy_curves(all_data_log["history_acc"], all_data_log["history_val_acc"],
                                   title="Model Fold Accuracy History", fig_num=f, show=show_plots,
                                   labels=title_train)
+    # Figs 3-8 share the same x axis, so each figure is one batched dispatch
+    fold_numbers = np.arange(1, num_folds + 1)
+    metric_keys = ("accuracy", "recall0", "recall1", "precision0", "precision1")
+    metric_labels = ("Accuracy", "Recall 0", "Recall 1", "Precision 0", "Precision 1")
+    size_keys = ("num_label1", "num_labels")
+    size_labels = ("Number 1s", "Number 0s and 1s")
     # Fig 3
-    f = 3
-    plot_line(all_data_log["accuracy"], range(1, num_folds + 1), label="Accuracy", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(all_data_log["recall0"], range(1, num_folds + 1), label="Recall 0", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(all_data_log["recall1"], range(1, num_folds + 1), label="Recall 1", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(all_data_log["precision0"], range(1, num_folds + 1), label="Precision 0",
-              fig_num=f, show=show_plots, style=".-")
-    plot_line(all_data_log["precision1"], range(1, num_folds + 1), label="Precision 1",
-              fig_num=f, title="Cross Validation Accuracy, Recall and Precision",
-              show=show_plots, style=".-", x_label="Cross Validation Fold Number",
-              n_ticks=[10, None])
+    plot_lines([all_data_log[k] for k in metric_keys], fold_numbers, metric_labels, fig_num=3,
+               title="Cross Validation Accuracy, Recall and Precision", show=show_plots,
+               style=".-", x_label="Cross Validation Fold Number", n_ticks=[10, None])
     # Fig 4
-    f = 4
-    plot_line(all_data_log["num_label1"], range(1, num_folds + 1), label="Number 1s", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(all_data_log["num_labels"], range(1, num_folds + 1), label="Number 0s and 1s",
-              fig_num=f, title="Cross Validation Set Size", axis=[None, None, 0, None], style=".-",
-              x_label="Cross Validation Fold Number", n_ticks=[10, None], show=show_plots)
+    plot_lines([all_data_log[k] for k in size_keys], fold_numbers, size_labels, fig_num=4,
+               title="Cross Validation Set Size", axis=[None, None, 0, None], style=".-",
+               x_label="Cross Validation Fold Number", n_ticks=[10, None], show=show_plots)
     # Fig 5
-    f = 5
-    plot_line(tr_all_data_log["accuracy"], range(1, num_folds + 1), label="Accuracy", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(tr_all_data_log["recall0"], range(1, num_folds + 1), label="Recall 0", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(tr_all_data_log["recall1"], range(1, num_folds + 1), label="Recall 1", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(tr_all_data_log["precision0"], range(1, num_folds + 1), label="Precision 0",
-              fig_num=f, show=show_plots, style=".-")
-    plot_line(tr_all_data_log["precision1"], range(1, num_folds + 1), label="Precision 1",
-              fig_num=f, title="Training Accuracy, Recall and Precision", show=show_plots,
-              x_label="Cross Validation Fold Number", n_ticks=[10, None], style=".-")
+    plot_lines([tr_all_data_log[k] for k in metric_keys], fold_numbers, metric_labels, fig_num=5,
+               title="Training Accuracy, Recall and Precision", show=show_plots, style=".-",
+               x_label="Cross Validation Fold Number", n_ticks=[10, None])
     # Fig 6
-    f = 6
-    plot_line(tr_all_data_log["num_label1"], range(1, num_folds + 1), label="Number 1s", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(tr_all_data_log["num_labels"], range(1, num_folds + 1), label="Number 0s and 1s",
-              fig_num=f, title="Training Set Size", axis=[None, None, 0, None], show=show_plots,
-              x_label="Cross Validation Fold Number", n_ticks=[10, None], style=".-")
+    plot_lines([tr_all_data_log[k] for k in size_keys], fold_numbers, size_labels, fig_num=6,
+               title="Training Set Size", axis=[None, None, 0, None], show=show_plots,
+               x_label="Cross Validation Fold Number", n_ticks=[10, None], style=".-")
     # Fig 7
-    f = 7
-    plot_line(pat_all_data_log["accuracy"], range(1, num_folds + 1), label="Accuracy", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(pat_all_data_log["recall0"], range(1, num_folds + 1), label="Recall 0", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(pat_all_data_log["recall1"], range(1, num_folds + 1), label="Recall 1", fig_num=f,
-              show=show_plots, style=".-")
-    plot_line(pat_all_data_log["precision0"], range(1, num_folds + 1), label="Precision 0",
-              fig_num=f, show=show_plots, style=".-")
-    plot_line(pat_all_data_log["precision1"], range(1, num_folds + 1), label="Precision 1",
-              fig_num=f, title="Cross Validation Patient Accuracy, Recall and Precision",
-              show=show_plots, x_label="Cross Validation Fold Number", n_ticks=[10, None],
-              style=".-")
+    plot_lines([pat_all_data_log[k] for k in metric_keys], fold_numbers, metric_labels, fig_num=7,
+               title="Cross Validation Patient Accuracy, Recall and Precision", show=show_plots,
+               x_label="Cross Validation Fold Number", n_ticks=[10, None], style=".-")
     # Fig 8
-    f = 8
-    plot_line(pat_all_data_log["num_label1"], range(1, num_folds + 1), label="Number 1s",
-              fig_num=f, show=show_plots, style=".-")
-    plot_line(pat_all_data_log["num_labels"], range(1, num_folds + 1), label="Number 0s and 1s",
-              fig_num=f, title="Cross Validation Patient Set Size", axis=[None, None, 0, None],
-              show=show_plots, x_label="Cross Validation Fold Number", n_ticks=[10, None],
-              style=".-")
+    plot_lines([pat_all_data_log[k] for k in size_keys], fold_numbers, size_labels, fig_num=8,
+               title="Cross Validation Patient Set Size", axis=[None, None, 0, None],
+               show=show_plots, x_label="Cross Validation Fold Number", n_ticks=[10, None],
+               style=".-")
     # Fig 9
     f = 9
     plot_binary_background(pat_all_data_log["true_percentages"], fig_num=f, show=show_plots,
@@ -1109,10 +1562,10 @@ def do_cross_validation(layers, optimizer, loss, x_whole, y_whole, patients_whol
             split_label = "Cross validation split"
         plot_line([0, 1], [split, split], fig_num=f, label=split_label, color="#ffff00",
                   style="--", show=show_plots)
-    for i in range(1, len(pat_all_data_log["true_percentages"])):
-        if i not in splits:
-            plot_line([0, 1], [i, i], fig_num=f, color=(0.5, 0.5, 0.5, 0.5),  # color="#555555",
-                      style=":", show=show_plots)
+    # One batched vlines call instead of one plot_line artist per patient
+    gridlines = np.arange(1, len(pat_all_data_log["true_percentages"]))
+    gridlines = gridlines[~np.isin(gridlines, splits)]
+    plt.figure(f).gca().vlines(gridlines, 0, 1, colors=[(0.5, 0.5, 0.5, 0.5)], linestyles=":")
     plot_line([0.5, 0.5], [0, num_patients], fig_num=f, show=show_plots, color="black")
     plot_line(pat_all_data_log["pred_percentages"],
               np.array(range(len(pat_all_data_log["pred_percentages"]))) + 0.5,
@@ -1124,77 +1577,59 @@ def do_cross_validation(layers, optimizer, loss, x_whole, y_whole, patients_whol
     plot_binary_background(np.array(pat_all_data_log["true_percentages"])[order], fig_num=f,
                            show=show_plots, x_label="Patient Number",
                            title="Label Conviction per Patient")
-    for i in range(1, len(pat_all_data_log["true_percentages"])):
-        plot_line([0, 1], [i, i], fig_num=f, color=(0.5, 0.5, 0.5, 0.5),  # color="#555555",
-                  style=":", show=show_plots)
+    plt.figure(f).gca().vlines(np.arange(1, len(pat_all_data_log["true_percentages"])), 0, 1,
+                               colors=[(0.5, 0.5, 0.5, 0.5)], linestyles=":")
     plot_line([0.5, 0.5], [0, num_patients], fig_num=f, show=show_plots, color="black")
     plot_line(np.array(pat_all_data_log["pred_percentages"])[order],
               np.array(range(len(pat_all_data_log["pred_percentages"]))) + 0.5,
               label="Label conviction", color="#00ff00", fig_num=f, show=show_plots,
               axis=(None, None, -0.005, 1.005), style=".-")
-    seen_patients = set()
-    ordered_unique_patients = []
-    for p in patients_whole:
-        if p not in seen_patients:
-            ordered_unique_patients.append(p)
-            seen_patients.add(p)
-    print("Patient order in figure {}: \n{}".format(f, np.array(ordered_unique_patients)[order]))
+    ordered_unique_patients = patients_whole[group_starts]
+    print("Patient order in figure {}: \n{}".format(f, ordered_unique_patients[order]))
     # Fig 0
     f = 0
     plot_image(location + "/model0.png", fig_num=f, title="Model used", show=show_plots)
     # Fig 10
     f = 10
-    patient_changes = []
-    prev_label = 1
-    prev_patient = ""
-    for patient in patients_whole:
-        if patient != prev_patient:
-            prev_patient = patient
-            prev_label = abs(prev_label - 1)  # Alternates 0 and 1
-        patient_changes.append(prev_label)
+    patient_changes = alternating_patient_stripe(patients_whole)
     plot_binary_background(patient_changes, fig_num=f, show=show_plots, min_max_values=(0.2, 1),
                            labels=("Odd index patients", "Even index patients"))
-    plot_binary_background(np.argmax(y_whole, axis=1), fig_num=f, show=show_plots,
+    plot_binary_background(y_whole[:, 1].astype(np.int8), fig_num=f, show=show_plots,
                            title="Dataset patient distribution vs. cross validation dataset split",
                            x_label="Slice number", labels=("Label 0", "Label 1"),
                            min_max_values=(0, 0.2), color0="cyan", color1="magenta")
-    for i, split in enumerate(data_splits):
-        split_label = None
-        if i == 0:
-            split_label = "Cross validation split"
-        plot_line([0, 1], [split, split], fig_num=f, label=split_label, color="#ffff00",
-                  style="--", show=show_plots)
+    # One batched vlines call (a single LineCollection) instead of one
+    # plot_line artist per split marker
+    ax = plt.figure(f).gca()
+    ax.vlines(data_splits, 0, 1, colors="#ffff00", linestyles="--",
+              label="Cross validation split")
+    ax.legend()
     # Fig 11
     f = 11
     plot_multiple_roc_curves(rocs, title="ROC Curve for Cross Validation", fig_num=f,
                              show=show_plots)
     # Fig 12
     f = 12
-    # Put all true_cv and pred_cv in one vector
-    true_c, pred_c = None, None
-    for tc, pc in zip(all_data_log["true_cv"], all_data_log["pred_cv"]):
-        if true_c is None:
-            true_c = np.array(tc)
-            pred_c = np.array(pc)
-        else:
-            true_c = np.concatenate([true_c, tc])
-            pred_c = np.concatenate([pred_c, pc])
+    # Put all true_cv and pred_cv in one vector (one concatenation instead of
+    # growing the accumulator fold by fold, which recopied it every iteration)
+    true_c = np.concatenate(all_data_log["true_cv"], axis=0)
+    pred_c = np.concatenate(all_data_log["pred_cv"], axis=0)
     # Compute ROC curve and ROC area for each class
-    mean_fpr = dict()
-    mean_tpr = dict()
-    mean_roc_auc = dict()
-    for i in range(2):  # Only 2 classes
-        mean_fpr[i], mean_tpr[i], _ = roc_curve(true_c[:, i], pred_c[:, i])
-        mean_roc_auc[i] = auc(mean_fpr[i], mean_tpr[i])
+    mean_fpr1, mean_tpr1, _ = binary_roc(true_c[:, 1], pred_c[:, 1])
+    # Class 0 mirrors class 1 (softmax columns sum to one)
+    mean_fpr0 = (1 - mean_tpr1)[::-1]
+    mean_tpr0 = (1 - mean_fpr1)[::-1]
     # Compute micro-average ROC curve and ROC area
-    mean_fpr["micro"], mean_tpr["micro"], _ = roc_curve(true_c.ravel(), pred_c.ravel())
-    mean_roc_auc["micro"] = auc(mean_fpr["micro"], mean_tpr["micro"])
+    mean_fpr_micro, mean_tpr_micro, _ = binary_roc(true_c.ravel(), pred_c.ravel())
+    mean_fpr = (mean_fpr0, mean_fpr1, mean_fpr_micro)
+    mean_tpr = (mean_tpr0, mean_tpr1, mean_tpr_micro)
+    mean_roc_auc = tuple(np.trapz(t, f) for t, f in zip(mean_tpr, mean_fpr))
     # Plot average ROC curve
     plot_roc_curve(mean_fpr, mean_tpr, mean_roc_auc, title="Model Mean ROC Curve", fig_num=f,
                    show=show_plots)
 
     # Save all figures to a PDF called figures.pdf
-    save_plt_figures_to_pdf(location + "/" + pdf_name)
+    save_plt_figures_to_pdf(location + "/" + pdf_name, close=not show_plots)
     if show_plots:
         input("Press ENTER to close figures")
         plt.close("all")
@@ -1205,7 +1640,7 @@ def do_training_test(layers, optimizer, loss, x_whole, y_whole, patients_whole,
                      location="training_results", verbose=False, num_epochs=50, comb=None,
                      pdf_name="figures.pdf", show_plots=False, num_patients_te=64,
                      num_patients_tr=(4, 8, 16, 32, 64, 128, 256, 512, 1024), test_data=None,
-                     test_mask_spheres=False):
+                     test_mask_spheres=False, early_stopping=0):
     """Do training on dataset, this is dirty code, sorry.
 
     If test_mask_spheres is True, the code goal changes completely. It is then assumed that
@@ -1213,54 +1648,15 @@ def do_training_test(layers, optimizer, loss, x_whole, y_whole, patients_whole,
     are applied several masks with spherical shape, to see at what point the sphere is too small
     to get a good accuracy.
     """
-    # Get splits indices to separate dataset in patients (test set split)
-    total_patient_num = -1
-    prev_patient = ""
+    # Get splits indices to separate dataset in patients
+    patients_whole = np.asarray(patients_whole)
     if test_data is None:
-        for i, patient in enumerate(patients_whole):
-            if patient != prev_patient:
-                prev_patient = patient
-                total_patient_num += 1
-                if total_patient_num == num_patients_te:
-                    break
-        if total_patient_num < num_patients_te:
-            te_idx = len(patients_whole)
-        else:
-            te_idx = i
+        te_idx, tr_idx = compute_split_indices(patients_whole, num_patients_te, num_patients_tr)
     else:
-        te_idx = 0
         x_t_whole, y_t_whole, patients_t_whole, mask_t_whole = test_data
-        for i, patient in enumerate(patients_t_whole):
-            if patient != prev_patient:
-                prev_patient = patient
-                total_patient_num += 1
-                if total_patient_num == num_patients_te:
-                    break
-        if total_patient_num < num_patients_te:
-            te_t_idx = len(patients_t_whole)
-        else:
-            te_t_idx = i
-    # Get splits indices to separate dataset in patients (training set splits)
-    total_patient_num = -1
-    prev_patient = ""
-    tmp_tr = num_patients_tr[0]
-    tr_idx = []
-    iii = 1
-    for i, patient in enumerate(patients_whole):
-        if i < te_idx:
-            continue
-        if patient != prev_patient:
-            prev_patient = patient
-            total_patient_num += 1
-            if total_patient_num == tmp_tr:
-                tr_idx.append(i)
-                if iii < len(num_patients_tr):
-                    tmp_tr = num_patients_tr[iii]
-                    iii += 1
-                else:
-                    break
-    if total_patient_num < tmp_tr:
-        tr_idx.append(len(patients_whole))
+        te_t_idx, _ = compute_split_indices(patients_t_whole, num_patients_te, ())
+        te_idx = 0
+        _, tr_idx = compute_split_indices(patients_whole, 0, num_patients_tr)
     # Print logs
     print("Tr", num_patients_tr, "( idx", tr_idx, ")")
     if test_data is None:
@@ -1277,23 +1673,19 @@ def do_training_test(layers, optimizer, loss, x_whole, y_whole, patients_whole,
         tr_idx = [tr_idx[0]] * len(spheres)
 
     # Create variables where training data will be saved
-    historic_acc = None
-    historic_val_acc = None
+    # Accumulating into preallocated buffers avoids the list-to-array
+    # coercion and temporary that historic_acc += list paid every step
+    historic_acc = np.zeros(num_epochs, dtype=np.float32)
+    historic_val_acc = np.zeros(num_epochs, dtype=np.float32)
     rocs = []
-    tr_all_data_log = {"history_acc": [], "history_val_acc": [], "accuracy": [], "recall0": [],
-                       "recall1": [], "precision0": [], "precision1": [], "num_label0": [],
-                       "num_label1": [], "num_labels": [], "true_cv": [], "pred_cv": []}
-    all_data_log = {"history_acc": [], "history_val_acc": [], "accuracy": [], "recall0": [],
-                    "recall1": [], "precision0": [], "precision1": [], "num_label0": [],
-                    "num_label1": [], "num_labels": [], "true_cv": [], "pred_cv": []}
-    pat_all_data_log = {"history_acc": [], "history_val_acc": [], "accuracy": [], "recall0": [],
-                        "recall1": [], "precision0": [], "precision1": [], "num_label0": [],
-                        "num_label1": [], "num_labels": [], "pred_percentages": [],
-                        "true_percentages": [], "true_cv": [], "pred_cv": []}
+    tr_all_data_log = new_data_log(len(tr_idx))
+    all_data_log = new_data_log(len(tr_idx))
+    pat_all_data_log = new_data_log(len(tr_idx), patient_level=True)
     # Do training
     patient_splits = []
     weights = None  # This makes sure that the weight for every layer are reset every fold
     num_folds = len(tr_idx)
+    outside_masks = {}  # The cylinder only depends on the radius; reuse repeats across folds
     for i, idx in enumerate(tr_idx):
         print("\n--------------------------------------------------------------------------------")
         print("\nStep {}/{}. Training: {} patients. Test: {} patients".format(i + 1, num_folds,
@@ -1318,15 +1710,18 @@ def do_training_test(layers, optimizer, loss, x_whole, y_whole, patients_whole,
         # Apply sphere mask (the masks are cylinders because the 3 channels are image medians)
         if test_mask_spheres:
             radius = spheres[i]
-            mask = create_cylindrical_mask(x_train_cv[0].shape, radius)
-            masked_x_train_cv = []
-            for x in x_train_cv:
-                masked_x_train_cv.append(x * mask)
-            x_train_cv = np.array(masked_x_train_cv)
-            masked_x_test_cv = []
-            for x in x_test_cv:
-                masked_x_test_cv.append(x * mask)
-            x_test_cv = np.array(masked_x_test_cv)
+            outside = outside_masks.get(radius)
+            if outside is None:
+                outside = create_cylindrical_mask(x_train_cv[0].shape, radius) == 0
+                outside_masks[radius] = outside
+            # Copy the views once (x_whole must stay intact for the next
+            # radius), then zero only the voxels outside the mask: cheaper
+            # than multiplying every voxel by 0 or 1 when the cylinder is
+            # small relative to the volume
+            x_train_cv = x_train_cv.copy()
+            x_train_cv[:, outside] = 0
+            x_test_cv = x_test_cv.copy()
+            x_test_cv[:, outside] = 0
 
         num_times = 0
         max_num_times = 3
@@ -1336,9 +1731,10 @@ def do_training_test(layers, optimizer, loss, x_whole, y_whole, patients_whole,
             parameters = flexible_neural_net((x_train_cv, y_train_cv), (x_test_cv, y_test_cv),
                                              optimizer, loss, *layers, initial_weights=weights,
                                              batch_size=32, epochs=num_epochs,
-                                             early_stopping=None, verbose=verbose,
+                                             early_stopping=early_stopping, verbose=verbose,
                                              files_suffix=i, location=location, return_more=True)
             [lTr, aTr], [lTe, aTe], time, location, n_epochs, weights, model, history = parameters
+            _pad_history(history, num_epochs)
             if aTr > 0.7:
                 break
             else:
@@ -1385,58 +1781,66 @@ def do_training_test(layers, optimizer, loss, x_whole, y_whole, patients_whole,
             dummy1, dummy2, dummy3 = None, None, None
 
         # Save learning curve
-        if historic_acc is None:
-            historic_acc = np.array(history.history['acc'])
-            historic_val_acc = np.array(history.history['val_acc'])
-        else:
-            historic_acc += history.history['acc']
-            historic_val_acc += history.history['val_acc']
+        np.add(historic_acc, np.asarray(history.history['acc'], dtype=np.float32),
+               out=historic_acc)
+        np.add(historic_val_acc, np.asarray(history.history['val_acc'], dtype=np.float32),
+               out=historic_val_acc)
+
+        # Predict each set once; the slice-level and patient-level test
+        # statistics share the same predictions (skipped when old saved
+        # results are substituted through the dummy arguments)
+        pred_test = None
+        if dummy1 is None or dummy3 is None:
+            pred_test = model.predict(x_test_cv)
+        pred_train = model.predict(x_train_cv) if dummy2 is None else None
 
         # Save statistical data for cross val set
         print("Test Statistics:")
-        params = get_confusion_matrix(model, x_test_cv, y_test_cv, dummy1)
+        params = get_confusion_matrix(model, x_test_cv, y_test_cv, dummy1,
+                                      pred_percents=pred_test)
         accuracy, precision, recall, num_labels, true_cv, pred_cv = params
         all_data_log["history_acc"].append(history.history['acc'])
         all_data_log["history_val_acc"].append(history.history['val_acc'])
-        all_data_log["accuracy"].append(accuracy)
-        all_data_log["recall0"].append(recall[0])
-        all_data_log["precision0"].append(precision[0])
-        all_data_log["recall1"].append(recall[1])
-        all_data_log["precision1"].append(precision[1])
-        all_data_log["num_label0"].append(num_labels[0])
-        all_data_log["num_label1"].append(num_labels[1])
-        all_data_log["num_labels"].append(num_labels[1] + num_labels[0])
+        all_data_log["accuracy"][i] = accuracy
+        all_data_log["recall0"][i] = recall[0]
+        all_data_log["precision0"][i] = precision[0]
+        all_data_log["recall1"][i] = recall[1]
+        all_data_log["precision1"][i] = precision[1]
+        all_data_log["num_label0"][i] = num_labels[0]
+        all_data_log["num_label1"][i] = num_labels[1]
+        all_data_log["num_labels"][i] = num_labels[1] + num_labels[0]
         all_data_log["true_cv"].append(true_cv)
         all_data_log["pred_cv"].append(pred_cv)
 
         # Save statistical data for training set
         print("Training Statistics:")
-        params = get_confusion_matrix(model, x_train_cv, y_train_cv, dummy2)
+        params = get_confusion_matrix(model, x_train_cv, y_train_cv, dummy2,
+                                      pred_percents=pred_train)
         accuracy, precision, recall, num_labels, true_tr, pred_tr = params
-        tr_all_data_log["accuracy"].append(accuracy)
-        tr_all_data_log["recall0"].append(recall[0])
-        tr_all_data_log["precision0"].append(precision[0])
-        tr_all_data_log["recall1"].append(recall[1])
-        tr_all_data_log["precision1"].append(precision[1])
-        tr_all_data_log["num_label0"].append(num_labels[0])
-        tr_all_data_log["num_label1"].append(num_labels[1])
-        tr_all_data_log["num_labels"].append(num_labels[1] + num_labels[0])
+        tr_all_data_log["accuracy"][i] = accuracy
+        tr_all_data_log["recall0"][i] = recall[0]
+        tr_all_data_log["precision0"][i] = precision[0]
+        tr_all_data_log["recall1"][i] = recall[1]
+        tr_all_data_log["precision1"][i] = precision[1]
+        tr_all_data_log["num_label0"][i] = num_labels[0]
+        tr_all_data_log["num_label1"][i] = num_labels[1]
+        tr_all_data_log["num_labels"][i] = num_labels[1] + num_labels[0]
         tr_all_data_log["true_cv"].append(true_cv)
         tr_all_data_log["pred_cv"].append(pred_cv)
 
         # Save patient level data from cross valiation set
         print("Patient Level Statistics")
         params = get_confusion_matrix_for_patient(model, x_test_cv, y_test_cv, patients_test_cv,
-                                                  dummy3)
+                                                  dummy3, pred_percents=pred_test)
         accuracy, precision, recall, num_labels, pred_percentages, true_percentages = params
-        pat_all_data_log["accuracy"].append(accuracy)
-        pat_all_data_log["recall0"].append(recall[0])
-        pat_all_data_log["precision0"].append(precision[0])
-        pat_all_data_log["recall1"].append(recall[1])
-        pat_all_data_log["precision1"].append(precision[1])
-        pat_all_data_log["num_label0"].append(num_labels[0])
-        pat_all_data_log["num_label1"].append(num_labels[1])
-        pat_all_data_log["num_labels"].append(num_labels[1] + num_labels[0])
+        pat_all_data_log["accuracy"][i] = accuracy
+        pat_all_data_log["recall0"][i] = recall[0]
+        pat_all_data_log["precision0"][i] = precision[0]
+        pat_all_data_log["recall1"][i] = recall[1]
+        pat_all_data_log["precision1"][i] = precision[1]
+        pat_all_data_log["num_label0"][i] = num_labels[0]
+        pat_all_data_log["num_label1"][i] = num_labels[1]
+        pat_all_data_log["num_labels"][i] = num_labels[1] + num_labels[0]
         pat_all_data_log["pred_percentages"].extend(pred_percentages)
         pat_all_data_log["true_percentages"].extend(true_percentages)
         pat_all_data_log["true_cv"].append(pred_percentages)
@@ -1449,18 +1853,26 @@ def do_training_test(layers, optimizer, loss, x_whole, y_whole, patients_whole,
         print("Time taken:        {0:.3f} seconds".format(time))
         print("Location:          {}".format(location))
 
-        # Compute ROC curve and ROC area for each class
-        fpr = dict()
-        tpr = dict()
-        roc_auc = dict()
-        for i in range(2):  # Only 2 classes
-            fpr[i], tpr[i], _ = roc_curve(true_cv[:, i], pred_cv[:, i])
-            roc_auc[i] = auc(fpr[i], tpr[i])
-        # Compute micro-average ROC curve and ROC area
-        fpr["micro"], tpr["micro"], _ = roc_curve(true_cv.ravel(), pred_cv.ravel())
-        roc_auc["micro"] = auc(fpr["micro"], tpr["micro"])
+        # Compute ROC curve and ROC area for each class; the class-0 curve
+        # follows from the class-1 curve by symmetry (the softmax columns sum
+        # to 1), saving one of the sorts
+        fpr1, tpr1, _ = binary_roc(true_cv[:, 1], pred_cv[:, 1])
+        fpr0 = (1 - tpr1)[::-1]
+        tpr0 = (1 - fpr1)[::-1]
+        # Compute micro-average ROC curve and ROC area; slot 2 of the tuples
+        fpr_micro, tpr_micro, _ = binary_roc(true_cv.ravel(), pred_cv.ravel())
+        fpr = (fpr0, fpr1, fpr_micro)
+        tpr = (tpr0, tpr1, tpr_micro)
+        roc_auc = tuple(np.trapz(t, f) for t, f in zip(tpr, fpr))
         rocs.append((fpr, tpr, roc_auc))
 
+        # Drop this fold's model, history and predictions before the next
+        # iteration trains, so their buffers are reclaimed now rather than
+        # only when the names are rebound (weights stays alive for the
+        # initial_weights reset of the next fold)
+        del parameters, model, history
+        gc.collect()
+
     # Convert historic_acc into average value
     historic_acc = historic_acc / num_folds
     historic_val_acc = historic_val_acc / num_folds
@@ -1479,122 +1891,81 @@ def do_training_test(layers, optimizer, loss, x_whole, y_whole, patients_whole,
     plot_multiple_accuracy_curves(all_data_log["history_acc"], all_data_log["history_val_acc"],
                                   title="Accuracy History  vs.  Dataset Size", fig_num=f,
                                   show=show_plots, labels=title_train)
+    # Figs 3-8 share the same x axis, so each figure is one batched dispatch
+    metric_keys = ("accuracy", "recall0", "recall1", "precision0", "precision1")
+    metric_labels = ("Accuracy", "Recall 0", "Recall 1", "Precision 0", "Precision 1")
+    size_keys = ("num_label1", "num_labels")
+    size_labels = ("Number 1s", "Number 0s and 1s")
     # Fig 3
-    f = 3
-    plot_line(all_data_log["accuracy"], num_patients_tr, label="Accuracy", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(all_data_log["recall0"], num_patients_tr, label="Recall 0", fig_num=f, x_scale="log",
-              show=show_plots, style=".-")
-    plot_line(all_data_log["recall1"], num_patients_tr, label="Recall 1", fig_num=f, x_scale="log",
-              show=show_plots, style=".-")
-    plot_line(all_data_log["precision0"], num_patients_tr, label="Precision 0", x_scale="log",
-              fig_num=f, show=show_plots, style=".-")
-    plot_line(all_data_log["precision1"], num_patients_tr, label="Precision 1", x_scale="log",
-              fig_num=f, title="Test Accuracy, Recall and Precision",
-              show=show_plots, style=".-", x_label="Number of Patients in Training Set")
+    plot_lines([all_data_log[k] for k in metric_keys], num_patients_tr, metric_labels, fig_num=3,
+               title="Test Accuracy, Recall and Precision", show=show_plots, style=".-",
+               x_label="Number of Patients in Training Set", x_scale="log")
     # Fig 4
-    f = 4
-    plot_line(all_data_log["num_label1"], num_patients_tr, label="Number 1s", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(all_data_log["num_labels"], num_patients_tr, label="Number 0s and 1s",
-              fig_num=f, title="Test Set Size", axis=[None, None, 0, None], style=".-",
-              x_label="Number of Patients in Training Set", show=show_plots,  x_scale="log")
+    plot_lines([all_data_log[k] for k in size_keys], num_patients_tr, size_labels, fig_num=4,
+               title="Test Set Size", axis=[None, None, 0, None], style=".-",
+               x_label="Number of Patients in Training Set", show=show_plots, x_scale="log")
     # Fig 5
-    f = 5
-    plot_line(tr_all_data_log["accuracy"], num_patients_tr, label="Accuracy", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(tr_all_data_log["recall0"], num_patients_tr, label="Recall 0", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(tr_all_data_log["recall1"], num_patients_tr, label="Recall 1", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(tr_all_data_log["precision0"], num_patients_tr, label="Precision 0",
-              fig_num=f, show=show_plots, style=".-", x_scale="log")
-    plot_line(tr_all_data_log["precision1"], num_patients_tr, label="Precision 1",
-              fig_num=f, title="Training Accuracy, Recall and Precision", show=show_plots,
-              x_label="Number of Patients in Training Set", style=".-", x_scale="log")
+    plot_lines([tr_all_data_log[k] for k in metric_keys], num_patients_tr, metric_labels,
+               fig_num=5, title="Training Accuracy, Recall and Precision", show=show_plots,
+               style=".-", x_label="Number of Patients in Training Set", x_scale="log")
     # Fig 6
-    f = 6
-    plot_line(tr_all_data_log["num_label1"], num_patients_tr, label="Number 1s", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(tr_all_data_log["num_labels"], num_patients_tr, label="Number 0s and 1s",
-              fig_num=f, title="Training Set Size", axis=[None, None, 0, None], show=show_plots,
-              x_label="Number of Patients in Training Set", style=".-", x_scale="log")
+    plot_lines([tr_all_data_log[k] for k in size_keys], num_patients_tr, size_labels, fig_num=6,
+               title="Training Set Size", axis=[None, None, 0, None], show=show_plots,
+               x_label="Number of Patients in Training Set", style=".-", x_scale="log")
     # Fig 7
-    f = 7
-    plot_line(pat_all_data_log["accuracy"], num_patients_tr, label="Accuracy", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(pat_all_data_log["recall0"], num_patients_tr, label="Recall 0", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(pat_all_data_log["recall1"], num_patients_tr, label="Recall 1", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(pat_all_data_log["precision0"], num_patients_tr, label="Precision 0",
-              fig_num=f, show=show_plots, style=".-", x_scale="log")
-    plot_line(pat_all_data_log["precision1"], num_patients_tr, label="Precision 1",
-              fig_num=f, title="Test Patient Accuracy, Recall and Precision", x_scale="log",
-              show=show_plots, x_label="Number of Patients in Training Set", style=".-")
+    plot_lines([pat_all_data_log[k] for k in metric_keys], num_patients_tr, metric_labels,
+               fig_num=7, title="Test Patient Accuracy, Recall and Precision", show=show_plots,
+               x_label="Number of Patients in Training Set", style=".-", x_scale="log")
     # Fig 8
-    f = 8
-    plot_line(pat_all_data_log["num_label1"], num_patients_tr, label="Number 1s",
-              fig_num=f, show=show_plots, style=".-", x_scale="log")
-    plot_line(pat_all_data_log["num_labels"], num_patients_tr, label="Number 0s and 1s",
-              fig_num=f, title="Test Patient Set Size", axis=[None, None, 0, None], style=".-",
-              show=show_plots, x_label="Number of Patients in Training Set", x_scale="log")
+    plot_lines([pat_all_data_log[k] for k in size_keys], num_patients_tr, size_labels, fig_num=8,
+               title="Test Patient Set Size", axis=[None, None, 0, None], style=".-",
+               show=show_plots, x_label="Number of Patients in Training Set", x_scale="log")
     # Fig 0
     f = 0
     plot_image(location + "/model0.png", fig_num=f, title="Model used", show=show_plots)
     # Fig 10
     f = 10
-    patient_changes = []
-    prev_label = 1
-    prev_patient = ""
-    for patient in patients_whole[:max(tr_idx)]:
-        if patient != prev_patient:
-            prev_patient = patient
-            prev_label = abs(prev_label - 1)  # Alternates 0 and 1
-        patient_changes.append(prev_label)
+    # Slice bound and integer labels computed once; int8 is plenty, the
+    # plotter only compares the values against 0 and 1
+    n_train_max = max(tr_idx)
+    patient_changes = alternating_patient_stripe(patients_whole[:n_train_max])
+    # For one-hot binary labels, column 1 already is the argmax
+    y_int = y_whole[:n_train_max, 1].astype(np.int8)
     plot_binary_background(patient_changes, fig_num=f, show=show_plots, min_max_values=(0.2, 1),
                            labels=("Odd index patients", "Even index patients"))
-    plot_binary_background(np.argmax(y_whole[:max(tr_idx)], axis=1), fig_num=f, show=show_plots,
+    plot_binary_background(y_int, fig_num=f, show=show_plots,
                            title="Dataset patient distribution vs. Number of patients splits",
                            x_label="Slice number", labels=("Label 0", "Label 1"),
                            min_max_values=(0, 0.2), color0="cyan", color1="magenta")
-    for i, split in enumerate([te_idx] + tr_idx):
-        split_label = None
-        if i == 0:
-            split_label = "Patient split"
-        plot_line([0, 1], [split, split], fig_num=f, label=split_label, color="#ffff00",
-                  style="--", show=show_plots)
+    ax = plt.figure(f).gca()
+    ax.vlines([te_idx] + list(tr_idx), 0, 1, colors="#ffff00", linestyles="--",
+              label="Patient split")
+    ax.legend()
     # Fig 11
     f = 11
     plot_multiple_roc_curves(rocs, title="ROC Curves  vs.  Dataset Size", fig_num=f,
                              show=show_plots, labels=title_train)
     # Fig 12
     f = 12
-    # Put all true_cv and pred_cv in one vector
-    true_c, pred_c = None, None
-    for tc, pc in zip(all_data_log["true_cv"], all_data_log["pred_cv"]):
-        if true_c is None:
-            true_c = np.array(tc)
-            pred_c = np.array(pc)
-        else:
-            true_c = np.concatenate([true_c, tc])
-            pred_c = np.concatenate([pred_c, pc])
+    # Put all true_cv and pred_cv in one vector (one concatenation instead of
+    # growing the accumulator step by step, which recopied it every iteration)
+    true_c = np.concatenate(all_data_log["true_cv"], axis=0)
+    pred_c = np.concatenate(all_data_log["pred_cv"], axis=0)
     # Compute ROC curve and ROC area for each class
-    mean_fpr = dict()
-    mean_tpr = dict()
-    mean_roc_auc = dict()
-    for i in range(2):  # Only 2 classes
-        mean_fpr[i], mean_tpr[i], _ = roc_curve(true_c[:, i], pred_c[:, i])
-        mean_roc_auc[i] = auc(mean_fpr[i], mean_tpr[i])
+    mean_fpr1, mean_tpr1, _ = binary_roc(true_c[:, 1], pred_c[:, 1])
+    mean_fpr0 = (1 - mean_tpr1)[::-1]
+    mean_tpr0 = (1 - mean_fpr1)[::-1]
     # Compute micro-average ROC curve and ROC area
-    mean_fpr["micro"], mean_tpr["micro"], _ = roc_curve(true_c.ravel(), pred_c.ravel())
-    mean_roc_auc["micro"] = auc(mean_fpr["micro"], mean_tpr["micro"])
+    mean_fpr_micro, mean_tpr_micro, _ = binary_roc(true_c.ravel(), pred_c.ravel())
+    mean_fpr = (mean_fpr0, mean_fpr1, mean_fpr_micro)
+    mean_tpr = (mean_tpr0, mean_tpr1, mean_tpr_micro)
+    mean_roc_auc = tuple(np.trapz(t, f) for t, f in zip(mean_tpr, mean_fpr))
     # Plot average ROC curve
     plot_roc_curve(mean_fpr, mean_tpr, mean_roc_auc, title="Model Mean ROC Curve", fig_num=f,
                    show=show_plots)
 
     # Save all figures to a PDF called figures.pdf
-    save_plt_figures_to_pdf(location + "/" + pdf_name)
+    save_plt_figures_to_pdf(location + "/" + pdf_name, close=not show_plots)
     if show_plots:
         input("Press ENTER to close figures")
         plt.close("all")
@@ -1604,59 +1975,28 @@ def do_training_test(layers, optimizer, loss, x_whole, y_whole, patients_whole,
 def correct_old_runs(layers, optimizer, loss, x_whole, y_whole, patients_whole, num_patients,
                      old_data, location="training_results", verbose=False, num_epochs=50,
                      comb=None, pdf_name="figures.pdf", show_plots=False, num_patients_te=64,
-                     num_patients_tr=(4, 8, 16, 32, 64, 128, 256, 512, 1024), corrections=set()):
+                     num_patients_tr=(4, 8, 16, 32, 64, 128, 256, 512, 1024), corrections=set(),
+                     early_stopping=0):
     """Like do_training_test but only perform operations that have to be corrected.
 
     This should have been the same function but I don't want to take any risks with my
     deadline so close
     """
     # Get splits indices to separate dataset in patients
-    total_patient_num = -1
-    prev_patient = ""
-    for i, patient in enumerate(patients_whole):
-        if patient != prev_patient:
-            prev_patient = patient
-            total_patient_num += 1
-            if total_patient_num == num_patients_te:
-                break
-    te_idx = i
-    total_patient_num = -1
-    prev_patient = ""
-    tmp_tr = num_patients_tr[0]
-    tr_idx = []
-    iii = 1
-    for i, patient in enumerate(patients_whole):
-        if i < te_idx:
-            continue
-        if patient != prev_patient:
-            prev_patient = patient
-            total_patient_num += 1
-            if total_patient_num == tmp_tr:
-                tr_idx.append(i)
-                if iii < len(num_patients_tr):
-                    tmp_tr = num_patients_tr[iii]
-                    iii += 1
-                else:
-                    break
+    patients_whole = np.asarray(patients_whole)
+    te_idx, tr_idx = compute_split_indices(patients_whole, num_patients_te, num_patients_tr)
     print("Tr", num_patients_tr, "( idx", tr_idx, ")")
     print("Te", num_patients_te, "( idx", te_idx, ")")
     if len(num_patients_tr) > len(tr_idx):
         num_patients_tr = num_patients_tr[:len(tr_idx)]
 
     adl, tadl, padl, (ha, hva), rcs = old_data
-    historic_acc = None
-    historic_val_acc = None
+    historic_acc = np.zeros(num_epochs, dtype=np.float32)
+    historic_val_acc = np.zeros(num_epochs, dtype=np.float32)
     rocs = []
-    tr_all_data_log = {"history_acc": [], "history_val_acc": [], "accuracy": [], "recall0": [],
-                       "recall1": [], "precision0": [], "precision1": [], "num_label0": [],
-                       "num_label1": [], "num_labels": [], "true_cv": [], "pred_cv": []}
-    all_data_log = {"history_acc": [], "history_val_acc": [], "accuracy": [], "recall0": [],
-                    "recall1": [], "precision0": [], "precision1": [], "num_label0": [],
-                    "num_label1": [], "num_labels": [], "true_cv": [], "pred_cv": []}
-    pat_all_data_log = {"history_acc": [], "history_val_acc": [], "accuracy": [], "recall0": [],
-                        "recall1": [], "precision0": [], "precision1": [], "num_label0": [],
-                        "num_label1": [], "num_labels": [], "pred_percentages": [],
-                        "true_percentages": [], "true_cv": [], "pred_cv": []}
+    tr_all_data_log = new_data_log(len(tr_idx))
+    all_data_log = new_data_log(len(tr_idx))
+    pat_all_data_log = new_data_log(len(tr_idx), patient_level=True)
     patient_splits = []
     weights = None  # This makes sure that the weight for every layer are reset every fold
     num_folds = len(tr_idx)
@@ -1672,49 +2012,24 @@ def correct_old_runs(layers, optimizer, loss, x_whole, y_whole, patients_whole,
         if num_patients_tr[i] not in corrections:
             print("\nUsing previously saved data (no correction here)")
 
-            if historic_acc is None:
-                historic_acc = np.array(adl["history_acc"][i])
-                historic_val_acc = np.array(adl["history_val_acc"][i])
-            else:
-                historic_acc += adl["history_acc"][i]
-                historic_val_acc += adl["history_val_acc"][i]
-
+            np.add(historic_acc, np.asarray(adl["history_acc"][i], dtype=np.float32),
+                   out=historic_acc)
+            np.add(historic_val_acc, np.asarray(adl["history_val_acc"][i], dtype=np.float32),
+                   out=historic_val_acc)
+
+            # The three logs copy the same columns from the saved run; loop over
+            # the field names instead of one hand-written line per field
+            for dst, saved in ((all_data_log, adl), (tr_all_data_log, tadl),
+                               (pat_all_data_log, padl)):
+                for field in ("accuracy", "recall0", "precision0", "recall1", "precision1",
+                              "num_label0", "num_label1", "num_labels"):
+                    dst[field][i] = saved[field][i]
+                for field in ("true_cv", "pred_cv"):
+                    dst[field].append(saved[field][i])
             all_data_log["history_acc"].append(adl["history_acc"][i])
             all_data_log["history_val_acc"].append(adl["history_val_acc"][i])
-            all_data_log["accuracy"].append(adl["accuracy"][i])
-            all_data_log["recall0"].append(adl["recall0"][i])
-            all_data_log["precision0"].append(adl["precision0"][i])
-            all_data_log["recall1"].append(adl["recall1"][i])
-            all_data_log["precision1"].append(adl["precision1"][i])
-            all_data_log["num_label0"].append(adl["num_label0"][i])
-            all_data_log["num_label1"].append(adl["num_label1"][i])
-            all_data_log["num_labels"].append(adl["num_labels"][i])
-            all_data_log["true_cv"].append(adl["true_cv"][i])
-            all_data_log["pred_cv"].append(adl["pred_cv"][i])
-
-            tr_all_data_log["accuracy"].append(tadl["accuracy"][i])
-            tr_all_data_log["recall0"].append(tadl["recall0"][i])
-            tr_all_data_log["precision0"].append(tadl["precision0"][i])
-            tr_all_data_log["recall1"].append(tadl["recall1"][i])
-            tr_all_data_log["precision1"].append(tadl["precision1"][i])
-            tr_all_data_log["num_label0"].append(tadl["num_label0"][i])
-            tr_all_data_log["num_label1"].append(tadl["num_label1"][i])
-            tr_all_data_log["num_labels"].append(tadl["num_labels"][i])
-            tr_all_data_log["true_cv"].append(tadl["true_cv"][i])
-            tr_all_data_log["pred_cv"].append(tadl["pred_cv"][i])
-
-            pat_all_data_log["accuracy"].append(padl["accuracy"][i])
-            pat_all_data_log["recall0"].append(padl["recall0"][i])
-            pat_all_data_log["precision0"].append(padl["precision0"][i])
-            pat_all_data_log["recall1"].append(padl["recall1"][i])
-            pat_all_data_log["precision1"].append(padl["precision1"][i])
-            pat_all_data_log["num_label0"].append(padl["num_label0"][i])
-            pat_all_data_log["num_label1"].append(padl["num_label1"][i])
-            pat_all_data_log["num_labels"].append(padl["num_labels"][i])
             pat_all_data_log["pred_percentages"].extend(padl["true_cv"][i])
             pat_all_data_log["true_percentages"].extend(padl["pred_cv"][i])
-            pat_all_data_log["true_cv"].append(padl["true_cv"][i])
-            pat_all_data_log["pred_cv"].append(padl["pred_cv"][i])
 
             rocs.append(rcs[i])
             continue
@@ -1736,9 +2051,10 @@ def correct_old_runs(layers, optimizer, loss, x_whole, y_whole, patients_whole,
             parameters = flexible_neural_net((x_train_cv, y_train_cv), (x_test_cv, y_test_cv),
                                              optimizer, loss, *layers, initial_weights=weights,
                                              batch_size=32, epochs=num_epochs,
-                                             early_stopping=None, verbose=verbose,
+                                             early_stopping=early_stopping, verbose=verbose,
                                              files_suffix=i, location=location, return_more=True)
             [lTr, aTr], [lTe, aTe], time, location, n_epochs, weights, model, history = parameters
+            _pad_history(history, num_epochs)
             if aTr > 0.7:
                 break
             else:
@@ -1781,12 +2097,10 @@ def correct_old_runs(layers, optimizer, loss, x_whole, y_whole, patients_whole,
             dummy1, dummy2, dummy3 = None, None, None
 
         # Save learning curve
-        if historic_acc is None:
-            historic_acc = np.array(history.history['acc'])
-            historic_val_acc = np.array(history.history['val_acc'])
-        else:
-            historic_acc += history.history['acc']
-            historic_val_acc += history.history['val_acc']
+        np.add(historic_acc, np.asarray(history.history['acc'], dtype=np.float32),
+               out=historic_acc)
+        np.add(historic_val_acc, np.asarray(history.history['val_acc'], dtype=np.float32),
+               out=historic_val_acc)
 
         # Save statistical data for cross val set
         print("Test Statistics:")
@@ -1794,14 +2108,14 @@ def correct_old_runs(layers, optimizer, loss, x_whole, y_whole, patients_whole,
         accuracy, precision, recall, num_labels, true_cv, pred_cv = params
         all_data_log["history_acc"].append(history.history['acc'])
         all_data_log["history_val_acc"].append(history.history['val_acc'])
-        all_data_log["accuracy"].append(accuracy)
-        all_data_log["recall0"].append(recall[0])
-        all_data_log["precision0"].append(precision[0])
-        all_data_log["recall1"].append(recall[1])
-        all_data_log["precision1"].append(precision[1])
-        all_data_log["num_label0"].append(num_labels[0])
-        all_data_log["num_label1"].append(num_labels[1])
-        all_data_log["num_labels"].append(num_labels[1] + num_labels[0])
+        all_data_log["accuracy"][i] = accuracy
+        all_data_log["recall0"][i] = recall[0]
+        all_data_log["precision0"][i] = precision[0]
+        all_data_log["recall1"][i] = recall[1]
+        all_data_log["precision1"][i] = precision[1]
+        all_data_log["num_label0"][i] = num_labels[0]
+        all_data_log["num_label1"][i] = num_labels[1]
+        all_data_log["num_labels"][i] = num_labels[1] + num_labels[0]
         all_data_log["true_cv"].append(true_cv)
         all_data_log["pred_cv"].append(pred_cv)
 
@@ -1809,14 +2123,14 @@ def correct_old_runs(layers, optimizer, loss, x_whole, y_whole, patients_whole,
         print("Training Statistics:")
         params = get_confusion_matrix(model, x_train_cv, y_train_cv, dummy2)
         accuracy, precision, recall, num_labels, true_tr, pred_tr = params
-        tr_all_data_log["accuracy"].append(accuracy)
-        tr_all_data_log["recall0"].append(recall[0])
-        tr_all_data_log["precision0"].append(precision[0])
-        tr_all_data_log["recall1"].append(recall[1])
-        tr_all_data_log["precision1"].append(precision[1])
-        tr_all_data_log["num_label0"].append(num_labels[0])
-        tr_all_data_log["num_label1"].append(num_labels[1])
-        tr_all_data_log["num_labels"].append(num_labels[1] + num_labels[0])
+        tr_all_data_log["accuracy"][i] = accuracy
+        tr_all_data_log["recall0"][i] = recall[0]
+        tr_all_data_log["precision0"][i] = precision[0]
+        tr_all_data_log["recall1"][i] = recall[1]
+        tr_all_data_log["precision1"][i] = precision[1]
+        tr_all_data_log["num_label0"][i] = num_labels[0]
+        tr_all_data_log["num_label1"][i] = num_labels[1]
+        tr_all_data_log["num_labels"][i] = num_labels[1] + num_labels[0]
         tr_all_data_log["true_cv"].append(true_cv)
         tr_all_data_log["pred_cv"].append(pred_cv)
 
@@ -1825,14 +2139,14 @@ def correct_old_runs(layers, optimizer, loss, x_whole, y_whole, patients_whole,
         params = get_confusion_matrix_for_patient(model, x_test_cv, y_test_cv, patients_test_cv,
                                                   dummy3)
         accuracy, precision, recall, num_labels, pred_percentages, true_percentages = params
-        pat_all_data_log["accuracy"].append(accuracy)
-        pat_all_data_log["recall0"].append(recall[0])
-        pat_all_data_log["precision0"].append(precision[0])
-        pat_all_data_log["recall1"].append(recall[1])
-        pat_all_data_log["precision1"].append(precision[1])
-        pat_all_data_log["num_label0"].append(num_labels[0])
-        pat_all_data_log["num_label1"].append(num_labels[1])
-        pat_all_data_log["num_labels"].append(num_labels[1] + num_labels[0])
+        pat_all_data_log["accuracy"][i] = accuracy
+        pat_all_data_log["recall0"][i] = recall[0]
+        pat_all_data_log["precision0"][i] = precision[0]
+        pat_all_data_log["recall1"][i] = recall[1]
+        pat_all_data_log["precision1"][i] = precision[1]
+        pat_all_data_log["num_label0"][i] = num_labels[0]
+        pat_all_data_log["num_label1"][i] = num_labels[1]
+        pat_all_data_log["num_labels"][i] = num_labels[1] + num_labels[0]
         pat_all_data_log["pred_percentages"].extend(pred_percentages)
         pat_all_data_log["true_percentages"].extend(true_percentages)
         pat_all_data_log["true_cv"].append(pred_percentages)
@@ -1845,18 +2159,26 @@ def correct_old_runs(layers, optimizer, loss, x_whole, y_whole, patients_whole,
         print("Time taken:        {0:.3f} seconds".format(time))
         print("Location:          {}".format(location))
 
-        # Compute ROC curve and ROC area for each class
-        fpr = dict()
-        tpr = dict()
-        roc_auc = dict()
-        for i in range(2):  # Only 2 classes
-            fpr[i], tpr[i], _ = roc_curve(true_cv[:, i], pred_cv[:, i])
-            roc_auc[i] = auc(fpr[i], tpr[i])
-        # Compute micro-average ROC curve and ROC area
-        fpr["micro"], tpr["micro"], _ = roc_curve(true_cv.ravel(), pred_cv.ravel())
-        roc_auc["micro"] = auc(fpr["micro"], tpr["micro"])
+        # Compute ROC curve and ROC area for each class; the class-0 curve
+        # follows from the class-1 curve by symmetry (the softmax columns sum
+        # to 1), saving one of the sorts
+        fpr1, tpr1, _ = binary_roc(true_cv[:, 1], pred_cv[:, 1])
+        fpr0 = (1 - tpr1)[::-1]
+        tpr0 = (1 - fpr1)[::-1]
+        # Compute micro-average ROC curve and ROC area; slot 2 of the tuples
+        fpr_micro, tpr_micro, _ = binary_roc(true_cv.ravel(), pred_cv.ravel())
+        fpr = (fpr0, fpr1, fpr_micro)
+        tpr = (tpr0, tpr1, tpr_micro)
+        roc_auc = tuple(np.trapz(t, f) for t, f in zip(tpr, fpr))
         rocs.append((fpr, tpr, roc_auc))
 
+        # Drop this fold's model, history and predictions before the next
+        # iteration trains, so their buffers are reclaimed now rather than
+        # only when the names are rebound (weights stays alive for the
+        # initial_weights reset of the next fold)
+        del parameters, model, history
+        gc.collect()
+
     # Convert historic_acc into average value
     historic_acc = historic_acc / num_folds
     historic_val_acc = historic_val_acc / num_folds
@@ -1872,122 +2194,81 @@ def correct_old_runs(layers, optimizer, loss, x_whole, y_whole, patients_whole,
     plot_multiple_accuracy_curves(all_data_log["history_acc"], all_data_log["history_val_acc"],
                                   title="Accuracy History  vs.  Dataset Size", fig_num=f,
                                   show=show_plots, labels=title_train)
+    # Figs 3-8 share the same x axis, so each figure is one batched dispatch
+    metric_keys = ("accuracy", "recall0", "recall1", "precision0", "precision1")
+    metric_labels = ("Accuracy", "Recall 0", "Recall 1", "Precision 0", "Precision 1")
+    size_keys = ("num_label1", "num_labels")
+    size_labels = ("Number 1s", "Number 0s and 1s")
     # Fig 3
-    f = 3
-    plot_line(all_data_log["accuracy"], num_patients_tr, label="Accuracy", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(all_data_log["recall0"], num_patients_tr, label="Recall 0", fig_num=f, x_scale="log",
-              show=show_plots, style=".-")
-    plot_line(all_data_log["recall1"], num_patients_tr, label="Recall 1", fig_num=f, x_scale="log",
-              show=show_plots, style=".-")
-    plot_line(all_data_log["precision0"], num_patients_tr, label="Precision 0", x_scale="log",
-              fig_num=f, show=show_plots, style=".-")
-    plot_line(all_data_log["precision1"], num_patients_tr, label="Precision 1", x_scale="log",
-              fig_num=f, title="Test Accuracy, Recall and Precision",
-              show=show_plots, style=".-", x_label="Number of Patients in Training Set")
+    plot_lines([all_data_log[k] for k in metric_keys], num_patients_tr, metric_labels, fig_num=3,
+               title="Test Accuracy, Recall and Precision", show=show_plots, style=".-",
+               x_label="Number of Patients in Training Set", x_scale="log")
     # Fig 4
-    f = 4
-    plot_line(all_data_log["num_label1"], num_patients_tr, label="Number 1s", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(all_data_log["num_labels"], num_patients_tr, label="Number 0s and 1s",
-              fig_num=f, title="Test Set Size", axis=[None, None, 0, None], style=".-",
-              x_label="Number of Patients in Training Set", show=show_plots,  x_scale="log")
+    plot_lines([all_data_log[k] for k in size_keys], num_patients_tr, size_labels, fig_num=4,
+               title="Test Set Size", axis=[None, None, 0, None], style=".-",
+               x_label="Number of Patients in Training Set", show=show_plots, x_scale="log")
     # Fig 5
-    f = 5
-    plot_line(tr_all_data_log["accuracy"], num_patients_tr, label="Accuracy", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(tr_all_data_log["recall0"], num_patients_tr, label="Recall 0", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(tr_all_data_log["recall1"], num_patients_tr, label="Recall 1", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(tr_all_data_log["precision0"], num_patients_tr, label="Precision 0",
-              fig_num=f, show=show_plots, style=".-", x_scale="log")
-    plot_line(tr_all_data_log["precision1"], num_patients_tr, label="Precision 1",
-              fig_num=f, title="Training Accuracy, Recall and Precision", show=show_plots,
-              x_label="Number of Patients in Training Set", style=".-", x_scale="log")
+    plot_lines([tr_all_data_log[k] for k in metric_keys], num_patients_tr, metric_labels,
+               fig_num=5, title="Training Accuracy, Recall and Precision", show=show_plots,
+               style=".-", x_label="Number of Patients in Training Set", x_scale="log")
     # Fig 6
-    f = 6
-    plot_line(tr_all_data_log["num_label1"], num_patients_tr, label="Number 1s", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(tr_all_data_log["num_labels"], num_patients_tr, label="Number 0s and 1s",
-              fig_num=f, title="Training Set Size", axis=[None, None, 0, None], show=show_plots,
-              x_label="Number of Patients in Training Set", style=".-", x_scale="log")
+    plot_lines([tr_all_data_log[k] for k in size_keys], num_patients_tr, size_labels, fig_num=6,
+               title="Training Set Size", axis=[None, None, 0, None], show=show_plots,
+               x_label="Number of Patients in Training Set", style=".-", x_scale="log")
     # Fig 7
-    f = 7
-    plot_line(pat_all_data_log["accuracy"], num_patients_tr, label="Accuracy", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(pat_all_data_log["recall0"], num_patients_tr, label="Recall 0", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(pat_all_data_log["recall1"], num_patients_tr, label="Recall 1", fig_num=f,
-              show=show_plots, style=".-", x_scale="log")
-    plot_line(pat_all_data_log["precision0"], num_patients_tr, label="Precision 0",
-              fig_num=f, show=show_plots, style=".-", x_scale="log")
-    plot_line(pat_all_data_log["precision1"], num_patients_tr, label="Precision 1",
-              fig_num=f, title="Test Patient Accuracy, Recall and Precision", x_scale="log",
-              show=show_plots, x_label="Number of Patients in Training Set", style=".-")
+    plot_lines([pat_all_data_log[k] for k in metric_keys], num_patients_tr, metric_labels,
+               fig_num=7, title="Test Patient Accuracy, Recall and Precision", show=show_plots,
+               x_label="Number of Patients in Training Set", style=".-", x_scale="log")
     # Fig 8
-    f = 8
-    plot_line(pat_all_data_log["num_label1"], num_patients_tr, label="Number 1s",
-              fig_num=f, show=show_plots, style=".-", x_scale="log")
-    plot_line(pat_all_data_log["num_labels"], num_patients_tr, label="Number 0s and 1s",
-              fig_num=f, title="Test Patient Set Size", axis=[None, None, 0, None], style=".-",
-              show=show_plots, x_label="Number of Patients in Training Set", x_scale="log")
+    plot_lines([pat_all_data_log[k] for k in size_keys], num_patients_tr, size_labels, fig_num=8,
+               title="Test Patient Set Size", axis=[None, None, 0, None], style=".-",
+               show=show_plots, x_label="Number of Patients in Training Set", x_scale="log")
     # Fig 0
     f = 0
     plot_image(location + "/model0.png", fig_num=f, title="Model used", show=show_plots)
     # Fig 10
     f = 10
-    patient_changes = []
-    prev_label = 1
-    prev_patient = ""
-    for patient in patients_whole[:max(tr_idx)]:
-        if patient != prev_patient:
-            prev_patient = patient
-            prev_label = abs(prev_label - 1)  # Alternates 0 and 1
-        patient_changes.append(prev_label)
+    # Slice bound and integer labels computed once; int8 is plenty, the
+    # plotter only compares the values against 0 and 1
+    n_train_max = max(tr_idx)
+    patient_changes = alternating_patient_stripe(patients_whole[:n_train_max])
+    # For one-hot binary labels, column 1 already is the argmax
+    y_int = y_whole[:n_train_max, 1].astype(np.int8)
     plot_binary_background(patient_changes, fig_num=f, show=show_plots, min_max_values=(0.2, 1),
                            labels=("Odd index patients", "Even index patients"))
-    plot_binary_background(np.argmax(y_whole[:max(tr_idx)], axis=1), fig_num=f, show=show_plots,
+    plot_binary_background(y_int, fig_num=f, show=show_plots,
                            title="Dataset patient distribution vs. Number of patients splits",
                            x_label="Slice number", labels=("Label 0", "Label 1"),
                            min_max_values=(0, 0.2), color0="cyan", color1="magenta")
-    for i, split in enumerate([te_idx] + tr_idx):
-        split_label = None
-        if i == 0:
-            split_label = "Patient split"
-        plot_line([0, 1], [split, split], fig_num=f, label=split_label, color="#ffff00",
-                  style="--", show=show_plots)
+    ax = plt.figure(f).gca()
+    ax.vlines([te_idx] + list(tr_idx), 0, 1, colors="#ffff00", linestyles="--",
+              label="Patient split")
+    ax.legend()
     # Fig 11
     f = 11
     plot_multiple_roc_curves(rocs, title="ROC Curves  vs.  Dataset Size", fig_num=f,
                              show=show_plots, labels=title_train)
     # Fig 12
     f = 12
-    # Put all true_cv and pred_cv in one vector
-    true_c, pred_c = None, None
-    for tc, pc in zip(all_data_log["true_cv"], all_data_log["pred_cv"]):
-        if true_c is None:
-            true_c = np.array(tc)
-            pred_c = np.array(pc)
-        else:
-            true_c = np.concatenate([true_c, tc])
-            pred_c = np.concatenate([pred_c, pc])
+    # Put all true_cv and pred_cv in one vector (one concatenation instead of
+    # growing the accumulator step by step, which recopied it every iteration)
+    true_c = np.concatenate(all_data_log["true_cv"], axis=0)
+    pred_c = np.concatenate(all_data_log["pred_cv"], axis=0)
     # Compute ROC curve and ROC area for each class
-    mean_fpr = dict()
-    mean_tpr = dict()
-    mean_roc_auc = dict()
-    for i in range(2):  # Only 2 classes
-        mean_fpr[i], mean_tpr[i], _ = roc_curve(true_c[:, i], pred_c[:, i])
-        mean_roc_auc[i] = auc(mean_fpr[i], mean_tpr[i])
+    mean_fpr1, mean_tpr1, _ = binary_roc(true_c[:, 1], pred_c[:, 1])
+    mean_fpr0 = (1 - mean_tpr1)[::-1]
+    mean_tpr0 = (1 - mean_fpr1)[::-1]
     # Compute micro-average ROC curve and ROC area
-    mean_fpr["micro"], mean_tpr["micro"], _ = roc_curve(true_c.ravel(), pred_c.ravel())
-    mean_roc_auc["micro"] = auc(mean_fpr["micro"], mean_tpr["micro"])
+    mean_fpr_micro, mean_tpr_micro, _ = binary_roc(true_c.ravel(), pred_c.ravel())
+    mean_fpr = (mean_fpr0, mean_fpr1, mean_fpr_micro)
+    mean_tpr = (mean_tpr0, mean_tpr1, mean_tpr_micro)
+    mean_roc_auc = tuple(np.trapz(t, f) for t, f in zip(mean_tpr, mean_fpr))
     # Plot average ROC curve
     plot_roc_curve(mean_fpr, mean_tpr, mean_roc_auc, title="Model Mean ROC Curve", fig_num=f,
                    show=show_plots)
 
     # Save all figures to a PDF called figures.pdf
-    save_plt_figures_to_pdf(location + "/" + pdf_name)
+    save_plt_figures_to_pdf(location + "/" + pdf_name, close=not show_plots)
     if show_plots:
         input("Press ENTER to close figures")
         plt.close("all")
@@ -1995,8 +2276,13 @@ def correct_old_runs(layers, optimizer, loss, x_whole, y_whole, patients_whole,
 
 
 def create_simplified_layers(input_shape, labels, units=16, num_fully_connected=1, dropout1=0,
-                             dropout2=0):
-    """Create list of layers based on some parameters."""
+                             dropout2=0, pooling="flatten"):
+    """Create list of layers based on some parameters.
+
+    pooling="flatten" keeps the original Flatten head; pooling="gap" averages
+    the spatial dims away instead, so the first Dense weight matrix shrinks
+    from prod(input_shape) x units to channels x units.
+    """
     # Define model
     units = units  # [8, 16, 32, 64]
     activation = "relu"  # ["relu", "tanh"]
@@ -2010,7 +2296,11 @@ def create_simplified_layers(input_shape, labels, units=16, num_fully_connected=
     fully_connected_layers = []
     for n in range(num_fully_connected_layers):
         fully_connected_layers.append(Dense(units, activation=activation))
-    layers = [Flatten(input_shape=input_shape),
+    if pooling == "gap":
+        first_layer = GlobalAveragePooling2D(input_shape=input_shape)
+    else:
+        first_layer = Flatten(input_shape=input_shape)
+    layers = [first_layer,
               *fully_connected_layers,
               *dropout1,
               Dense(units, activation=activation),
@@ -2064,26 +2354,21 @@ def create_layers(input_shape, labels, filters=16, units=16, num_convolutions=1,
     return layers, optimizer, loss
 
 
-def main(correction):
-    """Get dataset and train model.
+_PREPARED_DATA_CACHE = {}
 
-    How to use correction: some nn are not trained for some unknown bug. Those can be
-    manually selected and rerun. Correction should be a list of tuples where first element
-    is comb and second element is number of training samples, or None if all comb has to be rerun.
 
-    Corrections only work for training, they have not been tested for cross validation!
-    """
-    # Print when and how job starts
-    print("--------------------------------------------------------------------------------------")
-    now = datetime.now()
-    date_formated = "{} {:02d}:{:02d}:{:02d}".format(now.date(), now.hour, now.minute, now.second)
-    print("|  Running: {:<71}  |".format(" ".join(sys.argv)))
-    print("|  Time:    {:<71}  |".format(date_formated))
-    print("--------------------------------------------------------------------------------------")
-
-    # Parse arguments
-    args = parse_arguments()
+def prepare_dataset(args):
+    """Load and preprocess the whole dataset for one sweep configuration.
 
+    The result is cached per configuration, so when several main() calls run
+    in the same process (e.g. a series of correction sweeps) only the first
+    one pays for the concatenation, the one-hot encoding and the reordering.
+    """
+    key = (args.dataset, args.dataset_test, args.size, args.organize_patients)
+    try:
+        return _PREPARED_DATA_CACHE[key]
+    except KeyError:
+        pass
     # Load dataset
     dataset_location = args.dataset
     if not os.path.exists(dataset_location) and not dataset_location.startswith("data/"):
@@ -2091,10 +2376,16 @@ def main(correction):
     train_set, test_set, train_aux, test_aux = load_organized_dataset(dataset_location)
     (x_train, y_train), (x_test, y_test), = train_set, test_set
     (patients_train, mask_train), (patients_test, mask_test) = train_aux, test_aux
-    x_whole = np.append(x_train, x_test, axis=0)
-    y_whole = np.append(y_train, y_test, axis=0)
-    mask_whole = np.append(mask_train, mask_test, axis=0)
-    patients_whole = np.append(patients_train, patients_test, axis=0)
+    # np.concatenate instead of np.append: same result, but np.append is just
+    # a wrapper that re-wraps its arguments on every call
+    x_whole = np.concatenate((x_train, x_test), axis=0)
+    # Keras feeds the backend floatx (float32) anyway, so float64 voxels from
+    # older dataset files would only double RAM and copy bandwidth
+    if x_whole.dtype != np.float32:
+        x_whole = x_whole.astype(np.float32)
+    y_whole = np.concatenate((y_train, y_test), axis=0)
+    mask_whole = np.concatenate((mask_train, mask_test), axis=0)
+    patients_whole = np.concatenate((patients_train, patients_test), axis=0)
     analyze_data(x_whole, y_whole, patients_whole, mask_whole, plot_data=False, dataset_name=None)
 
     # Load test dataset if it exists
@@ -2105,10 +2396,12 @@ def main(correction):
         train_t_set, test_t_set, train_t_aux, test_t_aux = load_organized_dataset(dataset_test_loc)
         (x_t_train, y_t_train), (x_t_test, y_t_test), = train_t_set, test_t_set
         (patients_t_train, mask_t_train), (patients_t_test, mask_t_test) = train_t_aux, test_t_aux
-        x_t_whole = np.append(x_t_train, x_t_test, axis=0)
-        y_t_whole = np.append(y_t_train, y_t_test, axis=0)
-        mask_t_whole = np.append(mask_t_train, mask_t_test, axis=0)
-        patients_t_whole = np.append(patients_t_train, patients_t_test, axis=0)
+        x_t_whole = np.concatenate((x_t_train, x_t_test), axis=0)
+        if x_t_whole.dtype != np.float32:
+            x_t_whole = x_t_whole.astype(np.float32)
+        y_t_whole = np.concatenate((y_t_train, y_t_test), axis=0)
+        mask_t_whole = np.concatenate((mask_t_train, mask_t_test), axis=0)
+        patients_t_whole = np.concatenate((patients_t_train, patients_t_test), axis=0)
         analyze_data(x_t_whole, y_t_whole, patients_t_whole, mask_t_whole, plot_data=False,
                      dataset_name=None)
 
@@ -2117,31 +2410,30 @@ def main(correction):
     params = limit_number_patients_per_label(x_whole, y_whole, mask_whole, patients_whole,
                                              num_patients_per_label=args.size, adjacent=False)
     x_whole, y_whole, mask_whole, patients_whole = params
+    patients = np.unique(patients_whole)  # Sorted once; every count below reuses it
     if args.size is not None:
         print("Dataset limited to {} samples which contain {} unique patients"
-              "".format(len(x_whole), len(np.unique(patients_whole))))
+              "".format(len(x_whole), len(patients)))
         analyze_data(x_whole, y_whole, patients_whole, mask_whole, plot_data=False,
                      dataset_name=None)
     else:
         print("Dataset contains {} samples which contain {} unique patients"
-              "".format(len(x_whole), len(np.unique(patients_whole))))
+              "".format(len(x_whole), len(patients)))
 
-    patients = np.unique(patients_whole)
+    patients_te = None
     if args.dataset_test is not None:
         patients_te = np.unique(patients_t_whole)
-        for p in patients:
-            if p in patients_te:
-                raise Exception("Training and test set have repeated patients")
+        # Both arrays are unique and sorted, so one merge pass finds overlaps
+        # instead of a linear scan of patients_te per patient
+        repeated = np.intersect1d(patients, patients_te, assume_unique=True)
+        if len(repeated) > 0:
+            raise Exception("Training and test set have repeated patients")
     input_shape = x_whole.shape[1:]
     num_patients = len(patients)
     labels = np.unique(y_whole)
     y_whole = np_utils.to_categorical(y_whole, len(labels))
-    y_train = np_utils.to_categorical(y_train, len(labels))
-    y_test = np_utils.to_categorical(y_test, len(labels))
     if args.dataset_test is not None:
         y_t_whole = np_utils.to_categorical(y_t_whole, len(labels))
-        y_t_train = np_utils.to_categorical(y_t_train, len(labels))
-        y_t_test = np_utils.to_categorical(y_t_test, len(labels))
         test_data = x_t_whole, y_t_whole, patients_t_whole, mask_t_whole
     else:
         test_data = None
@@ -2155,6 +2447,43 @@ def main(correction):
         print("Number patients: {} (label 0: {}, label 1: {})".format(numpatients0 + numpatients1,
                                                                       numpatients0, numpatients1))
 
+    prepared = (x_whole, y_whole, mask_whole, patients_whole, patients, patients_te,
+                num_patients, input_shape, labels, test_data, x_train.shape, x_test.shape)
+    _PREPARED_DATA_CACHE[key] = prepared
+    return prepared
+
+
+def main(correction):
+    """Get dataset and train model.
+
+    How to use correction: some nn are not trained for some unknown bug. Those can be
+    manually selected and rerun. Correction should be a list of tuples where first element
+    is comb and second element is number of training samples, or None if all comb has to be rerun.
+
+    Corrections only work for training, they have not been tested for cross validation!
+    """
+    # Print when and how job starts
+    print("--------------------------------------------------------------------------------------")
+    now = datetime.now()
+    date_formated = "{} {:02d}:{:02d}:{:02d}".format(now.date(), now.hour, now.minute, now.second)
+    print("|  Running: {:<71}  |".format(" ".join(sys.argv)))
+    print("|  Time:    {:<71}  |".format(date_formated))
+    print("--------------------------------------------------------------------------------------")
+
+    # Parse arguments
+    args = parse_arguments()
+
+    # The correction list can also come from a JSON manifest, so switching
+    # sweeps does not require editing this file
+    if args.correction_file is not None:
+        with open(args.correction_file) as f:
+            correction = [(tuple(cmb), num_tr) for cmb, num_tr in json.load(f)]
+        args.correction = True
+
+    # Load and preprocess dataset (cached across main() calls in a sweep)
+    (x_whole, y_whole, mask_whole, patients_whole, patients, patients_te, num_patients,
+     input_shape, labels, test_data, train_shape, test_shape) = prepare_dataset(args)
+
     if args.plot_slices:
         plt.close("all")
         i = 0
@@ -2175,8 +2504,8 @@ def main(correction):
         plt.close("all")
 
     # Print some information of data
-    print("Training set shape:  {}".format(x_train.shape))
-    print("Test set shape:      {}".format(x_test.shape))
+    print("Training set shape:  {}".format(train_shape))
+    print("Test set shape:      {}".format(test_shape))
     print("Whole set shape:     {}".format(x_whole.shape))
     print("Existing labels:     {}".format(labels))
     print("Number of patients:  {}".format(num_patients))
@@ -2187,12 +2516,12 @@ def main(correction):
     # Create folder where we will save data
     location = args.location  # Use already existing folder, will not do work already done again
     if location is None:
+        # One directory listing instead of one stat round trip per candidate
+        existing = set(os.listdir("."))
         n = 0
-        while True:
-            location = "nn{:04d}".format(n)
-            if not os.path.exists(location):
-                break
+        while "nn{:04d}".format(n) in existing:
             n += 1
+        location = "nn{:04d}".format(n)
     try:
         os.makedirs(location)
     except OSError:
@@ -2261,21 +2590,76 @@ def main(correction):
         maxpool = False
         padding = "same"
     all_data = []
+    # Stream each combination's record to the global results file as it
+    # finishes: a crash keeps everything done so far, and the end of the run
+    # no longer re-serializes the whole list in one bulk dump
+    global_results_name = location + "/results{}.pkl".format(s)
+    if args.parallel_comb:
+        # Concurrent instances pointed at the same location each stream to
+        # their own part file (merged by find_mean_results.load_results);
+        # sharing one file would interleave and corrupt the pickle stream
+        global_results_name = location + "/results{}.pid{}.pkl".format(s, os.getpid())
+    global_results_file = open(global_results_name, 'wb')
     num_comb = len(filters) * len(units) * len(num_convolutions) * len(dropout1) * len(dropout2)
-    i = 0
-    times_taken = []
-    for comb in itertools.product(filters, units, num_convolutions, dropout1, dropout2):
-        t = clock()
-        # Create layers list that will define model
-        f, u, c, d1, d2 = comb
+
+    def build_layers(comb):
+        """Create the layers list that will define the model of one combination.
+
+        Called only when the combination actually trains (or corrects), so
+        skipped combinations never pay for the Keras layer construction.
+        """
+        filt, u, c, d1, d2 = comb
         if args.simplified_model:
-            layers, optimizer, loss = create_simplified_layers(input_shape, labels,
-                                                               units=u, num_fully_connected=c,
-                                                               dropout1=d1, dropout2=d2)
-        else:
-            layers, optimizer, loss = create_layers(input_shape, labels, filters=f, units=u,
-                                                    num_convolutions=c, dropout1=d1, dropout2=d2,
-                                                    maxpool=maxpool, padding=padding)
+            return create_simplified_layers(input_shape, labels, units=u, num_fully_connected=c,
+                                            dropout1=d1, dropout2=d2)
+        return create_layers(input_shape, labels, filters=filt, units=u, num_convolutions=c,
+                             dropout1=d1, dropout2=d2, maxpool=maxpool, padding=padding)
+
+    combinations = list(itertools.product(filters, units, num_convolutions, dropout1, dropout2))
+    if args.halving and len(combinations) > 1:
+        # Successive-halving style screening: every combination gets a quarter
+        # of the epochs, and only the best third trains with the full budget.
+        # Screening results land in their own screen-* subfolders so they
+        # never collide with the full runs
+        screen_epochs = max(1, args.epochs // 4)
+        print("\nScreening {} combinations with {} epochs each..."
+              "".format(len(combinations), screen_epochs))
+        scores = []
+        for comb in combinations:
+            screen_location = location + "/screen-" + "-".join([str(x) for x in comb])
+            layers, optimizer, loss = build_layers(comb)
+            if args.do_cross_val:
+                params = do_cross_validation(layers, optimizer, loss, x_whole, y_whole,
+                                             patients_whole, num_patients,
+                                             location=screen_location, num_folds=args.folds,
+                                             verbose=args.verbose,
+                                             patient_level_cv=not args.slice_level_cross_val,
+                                             num_epochs=screen_epochs, comb=comb,
+                                             show_plots=False, shuffle=False,
+                                             early_stopping=args.early_stopping)
+            else:
+                params = do_training_test(layers, optimizer, loss, x_whole, y_whole,
+                                          patients_whole, num_patients,
+                                          location=screen_location, verbose=args.verbose,
+                                          num_epochs=screen_epochs, show_plots=False, comb=comb,
+                                          num_patients_te=args.test_size,
+                                          num_patients_tr=num_patient_tr, test_data=test_data,
+                                          test_mask_spheres=args.test_mask_spheres,
+                                          early_stopping=args.early_stopping)
+            # Rank by mean patient-level accuracy, the metric the sweeps compare
+            scores.append(np.mean(params[2]["accuracy"]))
+            print("Screening score for {}: {}".format(comb, scores[-1]))
+        keep = max(1, -(-len(combinations) // 3))
+        best = sorted(np.argsort(scores)[::-1][:keep])
+        combinations = [combinations[j] for j in best]
+        num_comb = len(combinations)
+        print("\nKeeping {} combinations for the full budget: {}"
+              "".format(num_comb, combinations))
+
+    i = 0
+    total_time = 0  # Running sum: the mean is O(1) instead of np.mean over a growing list
+    for comb in combinations:
+        t = perf_counter()
         i += 1
         print("\n================================================================================")
         print("\nCombination {}/{}. Combination: {}".format(i, num_comb, comb))
@@ -2284,14 +2668,57 @@ def main(correction):
         suffix = "-{}".format(comb)
         pdf_name = "figures{}.pdf".format(suffix)
         results_name = "results{}.pkl".format(suffix)
-        if not os.path.isfile(sublocation + "/" + pdf_name):
+        claim_name = sublocation + "/combination.lock"
+        # One listing of the combination folder replaces the per-file stats
+        try:
+            sub_files = set(os.listdir(sublocation))
+        except OSError:
+            sub_files = set()
+        all_data_comb = None
+        if args.reuse_results:
+            # Share trained combinations across runs (several sweeps repeat
+            # configurations): the key hashes everything that changes what a
+            # training produces, so any match is safe to reuse
+            config = repr((args.dataset, args.dataset_test, args.size, args.organize_patients,
+                           args.do_cross_val, args.slice_level_cross_val, args.folds, args.epochs,
+                           args.early_stopping, args.test_size, num_patient_tr,
+                           args.test_mask_spheres, args.simplified_model, comb))
+            cache_name = "trained_cache/" + hashlib.sha1(config.encode()).hexdigest() + ".pkl"
+            if pdf_name not in sub_files:
+                try:
+                    with open(cache_name, 'rb') as f:
+                        all_data_comb = pickle.load(f)
+                    print("\nReusing results of a previous run for combination {} (from '{}')."
+                          "".format(comb, cache_name))
+                except (OSError, EOFError, pickle.UnpicklingError):
+                    all_data_comb = None
+        if all_data_comb is not None:
+            pass  # Cached results found, skip training and figure generation
+        elif pdf_name not in sub_files:
+            if args.parallel_comb:
+                # Claim the combination atomically so concurrent instances of
+                # the sweep never train the same one twice; a leftover lock
+                # from a crashed run must be deleted by hand before resuming
+                try:
+                    os.makedirs(sublocation)
+                except OSError:
+                    pass
+                try:
+                    os.close(os.open(claim_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                except OSError:
+                    print("\nCombination {} is claimed by another instance, skipping."
+                          "".format(comb))
+                    continue
+            layers, optimizer, loss = build_layers(comb)
             if args.do_cross_val:
                 params = do_cross_validation(layers, optimizer, loss, x_whole, y_whole,
                                              patients_whole, num_patients, location=sublocation,
                                              num_folds=args.folds, verbose=args.verbose,
                                              patient_level_cv=not args.slice_level_cross_val,
                                              num_epochs=args.epochs, pdf_name=pdf_name, comb=comb,
-                                             show_plots=args.plot, shuffle=False)
+                                             show_plots=args.plot, shuffle=False,
+                                             parallel_folds=args.parallel_folds,
+                                             early_stopping=args.early_stopping)
             else:
                 params = do_training_test(layers, optimizer, loss, x_whole, y_whole,
                                           patients_whole, num_patients, location=sublocation,
@@ -2299,26 +2726,49 @@ def main(correction):
                                           pdf_name=pdf_name, show_plots=args.plot, comb=comb,
                                           num_patients_te=args.test_size,
                                           num_patients_tr=num_patient_tr, test_data=test_data,
-                                          test_mask_spheres=args.test_mask_spheres)
+                                          test_mask_spheres=args.test_mask_spheres,
+                                          early_stopping=args.early_stopping)
             all_data_comb = (comb, *params)
             with open(sublocation + "/" + results_name, 'wb') as f:
-                pickle.dump(all_data_comb, f)
+                pickle.dump(all_data_comb, f, protocol=pickle.HIGHEST_PROTOCOL)
+            if args.reuse_results:
+                try:
+                    os.makedirs("trained_cache")
+                except OSError:
+                    pass
+                with open(cache_name, 'wb') as f:
+                    pickle.dump(all_data_comb, f, protocol=pickle.HIGHEST_PROTOCOL)
+            if args.parallel_comb:
+                try:
+                    os.remove(claim_name)
+                except OSError:
+                    pass
         else:
             # Instead of doing training or cv again, if the data already exists, load data saved
             print("\nFile '{}' already exists, skipping combination {}."
                   "".format(sublocation + "/" + pdf_name, comb))
-            if os.path.isfile(sublocation + "/" + results_name):
+            if results_name in sub_files:
                 with open(sublocation + "/" + results_name, 'rb') as f:
                     all_data_comb = pickle.load(f)
                 print("Loaded old results from '{}'."
                       "".format(sublocation + "/" + results_name))
                 # This will be called when a correction has to be performed
                 if args.correction and comb in correction_ht:
+                    if args.parallel_comb:
+                        # Corrections train models too, so concurrent instances
+                        # claim them with the same lock file as fresh runs
+                        try:
+                            os.close(os.open(claim_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                        except OSError:
+                            print("\nCorrection of {} is claimed by another instance, "
+                                  "skipping.".format(comb))
+                            continue
                     print("\nCorrection on the way! Training sizes: {}\n"
                           "".format(correction_ht[comb]))
                     if comb != all_data_comb[0]:
                         raise Exception("Error. Data was saved differently in this folder")
                     # Correct selected runs. Only works for training, not cv!
+                    layers, optimizer, loss = build_layers(comb)
                     params = correct_old_runs(layers, optimizer, loss, x_whole, y_whole,
                                               patients_whole, num_patients,
                                               all_data_comb[1:], location=sublocation,
@@ -2326,206 +2776,109 @@ def main(correction):
                                               pdf_name=pdf_name, show_plots=args.plot,
                                               comb=comb, num_patients_te=args.test_size,
                                               num_patients_tr=num_patient_tr,
-                                              corrections=correction_ht[comb])
+                                              corrections=correction_ht[comb],
+                                              early_stopping=args.early_stopping)
                     all_data_comb = (comb, *params)
                     # Save corrected results
                     with open(sublocation + "/" + results_name, 'wb') as f:
-                        pickle.dump(all_data_comb, f)
+                        pickle.dump(all_data_comb, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    if args.reuse_results:
+                        try:
+                            os.makedirs("trained_cache")
+                        except OSError:
+                            pass
+                        with open(cache_name, 'wb') as f:
+                            pickle.dump(all_data_comb, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    if args.parallel_comb:
+                        try:
+                            os.remove(claim_name)
+                        except OSError:
+                            pass
             else:
                 all_data_comb = None
                 print("File '{}' not found, global results will not include combination {}."
                       "".format(sublocation + "/" + results_name, comb))
         if all_data_comb is not None:
             all_data.append(all_data_comb)
-        times_taken.append(clock() - t)
+            pickle.dump(all_data_comb, global_results_file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        time_taken = perf_counter() - t
+        total_time += time_taken
+        mean_time = total_time / i
         print("\nFinished combination: {}".format(comb))
-        print("  Time taken:         {} s".format(times_taken[-1]))
-        print("  Mean time taken:    {} s".format(np.mean(times_taken)))
+        print("  Time taken:         {} s".format(time_taken))
+        print("  Mean time taken:    {} s".format(mean_time))
         print("  Expected time left: {} s ({} more jobs)"
-              "".format((num_comb - i) * np.mean(times_taken)), (num_comb - i))
+              "".format((num_comb - i) * mean_time, num_comb - i))
 
     # Plot summary of results
-    print("\nGenerating global figures...")
-    show_plots = args.plot
-    plt.close("all")
-    if args.do_cross_val:
-        title = "Cross Validation"
-    else:
-        title = "Test"
-    last_idx = len(all_data) - 1
-    wider_figsize = list(plt.rcParams.get('figure.figsize'))
-    wider_figsize[0] += 2.1
-    if args.do_cross_val:
-        x_axis = range(1, args.folds + 1)
-        x_scale = "linear"
-        x_label = "Cross Validation Fold Number"
-    elif not args.test_mask_spheres:
-        x_axis = num_patient_tr
-        x_scale = "log"
-        x_label = "Number of Patients in Training Set"
-    else:
-        x_axis = [10, 7, 5, 3, 2, 1]  # Hardcoded, almost Fibonacci numbers
-        x_scale = "linear"
-        x_label = "Radius Spheres in pixels"
-    x_history = range(1, args.epochs + 1)
-    for i, (comb, all_cv, all_train, pat_cv, history, rocs) in enumerate(all_data):
-        figsize = wider_figsize if i == 0 else None
-
-        plot_line(all_cv["accuracy"], x_axis, label=str(comb), fig_num=0, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="{} Accuracy".format(title), legend_out=(i == last_idx))
-        plot_line(all_cv["recall0"], x_axis, label=str(comb), fig_num=1, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="{} Recall (0)".format(title), legend_out=(i == last_idx))
-        plot_line(all_cv["recall1"], x_axis, label=str(comb), fig_num=2, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="{} Recall (1)".format(title), legend_out=(i == last_idx))
-        plot_line(all_cv["precision0"], x_axis, label=str(comb), fig_num=3, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="{} Precision (0)".format(title), legend_out=(i == last_idx))
-        plot_line(all_cv["precision1"], x_axis, label=str(comb), fig_num=4, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="{} Precision (1)".format(title), legend_out=(i == last_idx))
-
-        plot_line(all_train["accuracy"], x_axis, label=str(comb), fig_num=5, show=show_plots,
-                  marker=".",  x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="Training Accuracy", legend_out=(i == last_idx))
-        plot_line(all_train["recall0"], x_axis, label=str(comb), fig_num=6, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="Training Recall (0)", legend_out=(i == last_idx))
-        plot_line(all_train["recall1"], x_axis, label=str(comb), fig_num=7, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="Training Recall (1)", legend_out=(i == last_idx))
-        plot_line(all_train["precision0"], x_axis, label=str(comb), fig_num=8, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="Training Precision (0)", legend_out=(i == last_idx))
-        plot_line(all_train["precision1"], x_axis, label=str(comb), fig_num=9, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="Training Precision (1)", legend_out=(i == last_idx))
-
-        plot_line(pat_cv["accuracy"], x_axis, label=str(comb), fig_num=10, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="{} Patient Accuracy".format(title), legend_out=(i == last_idx))
-        plot_line(pat_cv["recall0"], x_axis, label=str(comb), fig_num=11, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="{} Patient Recall (0)".format(title), legend_out=(i == last_idx))
-        plot_line(pat_cv["recall1"], x_axis, label=str(comb), fig_num=12, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="{} Patient Recall (1)".format(title), legend_out=(i == last_idx))
-        plot_line(pat_cv["precision0"], x_axis, label=str(comb), fig_num=13, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="{} Patient Precision (0)".format(title), legend_out=(i == last_idx))
-        plot_line(pat_cv["precision1"], x_axis, label=str(comb), fig_num=14, show=show_plots,
-                  marker=".", x_label=x_label, x_scale=x_scale, figsize=figsize,
-                  title="{} Patient Precision (1)".format(title), legend_out=(i == last_idx))
-
-        plot_line(history[0], x_history, label=str(comb), fig_num=15, show=show_plots,
-                  figsize=figsize, title="Mean Training Accuracy History",
-                  legend_out=(i == last_idx), x_label="Epoch")
-        plot_line(history[1], x_history, label=str(comb), fig_num=16, show=show_plots,
-                  figsize=figsize, title="Mean Test Accuracy History", legend_out=(i == last_idx),
-                  x_label="Epoch")
-    # Save PDF results
-    save_plt_figures_to_pdf(location + "/figures{}.pdf".format(s))
-    # Show plots
-    if show_plots:
-        plt.ion()
-        plt.show()
-        input("Press ENTER to close all figures.")
+    if num_comb > 1:
+        print("\nGenerating global figures...")
+        show_plots = args.plot
         plt.close("all")
-        plt.ioff()
-    # Save data in file (just in case we want to print again)
-    print("Saving data, this may take a few minutes.")
-    with open(location + "/results{}.pkl".format(s), 'wb') as f:
-        pickle.dump(all_data, f)
-    print("Data saved in '{}'.".format(location + "/results{}.pkl".format(s)))
+        if args.do_cross_val:
+            title = "Cross Validation"
+        else:
+            title = "Test"
+        last_idx = len(all_data) - 1
+        wider_figsize = list(plt.rcParams.get('figure.figsize'))
+        wider_figsize[0] += 2.1
+        if args.do_cross_val:
+            x_axis = range(1, args.folds + 1)
+            x_scale = "linear"
+            x_label = "Cross Validation Fold Number"
+        elif not args.test_mask_spheres:
+            x_axis = num_patient_tr
+            x_scale = "log"
+            x_label = "Number of Patients in Training Set"
+        else:
+            x_axis = [10, 7, 5, 3, 2, 1]  # Hardcoded, almost Fibonacci numbers
+            x_scale = "linear"
+            x_label = "Radius Spheres in pixels"
+        x_history = range(1, args.epochs + 1)
+        # One (figure, data source, metric, title) table drives the seventeen
+        # per-combination summary plots that used to be hand-written blocks
+        metric_keys = ("accuracy", "recall0", "recall1", "precision0", "precision1")
+        metric_titles = ("Accuracy", "Recall (0)", "Recall (1)", "Precision (0)", "Precision (1)")
+        group_title_fmts = ("{} {{}}".format(title), "Training {}", "{} Patient {{}}".format(title))
+        summary_plots = []
+        for g, title_fmt in enumerate(group_title_fmts):
+            for k, key in enumerate(metric_keys):
+                summary_plots.append((5 * g + k, g + 1, key, title_fmt.format(metric_titles[k])))
+        for i, data_comb in enumerate(all_data):
+            comb, history = data_comb[0], data_comb[4]
+            figsize = wider_figsize if i == 0 else None
+            for fig_num, source_idx, key, fig_title in summary_plots:
+                plot_line(data_comb[source_idx][key], x_axis, label=str(comb), fig_num=fig_num,
+                          show=show_plots, marker=".", x_label=x_label, x_scale=x_scale,
+                          figsize=figsize, title=fig_title, legend_out=(i == last_idx))
+            plot_line(history[0], x_history, label=str(comb), fig_num=15, show=show_plots,
+                      figsize=figsize, title="Mean Training Accuracy History",
+                      legend_out=(i == last_idx), x_label="Epoch")
+            plot_line(history[1], x_history, label=str(comb), fig_num=16, show=show_plots,
+                      figsize=figsize, title="Mean Test Accuracy History",
+                      legend_out=(i == last_idx), x_label="Epoch")
+        # Save PDF results
+        save_plt_figures_to_pdf(location + "/figures{}.pdf".format(s), close=not show_plots)
+        # Show plots
+        if show_plots:
+            plt.ion()
+            plt.show()
+            input("Press ENTER to close all figures.")
+            plt.close("all")
+            plt.ioff()
+    else:
+        # One combination would only redraw single-line versions of the figures
+        # already saved in its own PDF
+        print("\nSingle combination, skipping global summary figures.")
+    # The per-combination records were already streamed while the loop ran
+    global_results_file.close()
+    print("Data saved in '{}'.".format(global_results_name))
 
 
 if __name__ == "__main__":
-    # Run with no corrections
+    # Run with no corrections by default. To rerun selected combinations,
+    # pass a manifest from the corrections folder, e.g.:
+    #     python3 single_experiment_runner.py -cf corrections/nn_models2_v3.json
+    # The manifests hold the old hardcoded nn_models1/2/3 sweep blocks.
     main(correction=[])
-    """
-    # nn_models1
-    main(correction=[
-                     [(64, 16, 2, 0, 0), [128, 512, 4096]],
-                     [(64, 16, 2, 0, 0.25), [2048]],
-                     [(64, 256, 2, 0, 0), [1024, 2048, 4096]],
-                     [(256, 16, 2, 0, 0), [256]],
-                     [(256, 16, 2, 0, 0.25), [256, 1024, 2048, 4096]],
-                     [(256, 64, 2, 0, 0.25), [512, 2048]],
-                     [(256, 256, 2, 0, 0), [2048]],
-                     [(256, 256, 2, 0, 0.25), [512, 1024, 4096]]
-                    ])
-    """
-    """
-    # nn_models1 v2
-    main(correction=[
-                     [(256, 16, 2, 0, 0.25), [2048]],
-                     [(256, 256, 2, 0, 0.25), [4096]]
-                    ])
-    """
-    """
-    # nn_models2
-    main(correction=[
-                     [(64, 16, 2, 0, 0.25), [256, 1024, 4096]],
-                     [(64, 64, 2, 0, 0.25), [2048]],
-                     [(64, 256, 2, 0, 0), [512]],
-                     [(256, 16, 2, 0, 0), [1024, 2048]],
-                     [(256, 16, 2, 0, 0.25), [512, 1024, 2048, 4096]],
-                     [(256, 64, 2, 0, 0.25), [512]],
-                     [(256, 256, 2, 0, 0), [256, 2048, 4096]],
-                     [(256, 256, 2, 0, 0.25), [256]]
-                    ])
-    """
-    """
-    # nn_models2 v2
-    main(correction=[
-                     [(256, 16, 2, 0, 0.25), [1024, 2048]],
-                     [(256, 256, 2, 0, 0), [4096]]
-                    ])
-    """
-    """
-    # nn_models2 v3
-    main(correction=[
-                     [(256, 16, 2, 0, 0.25), [2048]],
-                    ])
-    """
-    """
-    # nn_models3
-    main(correction=[
-                     [(16, 16, 2, 0, 0.25), [512]],
-                     [(64, 16, 2, 0, 0), [1024, 2048]],
-                     [(64, 64, 2, 0, 0.25), [4096]],
-                     [(64, 256, 2, 0, 0), [256, 1024, 2048, 4096]],
-                     [(64, 256, 2, 0, 0.25), [256, 512, 1024, 2048]],
-                     [(256, 16, 2, 0, 0.25), [256, 1024, 4096]],
-                     [(256, 64, 2, 0, 0.25), [1024, 4096]],
-                     [(256, 256, 2, 0, 0), [512, 4096]],
-                     [(256, 256, 2, 0, 0.25), [512, 2048, 4096]]
-                    ])
-    """
-    """
-    # nn_models3 v2
-    main(correction=[
-                     [(64, 256, 2, 0, 0.25), [512, 1024]],
-                     [(64, 64, 2, 0, 0), [1024, 2048]],
-                     [(64, 256, 2, 0, 0), [2048, 4096]],
-                     [(256, 16, 2, 0, 0.25), [4096]],
-                     [(256, 256, 2, 0, 0), [4096]]
-                    ])
-    """
-    """
-    # nn_models3 v3
-    main(correction=[
-                     [(64, 256, 2, 0, 0.25), [2048]],
-                     [(64, 64, 2, 0, 0), [1024, 2048]],
-                     [(64, 256, 2, 0, 0), [4096]],
-                     [(256, 16, 2, 0, 0.25), [1024]],
-                    ])
-    """
-    """
-    # nn_models3 v4
-    main(correction=[
-                     [(64, 16, 2, 0, 0), [2048]],
-                    ])
-    """